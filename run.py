@@ -1,13 +1,22 @@
 import asyncio
 from pathlib import Path
+from typing import List
 import click
 import datetime
+import json
 from dotenv import dotenv_values
 from loguru import logger
 
 from src.formatter import Formatter
 from src.differentiator import Differentiator
+from src.compactor import Compactor
+from src.runtime import Runtime
+from src.translation_memory import TextNormalizer
 from src.dumper import Dumper
+from src.revision_diff import RevisionDiff, load_line_flags
+from src.providers import PROVIDERS, RETIRED_PROVIDERS, create_provider
+from src.response_stream import MAX_THINK_CHARS
+from src.token_counter import DEFAULT_TOKENIZER
 from src.translator import Translator
 from src.downloader import Downloader
 
@@ -79,47 +88,193 @@ logger.add(
 _env = dotenv_values(".env")
 
 
-def UseDumper():
+async def UseDumper(runtime: Runtime):
     _dumper = Dumper()
-    _dumper.dump_sets()
-    _dumper.dump_variables()
+    await _dumper.dump_sets()
+    await _dumper.dump_variables()
 
 
-def UseDownloader(lang: str):
+async def UseDownloader(runtime: Runtime, lang: str):
     _downloader = Downloader(_env)
     logger.info(f"Downloading {lang} dicts")
     match lang:
         case "zh-hans" | "zh-Hans" | "zh-CN" | "zh-cn" | "cn":
-            result = _downloader.download_dol_zh_hans()
-            _downloader.extract_download(result, "dicts/translated/zh-Hans/")
+            result = await runtime.run_in_thread(_downloader.download_dol_zh_hans)
+            await runtime.run_in_thread(
+                _downloader.extract_download, result, "dicts/translated/zh-Hans/"
+            )
         case _:
             raise ValueError(f"Unsupported language: {lang}")
 
 
-def UseTranslator(input_files_path: Path, output_files_path: Path, resume: bool):
+async def UseTranslator(
+    runtime: Runtime,
+    input_files_path: Path,
+    output_files_path: Path,
+    resume: bool,
+    concurrency: int = 1,
+    batch_rows: int = 1,
+    batch_tokens: int = 2000,
+    cache_path: Path = None,
+    mask_markup: bool = False,
+    tokenizer: str = DEFAULT_TOKENIZER,
+    token_estimate: bool = False,
+    journal_path: Path = None,
+    provider: str = None,
+    provider_url: str = None,
+    model: str = None,
+    rpm: float = None,
+    tpm: float = None,
+    stream: bool = False,
+    max_response_ratio: float = 4.0,
+    max_think_chars: int = MAX_THINK_CHARS,
+):
+    client = None
+    if provider:
+        # requests of every stage share the pooled connections of the runtime
+        client = create_provider(
+            provider,
+            env=_env,
+            http=runtime.http_client,
+            base_url=provider_url,
+            rpm=rpm,
+            tpm=tpm,
+        )
+        model = model or PROVIDERS[provider].model
+        if not model:
+            raise ValueError(
+                f"Provider {provider} has no default model, use --mt-model"
+            )
     _translator = Translator(
+        model=model or "qwen3:8b",
         input_path=input_files_path,
         save=True,
         output_path=output_files_path,
+        concurrency=concurrency,
+        batch_rows=batch_rows,
+        batch_tokens=batch_tokens,
+        cache_path=cache_path,
+        mask_markup=mask_markup,
+        tokenizer=tokenizer,
+        token_estimate=token_estimate,
+        journal_path=journal_path,
+        client=client,
+        stream=stream,
+        max_response_ratio=max_response_ratio,
+        max_think_chars=max_think_chars,
     )
-    if resume:
-        _translator.resume_translate
-    else:
-        # start new run
-        _translator.search_and_translate()
+    try:
+        if concurrency > 1 or batch_rows > 1 or client is not None:
+            # concurrent requests and providers run on the event loop of the run
+            if resume:
+                await _translator.resume_translate_async()
+            else:
+                await _translator.search_and_translate_async()
+        elif resume:
+            await runtime.run_in_thread(_translator.resume_translate)
+        else:
+            # start new run
+            await runtime.run_in_thread(_translator.search_and_translate)
+        await runtime.run_in_thread(_translator.materialize)
+    finally:
+        _translator.close()
+        if client is not None:
+            client.limiter.log_stats()
 
 
-def UseFormatTranslates(format_translates: str):
+async def UseFormatTranslates(runtime: Runtime, format_translates: str):
     path_obj = Path(format_translates)
     _csv_helper = Formatter(path_obj)
-    _csv_helper.trim_csv_key()
-    _csv_helper.sort_csv()
+    await runtime.run_in_thread(_csv_helper.trim_csv_key)
+    await runtime.run_in_thread(_csv_helper.sort_csv)
+
+
+async def UseDiff(
+    runtime: Runtime,
+    translation_files_path: Path,
+    raw_files_path: Path,
+    diff_files_path: Path,
+    memory: bool = False,
+    memory_paths: List[Path] = None,
+    autofill: Path = None,
+    force: bool = False,
+    processes: bool = False,
+    normalize: bool = False,
+    near_match: Path = None,
+    segments: Path = None,
+    chunk_rows: int = None,
+    max_inflight_mb: int = None,
+):
+    differ = Differentiator(
+        translation_files_path,
+        raw_files_path,
+        diff_files_path,
+        translation_memory=memory,
+        memory_paths=memory_paths,
+        autofill_path=autofill,
+        force=force,
+        backend="process" if processes else "thread",
+        normalizer=TextNormalizer() if normalize else None,
+        near_match_path=near_match,
+        segment_path=segments,
+        chunk_rows=chunk_rows,
+        max_inflight_bytes=max_inflight_mb * 2**20 if max_inflight_mb else None,
+        runtime=runtime,
+    )
+    await differ.create_diff()
+    await differ.count_diff_rows()
+
+
+async def UseRevisionDiff(
+    runtime: Runtime,
+    repo_path: Path,
+    old_rev: str,
+    new_rev: str,
+    raw_files_path: Path,
+    delta_files_path: Path,
+    line_flags: str = None,
+):
+    # same file lists as the full dump, when they exist
+    lists = {}
+    for name in ("blacklist", "whitelist"):
+        list_file = Path(f"dicts/{name}s.json")
+        if list_file.is_file():
+            with open(list_file, "r", encoding="utf-8") as fp:
+                lists[name] = json.load(fp)[name]
+    differ = RevisionDiff(
+        repo_path,
+        old_rev,
+        new_rev,
+        raw_files_path,
+        delta_files_path,
+        line_flags=load_line_flags(line_flags) if line_flags else None,
+        **lists,
+    )
+    await differ.create_delta()
+
+
+async def UseCompactor(
+    runtime: Runtime,
+    translation_files_path: Path,
+    raw_files_path: Path,
+    archive_file: Path,
+    compacted_files_path: Path = None,
+):
+    compactor = Compactor(
+        translation_files_path,
+        raw_files_path,
+        archive_file,
+        compacted_files_path,
+        runtime=runtime,
+    )
+    await compactor.compact()
 
 
-def UseDiff(translation_files_path: Path, raw_files_path: Path, diff_files_path: Path):
-    differ = Differentiator(translation_files_path, raw_files_path, diff_files_path)
-    asyncio.run(differ.create_diff())
-    asyncio.run(differ.count_diff_rows())
+def _check_provider(ctx, param, value: str):
+    # fail before any stage runs rather than when the translator is created
+    if value in RETIRED_PROVIDERS:
+        raise click.BadParameter(RETIRED_PROVIDERS[value])
+    return value
 
 
 @click.command(context_settings=dict(help_option_names=["-h", "--help"]))
@@ -141,9 +296,104 @@ def UseDiff(translation_files_path: Path, raw_files_path: Path, diff_files_path:
     "--format-translates",
     help="Format the translated file, basically made for chaotic zh-hans translation files, need to provide the path of translated dicts.",
 )
+@click.option(
+    "--mt-concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Rows translated at the same time, set it to the parallel slots of the Ollama server (OLLAMA_NUM_PARALLEL).",
+)
+@click.option(
+    "--mt-batch-rows",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Rows packed into one request, they share one copy of the prompt.",
+)
+@click.option(
+    "--mt-batch-tokens",
+    type=click.IntRange(min=1),
+    default=2000,
+    help="Token budget of the rows of one batched request.",
+)
+@click.option(
+    "--mt-cache",
+    type=click.Path(file_okay=True, dir_okay=False),
+    default="dicts/mt_cache.sqlite3",
+    show_default=True,
+    help="SQLite cache of machine translations, repeated strings are translated once per model and prompt.",
+)
+@click.option(
+    "--no-mt-cache",
+    is_flag=True,
+    default=False,
+    help="Send every row to the model, without reading or filling the translation cache.",
+)
+@click.option(
+    "--mt-mask-markup",
+    is_flag=True,
+    default=False,
+    help="Send macros, tags, variables and link targets as short placeholders and restore them in the translation.",
+)
+@click.option(
+    "--mt-tokenizer",
+    default=DEFAULT_TOKENIZER,
+    show_default=True,
+    help="Tokenizer for the token budget, a Hugging Face model name or a local tokenizer directory (loads offline).",
+)
+@click.option(
+    "--mt-token-estimate",
+    is_flag=True,
+    default=False,
+    help="Estimate tokens from characters instead of loading a tokenizer.",
+)
+@click.option(
+    "--mt-journal",
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="Append finished rows to this JSONL journal and write the translated CSVs from it at the end of the run, resume reads only the journal tail.",
+)
+@click.option(
+    "--mt-stream/--no-mt-stream",
+    default=False,
+    show_default=True,
+    help="Read answers as they are generated, drop thinking on the way and stop runaway answers early.",
+)
+@click.option(
+    "--mt-max-response-ratio",
+    type=click.FloatRange(min=0, min_open=True),
+    default=4.0,
+    show_default=True,
+    help="Streamed answers longer than this many times their source text, thinking excluded, are cut off and their rows left untranslated.",
+)
+@click.option(
+    "--mt-max-think-chars",
+    type=click.IntRange(min=1),
+    default=MAX_THINK_CHARS,
+    show_default=True,
+    help="Streamed answers thinking longer than this many chars are cut off and their rows left untranslated.",
+)
 @click.option(
     "--provider",
-    help="LLM provider (Available: cursor, gemini, gpt, deepseek [API,local], X-ALMA [Local]).",
+    type=click.Choice(list(PROVIDERS) + list(RETIRED_PROVIDERS)),
+    callback=_check_provider,
+    help="LLM provider of the machine translation, API keys are read from .env. openai is any OpenAI-compatible server, "
+    "see --provider-url. Defaults to the local Ollama client. cursor and X-ALMA are no longer supported.",
+)
+@click.option(
+    "--provider-url",
+    help="API root of the provider, eg: http://127.0.0.1:8000/v1 for a local OpenAI-compatible server.",
+)
+@click.option(
+    "--provider-rpm",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Requests per minute allowed by the provider, overrides its default limit.",
+)
+@click.option(
+    "--provider-tpm",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Tokens per minute allowed by the provider, overrides its default limit.",
+)
+@click.option(
+    "--mt-model",
+    help="Model of the machine translation, defaults to qwen3:8b or the default model of the provider.",
 )
 @click.option(
     "--local",
@@ -160,6 +410,94 @@ def UseDiff(translation_files_path: Path, raw_files_path: Path, diff_files_path:
     type=click.Path(exists=True, file_okay=False, dir_okay=True),
     help="Create diff files between raw and translated dicts. Usage: --diff <translation_path> <raw_path> <diff_path>",
 )
+@click.option(
+    "--revision-diff",
+    nargs=5,
+    type=str,
+    help="Diff only the game files changed between two git revisions. Usage: --revision-diff <game_repo> <old_rev> <new_rev> <raw_path> <delta_path>. "
+    "Without --revision-line-flags .twee lines are picked by a heuristic, not the raw dict extraction rules, "
+    "so the delta may differ from a full dump.",
+)
+@click.option(
+    "--revision-line-flags",
+    help="Extraction rule of --revision-diff as module:function, called with (file path, lines) and returning a flag per line, eg: the ParseTwee/ParseJS rules of the full dump.",
+)
+@click.option(
+    "--compact",
+    type=click.Tuple(
+        [
+            click.Path(exists=True, file_okay=False, dir_okay=True),
+            click.Path(exists=True, file_okay=False, dir_okay=True),
+            click.Path(file_okay=True, dir_okay=False),
+        ]
+    ),
+    help="Move translated rows whose english is not in the raw dicts to an archive translation memory. Usage: --compact <translation_path> <raw_path> <archive_file>",
+)
+@click.option(
+    "--compact-output",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Write the compacted dicts to this directory instead of replacing the translated dicts.",
+)
+@click.option(
+    "--diff-memory",
+    is_flag=True,
+    default=False,
+    help="Use every translated file as translation memory, strings translated in any file are moved from the diff to --diff-autofill, without it they stay in the diff.",
+)
+@click.option(
+    "--memory-path",
+    multiple=True,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Extra translated dicts for the translation memory, eg. DoL translations when diffing DoLP, turns on --diff-memory. Can be repeated.",
+)
+@click.option(
+    "--diff-autofill",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Write the rows carried over by --diff-memory or --diff-normalize to this directory, same layout as the diff. Does not turn either on.",
+)
+@click.option(
+    "--diff-force",
+    is_flag=True,
+    default=False,
+    help="Recompute every diff file, even if the diff manifest has it unchanged.",
+)
+@click.option(
+    "--diff-processes",
+    is_flag=True,
+    default=False,
+    help="Diff files in worker processes instead of threads, uses every core for the pandas work.",
+)
+@click.option(
+    "--diff-workers",
+    type=int,
+    help="Number of diff workers, defaults to the number of cores.",
+)
+@click.option(
+    "--diff-normalize",
+    is_flag=True,
+    default=False,
+    help="Match english texts ignoring whitespace, doubled quotes and BOMs, translations of such rows are moved from the diff to --diff-autofill, without it they stay in the diff.",
+)
+@click.option(
+    "--diff-near-match",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Classify diff rows as new or changed and write them with the old translation of changed rows to this directory.",
+)
+@click.option(
+    "--diff-segments",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Diff partly changed passages per sentence, their changed segments and alignment go to this directory. The passages stay in the diff, segment translations are not merged back yet.",
+)
+@click.option(
+    "--diff-chunk-rows",
+    type=click.IntRange(min=1),
+    help="Read raw files this many rows at a time, for very large dicts.",
+)
+@click.option(
+    "--diff-max-inflight-mb",
+    type=click.IntRange(min=1),
+    help="Diff only as many files at once as fit in this many MB of CSV data.",
+)
 @click.option(
     "--download",
     help="Download the translated dicts. Usage: --download <language code>, eg. --download zh-hans",
@@ -170,10 +508,41 @@ def ClickHelper(
     dump: bool,
     translate: tuple,
     format_translates: str,
+    mt_concurrency: int,
+    mt_batch_rows: int,
+    mt_batch_tokens: int,
+    mt_cache: str,
+    no_mt_cache: bool,
+    mt_mask_markup: bool,
+    mt_tokenizer: str,
+    mt_token_estimate: bool,
+    mt_journal: str,
+    mt_stream: bool,
+    mt_max_response_ratio: float,
+    mt_max_think_chars: int,
     provider: str,
+    provider_url: str,
+    provider_rpm: float,
+    provider_tpm: float,
+    mt_model: str,
     local: bool,
     full: bool,
     diff: tuple,
+    revision_diff: tuple,
+    revision_line_flags: str,
+    compact: tuple,
+    compact_output: str,
+    diff_memory: bool,
+    memory_path: tuple,
+    diff_autofill: str,
+    diff_force: bool,
+    diff_processes: bool,
+    diff_workers: int,
+    diff_normalize: bool,
+    diff_near_match: str,
+    diff_segments: str,
+    diff_chunk_rows: int,
+    diff_max_inflight_mb: int,
     resume: bool,
     download: str,
 ):
@@ -183,20 +552,108 @@ def ClickHelper(
     Run without arguments to show this help message.
     """
 
+    # (stage name, coroutine function, arguments) in pipeline order
+    stages = []
     if dump:
-        UseDumper()
+        stages.append(("Dump", UseDumper, ()))
     if translate:
         input_files_path, output_files_path = map(Path, translate)
-        UseTranslator(input_files_path, output_files_path, resume)
+        stages.append(
+            (
+                "Translate",
+                UseTranslator,
+                (
+                    input_files_path,
+                    output_files_path,
+                    resume,
+                    mt_concurrency,
+                    mt_batch_rows,
+                    mt_batch_tokens,
+                    None if no_mt_cache else Path(mt_cache),
+                    mt_mask_markup,
+                    mt_tokenizer,
+                    mt_token_estimate,
+                    Path(mt_journal) if mt_journal else None,
+                    provider,
+                    provider_url,
+                    mt_model,
+                    provider_rpm,
+                    provider_tpm,
+                    mt_stream,
+                    mt_max_response_ratio,
+                    mt_max_think_chars,
+                ),
+            )
+        )
     if format_translates:
-        UseFormatTranslates(format_translates)
+        stages.append(("Format", UseFormatTranslates, (format_translates,)))
     if diff:
         translation_files_path, raw_files_path, diff_files_path = map(Path, diff)
-        UseDiff(translation_files_path, raw_files_path, diff_files_path)
+        stages.append(
+            (
+                "Diff",
+                UseDiff,
+                (
+                    translation_files_path,
+                    raw_files_path,
+                    diff_files_path,
+                    diff_memory or bool(memory_path),
+                    [Path(p) for p in memory_path],
+                    Path(diff_autofill) if diff_autofill else None,
+                    diff_force,
+                    diff_processes,
+                    diff_normalize,
+                    Path(diff_near_match) if diff_near_match else None,
+                    Path(diff_segments) if diff_segments else None,
+                    diff_chunk_rows,
+                    diff_max_inflight_mb,
+                ),
+            )
+        )
+    if revision_diff:
+        repo_path, old_rev, new_rev, raw_files_path, delta_files_path = revision_diff
+        stages.append(
+            (
+                "Revision diff",
+                UseRevisionDiff,
+                (
+                    Path(repo_path),
+                    old_rev,
+                    new_rev,
+                    Path(raw_files_path),
+                    Path(delta_files_path),
+                    revision_line_flags,
+                ),
+            )
+        )
+    if compact:
+        translation_files_path, raw_files_path, archive_file = map(Path, compact)
+        stages.append(
+            (
+                "Compact",
+                UseCompactor,
+                (
+                    translation_files_path,
+                    raw_files_path,
+                    archive_file,
+                    Path(compact_output) if compact_output else None,
+                ),
+            )
+        )
     if download:
-        UseDownloader(download)
-    else:
+        stages.append(("Download", UseDownloader, (download,)))
+
+    if not stages:
         click.echo(ctx.get_help())
+        return
+
+    async def main(runtime: Runtime):
+        for name, stage, args in stages:
+            async with runtime.stage(name):
+                await stage(runtime, *args)
+
+    # one event loop and one set of pools for every stage of the run
+    Runtime(max_workers=diff_workers, max_processes=diff_workers).run(main)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+import asyncio
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from .differentiator import Differentiator
+from .io_helper import IOHelper
+from .runtime import Runtime
+
+"""
+    Compactor removes obsolete rows from translated dicts, rows whose english is not in the raw dict of the file any more.
+    Obsolete rows with a translation are moved to an archive CSV in the translated format,
+    put its directory in the --memory-path list and the translations are still reused by the diff.
+"""
+
+
+class CompactionResult(NamedTuple):
+    path: Path  # relative to the translated dicts
+    rows: int
+    obsolete_rows: int
+    archived_rows: int  # obsolete rows with a translation, written to the archive
+    bytes_before: int
+    bytes_after: int
+
+
+class Compactor:
+    """
+    Args:
+        translation_files_path: translated dicts
+        raw_files_path: raw dicts the translated dicts are compared to
+        archive_file: CSV the obsolete translations are appended to, id column is "<file>:<id>"
+        compacted_files_path: output of the compacted dicts, None replaces the translated dicts in place
+        max_workers: worker threads, defaults to the number of cores
+        runtime: shared pools of a CLI run, max_workers is ignored when given
+    """
+
+    def __init__(
+        self,
+        translation_files_path: Path,
+        raw_files_path: Path,
+        archive_file: Path,
+        compacted_files_path: Optional[Path] = None,
+        max_workers: int = None,
+        runtime: Optional[Runtime] = None,
+    ):
+        self._io_helper = IOHelper()
+        self._translation_files_path = Path(translation_files_path)
+        self._raw_files_path = Path(raw_files_path)
+        self._archive_file = Path(archive_file)
+        self._compacted_files_path = (
+            Path(compacted_files_path) if compacted_files_path is not None else None
+        )
+        self._max_workers = max_workers or os.cpu_count()
+        self._runtime = runtime
+        self._results: List[CompactionResult] = []
+
+    @property
+    def results(self) -> List[CompactionResult]:
+        return self._results
+
+    async def compact(self) -> List[CompactionResult]:
+        """Compact every translated dict, obsolete rows are archived in file order"""
+        translated_files = sorted(self._translation_files_path.rglob("*.csv"))
+        loop = asyncio.get_running_loop()
+        with (
+            nullcontext(self._runtime.executor)
+            if self._runtime is not None
+            else ThreadPoolExecutor(max_workers=self._max_workers)
+        ) as executor:
+            outcomes = await asyncio.gather(
+                *(
+                    loop.run_in_executor(executor, self._compact_file, file_path)
+                    for file_path in translated_files
+                )
+            )
+
+        # one writer for the archive, appended so earlier compactions are kept
+        archived = [row for _, rows in outcomes if rows for row in rows]
+        if archived:
+            self._io_helper.append_csv(self._archive_file, archived)
+
+        self._results = [result for result, _ in outcomes if result is not None]
+        rows = sum(result.obsolete_rows for result in self._results)
+        saved = sum(
+            result.bytes_before - result.bytes_after for result in self._results
+        )
+        changed = sum(1 for result in self._results if result.obsolete_rows)
+        logger.info(
+            f"Removed {rows} obsolete rows from {changed} of {len(self._results)} files, "
+            f"{saved / 2**20:.2f} MiB saved, {len(archived)} translations archived to {self._archive_file}"
+        )
+        return self._results
+
+    def _compact_file(self, translated_file: Path):
+        """(CompactionResult, archive rows) of one translated dict, (None, None) if it fails"""
+        try:
+            return self._compact_rows(translated_file)
+        except Exception as e:
+            logger.error(f"Error compacting {translated_file}: {e}")
+            return None, None
+
+    def _compact_rows(self, translated_file: Path):
+        relative_path = translated_file.relative_to(self._translation_files_path)
+        # the dict may be rewritten, undecodable bytes must fail the file instead of being dropped
+        rows, ok = self._io_helper.read_csv(translated_file, errors="strict")
+        if not ok:
+            logger.warning(f"Skipping {relative_path}, it could not be read")
+            return None, None
+
+        raw_file = self._raw_files_path / relative_path
+        if raw_file.is_file():
+            raw_rows, raw_ok = self._io_helper.read_csv(raw_file)
+            if not raw_ok:
+                return None, None
+            # rows without an english column are kept as they are
+            english = pd.Series(
+                [row[1] if len(row) > 1 else None for row in rows], dtype=object
+            )
+            raw_english = pd.Series(
+                [row[1] for row in raw_rows if len(row) > 1], dtype=object
+            )
+            obsolete = Differentiator.hash_diff_mask(english, raw_english) & (
+                english.notna().to_numpy()
+            )
+        else:
+            # a missing raw dict is more likely a wrong raw path than a removed file
+            logger.warning(f"No raw dict for {relative_path}, keeping it as it is")
+            obsolete = np.zeros(len(rows), dtype=bool)
+
+        kept = [row for row, drop in zip(rows, obsolete) if not drop]
+        archive = [
+            [f"{relative_path.as_posix()}:{row[0]}", row[1], row[2]]
+            for row, drop in zip(rows, obsolete)
+            if drop and len(row) > 2 and row[2].strip()
+        ]
+
+        bytes_before = translated_file.stat().st_size
+        output_file = (
+            translated_file
+            if self._compacted_files_path is None
+            else self._compacted_files_path / relative_path
+        )
+        if obsolete.any() or output_file != translated_file:
+            self._write_atomic(output_file, kept)
+        if not kept and output_file != translated_file:
+            # nothing left of the dict, the translated dicts themselves are never deleted
+            output_file.unlink(missing_ok=True)
+        bytes_after = output_file.stat().st_size if output_file.exists() else 0
+
+        return (
+            CompactionResult(
+                relative_path,
+                len(rows),
+                int(obsolete.sum()),
+                len(archive),
+                bytes_before,
+                bytes_after,
+            ),
+            archive,
+        )
+
+    def _write_atomic(self, file_path: Path, rows: List[List[str]]) -> None:
+        # write then rename, an interrupted run never leaves a half written dict
+        self._io_helper.ensure_dir_exists(file_path.parent)
+        tmp_file = file_path.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8", newline="") as fp:
+            # same line ending as the dicts written by pandas, untouched rows stay byte-identical
+            csv.writer(fp, lineterminator="\n").writerows(rows)
+        os.replace(tmp_file, file_path)
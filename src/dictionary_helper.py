@@ -1,9 +1,11 @@
 import json
 import os
 from pathlib import Path
+from typing import Dict, List
 
 from loguru import logger
 from src.io_helper import IOHelper
+from src.js_parser import JSLiteral, JSParser
 
 
 class DictionaryHelper:
@@ -34,3 +36,21 @@ class DictionaryHelper:
                     filecount += 1
 
         logger.info(f"##### 共获取 {filecount} 个文本文件位置 !\n")
+
+    def parse_whitelisted_js(self) -> Dict[Path, List[JSLiteral]]:
+        """Tokenise every whitelisted .js file once and collect its translatable literals"""
+        if not hasattr(self, "preprocess_files_list"):
+            self.get_preprocess_files_list()
+
+        results = {}
+        for file in self.preprocess_files_list:
+            if file.suffix != ".js":
+                continue
+            try:
+                results[file] = JSParser.from_file(file).parse()
+            except (IOError, UnicodeDecodeError) as e:
+                logger.error(f"Failed to parse {file}: {e}")
+
+        literal_count = sum(len(literals) for literals in results.values())
+        logger.info(f"##### 共提取 {literal_count} 个 JS 字符串 !\n")
+        return results
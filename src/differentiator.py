@@ -1,13 +1,43 @@
 from loguru import logger
+import numpy as np
 import pandas as pd
+from pandas.util import hash_array
 from pathlib import Path
 import csv
+import hashlib
+import json
 import shutil
 import asyncio
 import os
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Optional, Any, Callable
+import multiprocessing
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, NamedTuple, Optional, Any, Callable, Tuple
 from .io_helper import IOHelper
+from .runtime import Runtime
+from .near_match import NearMatch, NearMatchIndex
+from .segmenter import SegmentChange, diff_segments
+from .translation_memory import TextNormalizer, TranslationMemory, hash_lookup
+
+# fast csv engines, pyarrow is optional
+try:
+    import pyarrow  # noqa: F401
+
+    FAST_CSV_ENGINES = ["pyarrow", "c"]
+except ImportError:
+    FAST_CSV_ENGINES = ["c"]
+
+MANIFEST_NAME = ".diff-manifest.json"
+MANIFEST_VERSION = 1
+
+DIFF_BACKENDS = ("thread", "process")
+
+# estimated bytes of a raw row, sizes one raw chunk for the in-flight budget
+CHUNK_ROW_BYTES = 256
+
+# alignment of the segment rows, next to the segment CSV of a file
+ALIGNMENT_SUFFIX = ".alignment.json"
 
 """
     Differentiator use for creating translations different files.
@@ -23,15 +53,86 @@ class Differentiator:
         raw_files_path: Path,
         diff_files_path: Path,
         max_workers: int = None,
+        backend: str = "thread",
+        translation_memory: bool = False,
+        memory_paths: Optional[List[Path]] = None,
+        autofill_path: Optional[Path] = None,
+        manifest: bool = True,
+        force: bool = False,
+        normalizer: Optional[TextNormalizer] = None,
+        near_match_path: Optional[Path] = None,
+        near_match_threshold: float = 0.7,
+        segment_path: Optional[Path] = None,
+        segment_threshold: float = 0.5,
+        chunk_rows: Optional[int] = None,
+        max_inflight_bytes: Optional[int] = None,
+        runtime: Optional[Runtime] = None,
     ):
         self._io_helper = IOHelper()
         self._translation_files_path = translation_files_path
         self._raw_files_path = raw_files_path
         self._diff_files_path = diff_files_path
 
+        # pools of the runtime are shared with the other stages, without a runtime the differ owns its pools
+        self._runtime = runtime
         # use core threads as worker number
-        self._max_workers = max_workers or os.cpu_count()
-        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._max_workers = max_workers or (
+            runtime.max_workers if runtime else os.cpu_count()
+        )
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # "thread" shares the translation memory for free, "process" bypasses the GIL for the pandas work
+        if backend not in DIFF_BACKENDS:
+            raise ValueError(
+                f"Unknown diff backend: {backend}, expected one of {DIFF_BACKENDS}"
+            )
+        self._backend = backend
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._worker_state: Optional[str] = None
+
+        self._csv_fallback_files: List[Path] = []
+
+        # carried over rows leave the diff only when they are written to the autofill path
+        if autofill_path is None and (translation_memory or normalizer is not None):
+            logger.warning(
+                "No autofill path set, rows with a known translation stay in the diff"
+            )
+            translation_memory, normalizer = False, None
+        # global english -> translation index, built once per run by create_diff
+        self._use_translation_memory = translation_memory
+        self._memory_paths = memory_paths or []
+        self._autofill_path = autofill_path
+        self._translation_memory: Optional[TranslationMemory] = None
+        self._memory_filled: List[Tuple[Path, int]] = []
+
+        # rows of the same file matched on normalised keys, eg: only whitespace or quoting changed
+        self._normalizer = normalizer
+        self._normalized_saved: List[Tuple[Path, int]] = []
+
+        # diff rows classified as new or changed against the translated file, written next to the diff
+        self._near_match_path = near_match_path
+        self._near_match_threshold = near_match_threshold
+        self._near_changed: List[Tuple[Path, int]] = []
+
+        # passages with only some changed sentences are diffed per segment, written to segment_path
+        self._segment_path = segment_path
+        self._segment_threshold = segment_threshold
+        self._segmented: List[Tuple[Path, int, int, int]] = []
+
+        # raw files are read chunk_rows rows at a time, the translated file is indexed once per pair.
+        # the output is the same as without chunks, so it is not a manifest option
+        if chunk_rows is not None and chunk_rows < 1:
+            raise ValueError(f"chunk_rows must be positive, got {chunk_rows}")
+        self._chunk_rows = chunk_rows
+        # csv bytes of the pairs diffed at the same time, a pair larger than the budget runs alone
+        self._max_inflight_bytes = max_inflight_bytes
+        self._budget: Optional[_ByteBudget] = None
+
+        # hashes of the inputs and outputs of every pair, unchanged pairs are skipped on the next run
+        self._use_manifest = manifest
+        self._force = force
+        self._reused_files: List[Path] = []
+        self._recomputed_files: List[Path] = []
 
     async def create_diff(self):
         """Processes all CSV files in the raw directory and compares them to translated files asynchronously."""
@@ -40,7 +141,9 @@ class Differentiator:
         raw_base = Path(self._raw_files_path)
         diff_base = Path(self._diff_files_path)
 
-        logger.debug(f"Starting diff process with {self._max_workers} workers...")
+        logger.debug(
+            f"Starting diff process with {self._max_workers} {self._backend} workers..."
+        )
         logger.debug(f"Raw directory: {raw_base}")
         logger.debug(f"Translated directory: {translated_base}")
         logger.debug(f"Diff output directory: {diff_base}")
@@ -50,29 +153,286 @@ class Differentiator:
         total_files = len(raw_files)
         logger.debug(f"Found {total_files} CSV files to process")
 
+        # hash every input once, pairs unchanged since the last run are reused from the manifest
+        memory_files = self._memory_files() if self._use_translation_memory else []
+        pairs = [(raw_file, raw_file.relative_to(raw_base)) for raw_file in raw_files]
+        hashes = (
+            await self._hash_files(
+                [raw_file for raw_file, _ in pairs]
+                + [translated_base / relative_path for _, relative_path in pairs]
+                + [diff_base / relative_path for _, relative_path in pairs]
+                + [file_path for _, file_path in memory_files]
+            )
+            if self._use_manifest
+            else {}
+        )
+        options = {
+            "translation_memory": self._use_translation_memory,
+            "memory": (
+                self._combined_hash(
+                    [
+                        (file_path.relative_to(base).as_posix(), hashes.get(file_path))
+                        for base, file_path in memory_files
+                    ]
+                )
+                if self._use_translation_memory
+                else None
+            ),
+            "normalizer": repr(self._normalizer) if self._normalizer else None,
+            "autofill_path": (
+                Path(self._autofill_path).as_posix() if self._autofill_path else None
+            ),
+            "near_match_path": (
+                Path(self._near_match_path).as_posix()
+                if self._near_match_path
+                else None
+            ),
+            "near_match_threshold": self._near_match_threshold,
+            "segment_path": (
+                Path(self._segment_path).as_posix() if self._segment_path else None
+            ),
+            "segment_threshold": self._segment_threshold,
+        }
+        previous = (
+            self._load_manifest(diff_base)
+            if self._use_manifest and not self._force
+            else {}
+        )
+        previous_files = (
+            previous.get("files", {}) if previous.get("options") == options else {}
+        )
+
         # create task list
         tasks = []
-        for raw_file in raw_files:
+        manifest_files = {}
+        recomputed = []
+        for raw_file, relative_path in pairs:
             # Get the relative path of the raw file for logger, debug usage
-            relative_path = raw_file.relative_to(raw_base)
             translated_file = translated_base / relative_path
             diff_file = diff_base / relative_path
+            key = relative_path.as_posix()
+            entry = {
+                "raw": hashes.get(raw_file),
+                "translated": hashes.get(translated_file),
+                "diff": hashes.get(diff_file),
+            }
 
+            if previous_files.get(key) == entry:
+                manifest_files[key] = entry
+                self._reused_files.append(relative_path)
+                continue
+
+            self._recomputed_files.append(relative_path)
+            recomputed.append((key, raw_file, translated_file, diff_file))
             tasks.append(
                 self.diff_single_csv(
                     raw_file, translated_file, diff_file, relative_path
                 )
             )
 
-        results = await asyncio.gather(*tasks)
+        if tasks and self._use_translation_memory:
+            await self.build_translation_memory(memory_files)
+
+        if tasks and self._max_inflight_bytes is not None:
+            self._budget = _ByteBudget(self._max_inflight_bytes)
+
+        own_pool = None
+        if tasks and self._backend == "process":
+            # workers load the translation memory once per run from the state file, then only paths per file
+            self._worker_state = await self._run_in_executor(self._save_worker_state)
+            if self._runtime is not None:
+                self._process_pool = self._runtime.process_pool
+            else:
+                own_pool = self._process_pool = ProcessPoolExecutor(
+                    max_workers=self._max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            self._budget = None
+            self._process_pool = None
+            if own_pool is not None:
+                own_pool.shutdown()
+            if self._worker_state is not None:
+                os.unlink(self._worker_state)
+                self._worker_state = None
+
+        if self._use_manifest:
+            # record the outputs of the recomputed pairs, failed pairs are retried next run
+            diff_hashes = await self._hash_files(
+                [diff_file for _, _, _, diff_file in recomputed]
+            )
+            for (key, raw_file, translated_file, diff_file), result in zip(
+                recomputed, results
+            ):
+                if result:
+                    manifest_files[key] = {
+                        "raw": hashes[raw_file],
+                        "translated": hashes[translated_file],
+                        "diff": diff_hashes[diff_file],
+                    }
+            self._save_manifest(
+                diff_base, {"options": options, "files": manifest_files}
+            )
 
         # count successfully processed files
-        processed_files = sum(1 for r in results if r)
+        reused_count = total_files - len(tasks)
+        processed_files = reused_count + sum(1 for r in results if r)
         logger.info(
-            f"\nDiff process finished. Successfully processed {processed_files}/{total_files} files."
+            f"\nDiff process finished. Successfully processed {processed_files}/{total_files} files "
+            f"({reused_count} reused from manifest, {len(tasks)} recomputed)."
         )
+        if self._csv_fallback_files:
+            logger.warning(
+                f"{len(self._csv_fallback_files)} files needed the python csv engine: "
+                + ", ".join(str(f) for f in self._csv_fallback_files)
+            )
+        if self._normalized_saved:
+            logger.info(
+                f"{sum(count for _, count in self._normalized_saved)} rows in {len(self._normalized_saved)} files "
+                "only changed in whitespace or quoting, their translations were carried over"
+            )
+        if self._near_changed:
+            logger.info(
+                f"{sum(count for _, count in self._near_changed)} diff rows in {len(self._near_changed)} files "
+                "are edits of an existing row, see the near match files for their old translations"
+            )
+        if self._segmented:
+            full_chars = sum(full for _, _, full, _ in self._segmented)
+            sent_chars = sum(sent for _, _, _, sent in self._segmented)
+            logger.info(
+                f"{sum(rows for _, rows, _, _ in self._segmented)} partly changed passages diffed by segment, "
+                f"{sent_chars} of their {full_chars} chars changed, see the segment files"
+            )
+        if self._memory_filled:
+            logger.info(
+                f"{sum(count for _, count in self._memory_filled)} rows in {len(self._memory_filled)} files "
+                "were found in other translated files and left out of the diff"
+            )
         return processed_files
 
+    def _memory_files(self) -> List[Tuple[Path, Path]]:
+        """(base, file) of every translated file indexed by the translation memory"""
+        bases = [Path(self._translation_files_path)] + [
+            Path(p) for p in self._memory_paths
+        ]
+        return [
+            (base, file_path)
+            for base in bases
+            for file_path in sorted(base.rglob("*.csv"))
+        ]
+
+    async def build_translation_memory(
+        self, memory_files: Optional[List[Tuple[Path, Path]]] = None
+    ) -> TranslationMemory:
+        """Index every translated file of the translation path and the extra memory paths"""
+        if memory_files is None:
+            memory_files = self._memory_files()
+        loads = [
+            self._run_in_executor(
+                self._load_csv_to_dataframe,
+                file_path,
+                None,
+                file_path.relative_to(base),
+                "memory",
+            )
+            for base, file_path in memory_files
+        ]
+        frames = await asyncio.gather(*loads)
+        self._translation_memory = await self._run_in_executor(
+            TranslationMemory(self._normalizer).build, frames
+        )
+        logger.info(
+            f"Translation memory: {len(self._translation_memory)} unique strings from {len(frames)} files"
+        )
+        return self._translation_memory
+
+    @property
+    def reused_files(self) -> List[Path]:
+        """Pairs skipped because the manifest has them unchanged"""
+        return self._reused_files
+
+    @property
+    def recomputed_files(self) -> List[Path]:
+        return self._recomputed_files
+
+    @property
+    def normalized_saved(self) -> List[Tuple[Path, int]]:
+        """(relative path, rows) of the raw rows matched only by their normalised key"""
+        return self._normalized_saved
+
+    @property
+    def near_changed(self) -> List[Tuple[Path, int]]:
+        """(relative path, rows) of the diff rows which are edits of an existing row"""
+        return self._near_changed
+
+    def _worker_options(self) -> Dict[str, Any]:
+        """Constructor options a process pool worker needs for _diff_pair"""
+        return {
+            "autofill_path": self._autofill_path,
+            "normalizer": self._normalizer,
+            "near_match_path": self._near_match_path,
+            "near_match_threshold": self._near_match_threshold,
+            "segment_path": self._segment_path,
+            "segment_threshold": self._segment_threshold,
+            "chunk_rows": self._chunk_rows,
+        }
+
+    @property
+    def segmented(self) -> List[Tuple[Path, int, int, int]]:
+        """(relative path, passages, chars of the passages, chars of their changed segments)"""
+        return self._segmented
+
+    @property
+    def memory_filled(self) -> List[Tuple[Path, int]]:
+        """(relative path, rows) of the raw rows left out of the diff because the memory has them"""
+        return self._memory_filled
+
+    async def _hash_files(self, files: List[Path]) -> Dict[Path, Optional[str]]:
+        """Content hash of every file, None for missing files"""
+        files = list(dict.fromkeys(files))
+        hashes = await asyncio.gather(
+            *(self._run_in_executor(self._io_helper.file_hash, f) for f in files)
+        )
+        return dict(zip(files, hashes))
+
+    @staticmethod
+    def _combined_hash(entries: List[Tuple[str, Optional[str]]]) -> str:
+        """One hash over (name, hash) entries, eg: all files of the translation memory"""
+        digest = hashlib.blake2b(digest_size=16)
+        for name, file_hash in entries:
+            digest.update(f"{name}\0{file_hash}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _load_manifest(self, diff_base: Path) -> Dict[str, Any]:
+        manifest_file = diff_base / MANIFEST_NAME
+        try:
+            with open(manifest_file, "r", encoding="utf-8") as fp:
+                manifest = json.load(fp)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable diff manifest {manifest_file}: {e}")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest
+
+    def _save_manifest(self, diff_base: Path, manifest: Dict[str, Any]) -> None:
+        self._io_helper.ensure_dir_exists(diff_base)
+        manifest_file = diff_base / MANIFEST_NAME
+        # write then rename, an interrupted run never leaves a half written manifest
+        tmp_file = manifest_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as fp:
+            json.dump(
+                {"version": MANIFEST_VERSION, **manifest},
+                fp,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp_file, manifest_file)
+
     async def diff_single_csv(
         self,
         raw_file: Path,
@@ -82,99 +442,189 @@ class Differentiator:
     ):
         """Compares a single raw CSV file with its translated counterpart and writes the diff asynchronously."""
         try:
-            # Check if translated file exists
-            if not translated_file.is_file():
-                logger.info(
-                    f"Translated file not found for {relative_path}. Copying raw file to diff."
+            if self._budget is None:
+                return await self._dispatch_pair(
+                    raw_file, translated_file, diff_file, relative_path
                 )
-                self._io_helper.ensure_dir_exists(diff_file.parent)
-                return await self._run_in_executor(shutil.copy2, raw_file, diff_file)
+            cost = self._pair_cost(raw_file, translated_file)
+            await self._budget.acquire(cost)
+            try:
+                return await self._dispatch_pair(
+                    raw_file, translated_file, diff_file, relative_path
+                )
+            finally:
+                await self._budget.release(cost)
 
+        except Exception as e:
+            logger.error(f"Unexpected error processing {relative_path}: {e}")
+            return False
+
+    async def _dispatch_pair(
+        self,
+        raw_file: Path,
+        translated_file: Path,
+        diff_file: Path,
+        relative_path: Path,
+    ) -> bool:
+        if self._process_pool is None:
             # run pandas operation in thread pool
             return await self._run_in_executor(
-                self._process_csv_files,
+                self._diff_pair,
                 raw_file,
                 translated_file,
                 diff_file,
                 relative_path,
             )
 
+        # only paths go to the worker process, only a compact result comes back
+        loop = asyncio.get_running_loop()
+        result: DiffResult = await loop.run_in_executor(
+            self._process_pool,
+            _diff_in_worker,
+            self._worker_state,
+            raw_file,
+            translated_file,
+            diff_file,
+            relative_path,
+        )
+        self._csv_fallback_files.extend(result.csv_fallback_files)
+        if result.memory_filled:
+            self._memory_filled.append((relative_path, result.memory_filled))
+        if result.normalized_saved:
+            self._normalized_saved.append((relative_path, result.normalized_saved))
+        if result.near_changed:
+            self._near_changed.append((relative_path, result.near_changed))
+        if result.segmented:
+            self._segmented.append((relative_path, *result.segmented))
+        return result.ok
+
+    def _pair_cost(self, raw_file: Path, translated_file: Path) -> int:
+        """CSV bytes a pair holds in memory, the whole translated file and one raw chunk or the whole raw file"""
+        raw_size = raw_file.stat().st_size if raw_file.is_file() else 0
+        translated_size = (
+            translated_file.stat().st_size if translated_file.is_file() else 0
+        )
+        if self._chunk_rows is not None:
+            raw_size = min(raw_size, self._chunk_rows * CHUNK_ROW_BYTES)
+        return raw_size + translated_size
+
+    def _diff_pair(
+        self,
+        raw_file: Path,
+        translated_file: Path,
+        diff_file: Path,
+        relative_path: Path,
+    ) -> bool:
+        """Write the diff of one file pair, runs in a worker thread or process"""
+        try:
+            # outputs of an earlier run are replaced, a pair without diff must not keep a stale file
+            self._remove_outputs(diff_file, relative_path)
+
+            # Check if translated file exists, with a translation memory the rows may be translated elsewhere
+            if not translated_file.is_file() and self._translation_memory is None:
+                logger.info(
+                    f"Translated file not found for {relative_path}. Copying raw file to diff."
+                )
+                self._io_helper.ensure_dir_exists(diff_file.parent)
+                shutil.copy2(raw_file, diff_file)
+                return True
+
+            return self._process_csv_files(
+                raw_file, translated_file, diff_file, relative_path
+            )
+
         except Exception as e:
             logger.error(f"Unexpected error processing {relative_path}: {e}")
             return False
 
     async def _run_in_executor(self, func: Callable, *args, **kwargs) -> Any:
         """Run function in thread pool"""
-        loop = asyncio.get_event_loop()
+        if self._runtime is not None:
+            return await self._runtime.run_in_thread(func, *args, **kwargs)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        loop = asyncio.get_running_loop()
         return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
 
+    def close(self) -> None:
+        """Shut down the thread pool of a differ without runtime, it is started again on next use"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _save_worker_state(self) -> str:
+        """Pickle what a worker process needs to a temp file, the path identifies the run"""
+        fd, state_file = tempfile.mkstemp(prefix="diff-worker-", suffix=".pickle")
+        with os.fdopen(fd, "wb") as fp:
+            pickle.dump(
+                (self._translation_memory, self._worker_options()),
+                fp,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        return state_file
+
     def _process_csv_files(
         self,
         raw_file: Path,
         translated_file: Path,
         diff_file: Path,
         relative_path: Path,
+        stream: Optional[bool] = None,
     ) -> bool:
         """
         Core logic for CSV file comparison, executed in thread pool
         This code remains synchronous because pandas operations are CPU-intensive and not I/O-bound
         """
+        if stream is None:
+            stream = self._chunk_rows is not None
         try:
-            # Load raw CSV
-            df_raw = self._load_csv_to_dataframe(
-                raw_file, ["id_r", "english"], relative_path, "raw"
-            )
-
-            if df_raw is None or df_raw.empty:
-                logger.info(f"Skipping empty raw file: {relative_path}")
-                return True
-
-            # Load translated CSV to determine column structure
-            df_translated = self._load_csv_to_dataframe(
-                translated_file, None, relative_path, "translated"
-            )
-
-            if df_translated is None or df_translated.empty:
-                logger.info(
-                    f"Translated file is empty: {relative_path}. Copying raw file to diff."
+            # Load translated CSV to determine column structure, it is indexed once for all raw chunks
+            df_translated = None
+            if translated_file.is_file():
+                df_translated = self._load_csv_to_dataframe(
+                    translated_file, None, relative_path, "translated"
                 )
-                os.makedirs(diff_file.parent, exist_ok=True)
-                shutil.copy2(raw_file, diff_file)
-                return True
 
-            # Assign proper column names based on column count
-            if len(df_translated.columns) >= 3:
+            translated = None
+            if df_translated is not None and not df_translated.empty:
+                # Assign proper column names based on column count
+                if len(df_translated.columns) < 3:
+                    logger.error(
+                        f"Translated file has only {len(df_translated.columns)} columns, expected at least 3. {translated_file.absolute()}"
+                    )
+                    os.makedirs(diff_file.parent, exist_ok=True)
+                    shutil.copy2(raw_file, diff_file)
+                    return True
                 df_translated.columns = ["id_t", "eng", "translated_text"] + [
                     f"col{i}" for i in range(4, len(df_translated.columns) + 1)
                 ]
-            else:
-                logger.error(
-                    f"Translated file has only {len(df_translated.columns)} columns, expected at least 3. {translated_file.absolute()}"
-                )
-                os.makedirs(diff_file.parent, exist_ok=True)
-                shutil.copy2(raw_file, diff_file)
-                return True
-
-            # Create a set of translated English texts (col2) for faster lookup
-            translated_eng_texts = set(df_translated["eng"].dropna())
-
-            # Find rows in raw where the english text doesn't exist in translated eng column
-            diff_mask = ~df_raw["english"].isin(translated_eng_texts)
+                translated = _TranslatedIndex(df_translated, self._normalizer)
 
-            if not diff_mask.any():
-                logger.info(f"No diff found for: {relative_path}")
-                return True
-            else:
-                diff_count = diff_mask.sum()
-                logger.info(f"Writing diff for: {relative_path} ({diff_count} rows)")
-                os.makedirs(diff_file.parent, exist_ok=True)
-
-                # Select only id_r and english columns for the diff rows
-                diff_rows = df_raw.loc[diff_mask, ["id_r", "english"]]
-                diff_rows.to_csv(diff_file, index=False, header=False)
-                return True
+            stats = _PairStats()
+            for df_raw in self._iter_raw(raw_file, relative_path, stream):
+                if translated is None and self._translation_memory is None:
+                    if stats.raw_rows == 0 and df_raw is not None and not df_raw.empty:
+                        logger.info(
+                            f"Translated file is empty: {relative_path}. Copying raw file to diff."
+                        )
+                        os.makedirs(diff_file.parent, exist_ok=True)
+                        shutil.copy2(raw_file, diff_file)
+                        return True
+                if df_raw is None or df_raw.empty:
+                    continue
+                stats.raw_rows += len(df_raw)
+                self._diff_chunk(df_raw, translated, diff_file, relative_path, stats)
 
         except Exception as e:
+            if stream and isinstance(e, (pd.errors.ParserError, UnicodeDecodeError)):
+                # the chunked reader has no engine fallback, read the whole file the usual way instead
+                logger.debug(
+                    f"Chunked read failed for {relative_path}, reading it whole: {e}"
+                )
+                self._remove_outputs(diff_file, relative_path)
+                return self._process_csv_files(
+                    raw_file, translated_file, diff_file, relative_path, stream=False
+                )
             logger.error(
                 f"Unexpected error in _process_csv_files for {relative_path}: {e}"
             )
@@ -188,6 +638,275 @@ class Differentiator:
                 logger.error(f"Failed to copy raw file after error: {copy_error}")
                 return False
 
+        if stats.raw_rows == 0:
+            logger.info(f"Skipping empty raw file: {relative_path}")
+            return True
+        self._record_pair_stats(stats, relative_path)
+        if stats.diff_rows == 0:
+            logger.info(f"No diff found for: {relative_path}")
+        else:
+            logger.info(f"Writing diff for: {relative_path} ({stats.diff_rows} rows)")
+        return True
+
+    def _diff_chunk(
+        self,
+        df_raw: pd.DataFrame,
+        translated: Optional["_TranslatedIndex"],
+        diff_file: Path,
+        relative_path: Path,
+        stats: "_PairStats",
+    ) -> None:
+        """Diff raw rows against the translated file and append every output of them"""
+        # rows not sent to MT because a translation was found for them
+        carried: List[pd.DataFrame] = []
+
+        if translated is None:
+            diff_mask = np.ones(len(df_raw), dtype=bool)
+        else:
+            # Find rows in raw where the english text doesn't exist in translated eng column
+            diff_mask = translated.diff_mask(df_raw["english"])
+            if self._normalizer is not None:
+                # rows changed only in whitespace or quoting keep their translation
+                diff_mask, rows = self._carry_over(
+                    df_raw, diff_mask, translated.normalized_memory
+                )
+                if len(rows):
+                    carried.append(rows)
+                    stats.normalized_saved += len(rows)
+
+        if self._translation_memory is not None:
+            diff_mask, rows = self._carry_over(
+                df_raw, diff_mask, self._translation_memory
+            )
+            if len(rows):
+                carried.append(rows)
+                stats.memory_filled += len(rows)
+
+        if carried and self._autofill_path is not None:
+            self._append_csv(
+                pd.concat(carried).sort_index(),
+                Path(self._autofill_path) / relative_path,
+            )
+
+        # Select only id_r and english columns for the diff rows
+        diff_rows = df_raw.loc[diff_mask, ["id_r", "english"]]
+
+        matches = None
+        if not diff_rows.empty and (
+            self._near_match_path is not None or self._segment_path is not None
+        ):
+            matches = self._near_matches(diff_rows, translated)
+        if matches is not None and self._segment_path is not None:
+            # an extra output, the passages stay in the diff until segment translations can be merged back
+            self._write_segments(diff_rows, matches, translated, relative_path, stats)
+
+        if diff_rows.empty:
+            return
+        stats.diff_rows += len(diff_rows)
+        self._append_csv(diff_rows, diff_file)
+        if self._near_match_path is not None:
+            self._write_near_matches(
+                diff_rows, matches, translated, relative_path, stats
+            )
+
+    def _iter_raw(
+        self, raw_file: Path, relative_path: Path, stream: bool
+    ) -> Iterator[Optional[pd.DataFrame]]:
+        """Raw file as one DataFrame, or in chunks of chunk_rows rows when streaming"""
+        if not stream:
+            yield self._load_csv_to_dataframe(
+                raw_file, ["id_r", "english"], relative_path, "raw"
+            )
+            return
+        # the C engine is the only fast engine with chunked reading
+        with pd.read_csv(
+            raw_file,
+            header=None,
+            names=["id_r", "english"],
+            engine="c",
+            sep=",",
+            chunksize=self._chunk_rows,
+        ) as reader:
+            yield from reader
+
+    @staticmethod
+    def _append_csv(rows: pd.DataFrame, file_path: Path) -> None:
+        """Append rows without header, outputs of a pair are removed before it is diffed"""
+        os.makedirs(file_path.parent, exist_ok=True)
+        rows.to_csv(file_path, mode="a", index=False, header=False)
+
+    def _remove_outputs(self, diff_file: Path, relative_path: Path) -> None:
+        """Remove every output an earlier run or attempt wrote for the pair"""
+        diff_file.unlink(missing_ok=True)
+        for output_path in (
+            self._autofill_path,
+            self._near_match_path,
+            self._segment_path,
+        ):
+            if output_path is not None:
+                (Path(output_path) / relative_path).unlink(missing_ok=True)
+        if self._segment_path is not None:
+            (Path(self._segment_path) / relative_path).with_suffix(
+                ALIGNMENT_SUFFIX
+            ).unlink(missing_ok=True)
+
+    def _record_pair_stats(self, stats: "_PairStats", relative_path: Path) -> None:
+        if stats.normalized_saved:
+            self._normalized_saved.append((relative_path, stats.normalized_saved))
+        if stats.memory_filled:
+            self._memory_filled.append((relative_path, stats.memory_filled))
+        if stats.near_changed:
+            self._near_changed.append((relative_path, stats.near_changed))
+        if stats.alignments:
+            with open(
+                (Path(self._segment_path) / relative_path).with_suffix(
+                    ALIGNMENT_SUFFIX
+                ),
+                "w",
+                encoding="utf-8",
+            ) as fp:
+                json.dump(stats.alignments, fp, ensure_ascii=False, indent=2)
+            self._segmented.append(
+                (
+                    relative_path,
+                    len(stats.alignments),
+                    stats.segment_full_chars,
+                    stats.segment_sent_chars,
+                )
+            )
+
+    def _near_matches(
+        self, diff_rows: pd.DataFrame, translated: Optional["_TranslatedIndex"]
+    ) -> List[NearMatch]:
+        """Most similar translated row of every diff row, index is a row of the translated file"""
+        if translated is None:
+            return [NearMatch(-1, 0.0)] * len(diff_rows)
+        # one query for both uses, each applies its own threshold afterwards
+        threshold = self._near_match_threshold
+        if self._segment_path is not None:
+            threshold = min(threshold, self._segment_threshold)
+        return translated.near_index.query(diff_rows["english"], threshold)
+
+    def _write_near_matches(
+        self,
+        diff_rows: pd.DataFrame,
+        matches: List[NearMatch],
+        translated: Optional["_TranslatedIndex"],
+        relative_path: Path,
+        stats: "_PairStats",
+    ) -> None:
+        """
+        Classify diff rows as new or changed and write them to the near match path.
+        Columns: id_r, english, status, similarity, old_id, old_translation
+        """
+        near_rows = diff_rows.assign(
+            status="new", similarity=np.nan, old_id=None, old_translation=None
+        )
+        index = np.array([match.index for match in matches], dtype=np.intp)
+        similarity = np.array([match.similarity for match in matches], dtype=float)
+        changed = (index >= 0) & (similarity >= self._near_match_threshold)
+        if changed.any():
+            old_rows = translated.df.iloc[index[changed]]
+            near_rows.loc[changed, "status"] = "changed"
+            near_rows.loc[changed, "similarity"] = similarity[changed].round(3)
+            near_rows.loc[changed, "old_id"] = old_rows["id_t"].to_numpy()
+            near_rows.loc[changed, "old_translation"] = old_rows[
+                "translated_text"
+            ].to_numpy()
+            stats.near_changed += int(changed.sum())
+
+        self._append_csv(near_rows, Path(self._near_match_path) / relative_path)
+
+    def _write_segments(
+        self,
+        diff_rows: pd.DataFrame,
+        matches: List[NearMatch],
+        translated: Optional["_TranslatedIndex"],
+        relative_path: Path,
+        stats: "_PairStats",
+    ) -> None:
+        """
+        Diff changed passages against their old version segment by segment.
+        Changed segments are written as "id_r#segment", segment rows, the alignment is collected in stats.
+        """
+        segment_rows = []
+        for id_r, english, match in zip(
+            diff_rows["id_r"], diff_rows["english"], matches
+        ):
+            if (
+                match.index < 0
+                or match.similarity < self._segment_threshold
+                or not isinstance(english, str)
+            ):
+                continue
+            old_id, old_english = translated.df.iloc[match.index][["id_t", "eng"]]
+            old_spans, new_spans, changes = diff_segments(str(old_english), english)
+            unchanged = len(new_spans) - sum(
+                change.new[1] - change.new[0] for change in changes
+            )
+            # passages without an unchanged segment are translated whole
+            if len(new_spans) < 2 or unchanged <= 0:
+                continue
+            if unchanged == len(new_spans):
+                # only deletions or whitespace edits, no segment to send, the passage goes as one segment
+                new_spans = [(0, len(english))]
+                changes = [SegmentChange("replace", (0, len(old_spans)), (0, 1))]
+
+            for change in changes:
+                for segment in range(*change.new):
+                    start, end = new_spans[segment]
+                    segment_rows.append((f"{id_r}#{segment}", english[start:end]))
+                    stats.segment_sent_chars += end - start
+            stats.segment_full_chars += len(english)
+            stats.alignments.append(
+                {
+                    "id_r": str(id_r),
+                    "old_id": str(old_id),
+                    "segments": new_spans,
+                    "old_segments": old_spans,
+                    "changes": [change._asdict() for change in changes],
+                }
+            )
+
+        if segment_rows:
+            self._append_csv(
+                pd.DataFrame(segment_rows), Path(self._segment_path) / relative_path
+            )
+
+    @staticmethod
+    def _carry_over(
+        df_raw: pd.DataFrame, diff_mask: np.ndarray, memory: TranslationMemory
+    ) -> Tuple[np.ndarray, pd.DataFrame]:
+        """
+        Drop diff rows the memory has a translation for
+
+        Returns:
+            Tuple[np.ndarray, pd.DataFrame]: new diff mask, dropped rows as id_r, english, translated_text
+        """
+        diff_rows = df_raw.loc[diff_mask, ["id_r", "english"]]
+        translations = memory.lookup(diff_rows["english"])
+        filled = pd.notna(translations)
+        if not filled.any():
+            return diff_mask, diff_rows.iloc[:0]
+
+        diff_mask = diff_mask.copy()
+        diff_mask[np.flatnonzero(diff_mask)[filled]] = False
+        return diff_mask, diff_rows[filled].assign(translated_text=translations[filled])
+
+    @staticmethod
+    def hash_diff_mask(raw_texts: pd.Series, translated_texts: pd.Series) -> np.ndarray:
+        """
+        Vectorized set difference on hashed english texts
+
+        Args:
+            raw_texts: english column of the raw file
+            translated_texts: english column of the translated file
+
+        Returns:
+            np.ndarray: bool mask, True for raw rows whose text is not in translated_texts
+        """
+        return _KeyTable(translated_texts).diff_mask(raw_texts)
+
     def _load_csv_to_dataframe(
         self,
         file_path: Path,
@@ -196,6 +915,23 @@ class Differentiator:
         file_type: str,
     ) -> Optional[pd.DataFrame]:
         """加载CSV文件到DataFrame，处理可能的错误"""
+        # try the fast engines first, the python engine is only used for files they fail on
+        for engine in FAST_CSV_ENGINES:
+            try:
+                return pd.read_csv(
+                    file_path,
+                    header=None,
+                    names=column_names,
+                    engine=engine,
+                    sep=",",
+                    **({} if engine == "pyarrow" else {"low_memory": False}),
+                )
+            except Exception as e:
+                logger.debug(
+                    f"{engine} engine failed on {file_type} file {relative_path}, trying next engine: {e}"
+                )
+
+        self._csv_fallback_files.append(file_path)
         try:
             df = pd.read_csv(
                 file_path,
@@ -217,37 +953,200 @@ class Differentiator:
             )
             return None
 
-    async def count_diff_rows(self):
+    @property
+    def csv_fallback_files(self) -> List[Path]:
+        """Files which could only be parsed by the python engine"""
+        return self._csv_fallback_files
+
+    async def count_diff_rows(self) -> int:
         """Count the number of diff rows in the diff files asynchronously."""
-        diff_files = list(self._diff_files_path.rglob("*.csv"))
+        counts = await self.count_diff_rows_per_file()
 
-        if not diff_files:
-            logger.warning(f"No CSV files found in {self._diff_files_path}")
-            return 0
+        # calculate total rows
+        total_rows = sum(counts.values())
 
-        # create async tasks
-        tasks = []
-        for file_path in diff_files:
-            tasks.append(self._count_rows_in_file(file_path))
+        logger.info(f"Total diff rows: {total_rows} in {len(counts)} files")
+        return total_rows
 
-        # run all tasks in parallel
-        results = await asyncio.gather(*tasks)
+    async def count_diff_rows_per_file(self) -> Dict[Path, int]:
+        """Count the rows of every diff file in parallel, unreadable files are left out"""
+        diff_files = list(Path(self._diff_files_path).rglob("*.csv"))
 
-        # calculate total rows
-        total_rows = sum(count for count in results if count is not None)
+        if not diff_files:
+            logger.warning(f"No CSV files found in {self._diff_files_path}")
+            return {}
 
-        logger.info(f"Total diff rows: {total_rows} in {len(diff_files)} files")
-        return total_rows
+        # run all tasks in parallel
+        results = await asyncio.gather(
+            *(self._count_rows_in_file(file_path) for file_path in diff_files)
+        )
+        return {
+            file_path: count
+            for file_path, count in zip(diff_files, results)
+            if count is not None
+        }
 
     async def _count_rows_in_file(self, file_path: Path) -> Optional[int]:
         """Count the number of rows in a single file asynchronously."""
         try:
             # use thread pool to read file
             row_count = await self._run_in_executor(
-                self._io_helper.count_csv_rows(), file_path
+                self._io_helper.count_csv_records, file_path
             )
             logger.debug(f"File {file_path}: {row_count} rows")
             return row_count
         except Exception as e:
             logger.error(f"Error reading file {file_path}: {str(e)}")
             return None
+
+
+class _ByteBudget:
+    """Bytes shared by concurrent pairs, a pair waits until its cost fits or nothing else runs"""
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, cost: int) -> None:
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self._used == 0 or self._used + cost <= self._limit
+            )
+            self._used += cost
+
+    async def release(self, cost: int) -> None:
+        async with self._condition:
+            self._used -= cost
+            self._condition.notify_all()
+
+
+class _KeyTable:
+    """Sorted hashes of the english texts of a translated file, built once and searched by every raw chunk"""
+
+    def __init__(self, texts: pd.Series):
+        texts = texts.dropna()
+        self._values = texts.astype(str).to_numpy(dtype=object)
+        hashes = hash_array(self._values, categorize=False)
+        self._order = np.argsort(hashes)
+        self._sorted_hashes = hashes[self._order]
+
+    def diff_mask(self, raw_texts: pd.Series) -> np.ndarray:
+        """True for raw texts which are not in the table, NaN is always a diff"""
+        raw_missing = raw_texts.isna().to_numpy()
+        if len(self._values) == 0:
+            return np.ones(len(raw_texts), dtype=bool)
+
+        raw_values = raw_texts.astype(str).to_numpy(dtype=object)
+        index = hash_lookup(
+            raw_values,
+            hash_array(raw_values, categorize=False),
+            self._values,
+            self._sorted_hashes,
+            self._order,
+        )
+        return (index < 0) | raw_missing
+
+
+class _TranslatedIndex:
+    """Everything derived from one translated file, the lookups a raw chunk needs are built on first use"""
+
+    def __init__(self, df: pd.DataFrame, normalizer: Optional[TextNormalizer] = None):
+        self.df = df
+        self._normalizer = normalizer
+        self._keys: Optional[_KeyTable] = None
+        self._normalized_memory: Optional[TranslationMemory] = None
+        self._near_index: Optional[NearMatchIndex] = None
+
+    def diff_mask(self, raw_texts: pd.Series) -> np.ndarray:
+        if self._keys is None:
+            self._keys = _KeyTable(self.df["eng"])
+        return self._keys.diff_mask(raw_texts)
+
+    @property
+    def normalized_memory(self) -> TranslationMemory:
+        if self._normalized_memory is None:
+            self._normalized_memory = TranslationMemory(self._normalizer).build(
+                [self.df]
+            )
+        return self._normalized_memory
+
+    @property
+    def near_index(self) -> NearMatchIndex:
+        if self._near_index is None:
+            self._near_index = NearMatchIndex().build(self.df["eng"])
+        return self._near_index
+
+
+class _PairStats:
+    """Counters of one file pair, summed over its raw chunks"""
+
+    def __init__(self):
+        self.raw_rows = 0
+        self.diff_rows = 0
+        self.normalized_saved = 0
+        self.memory_filled = 0
+        self.near_changed = 0
+        self.segment_full_chars = 0
+        self.segment_sent_chars = 0
+        self.alignments: List[Dict[str, Any]] = []
+
+
+class DiffResult(NamedTuple):
+    """Result of one file pair sent back by a process pool worker"""
+
+    ok: bool
+    csv_fallback_files: Tuple[Path, ...] = ()
+    memory_filled: int = 0
+    normalized_saved: int = 0
+    near_changed: int = 0
+    segmented: Optional[Tuple[int, int, int]] = (
+        None  # passages, their chars, chars sent
+    )
+
+
+# differ of the run a worker process last served, keyed by the state file of the run
+_worker_differ: Optional[Differentiator] = None
+_worker_state: Optional[str] = None
+
+
+def _load_worker_state(state_file: str) -> Differentiator:
+    global _worker_differ, _worker_state
+    if _worker_state != state_file:
+        with open(state_file, "rb") as fp:
+            translation_memory, options = pickle.load(fp)
+        _worker_differ = Differentiator(
+            Path(), Path(), Path(), max_workers=1, **options
+        )
+        _worker_differ._translation_memory = translation_memory
+        _worker_state = state_file
+    return _worker_differ
+
+
+def _diff_in_worker(
+    state_file: str,
+    raw_file: Path,
+    translated_file: Path,
+    diff_file: Path,
+    relative_path: Path,
+) -> DiffResult:
+    # a worker runs one pair at a time, everything appended during the call belongs to this pair
+    differ = _load_worker_state(state_file)
+    fallback_start = len(differ._csv_fallback_files)
+    filled_start = len(differ._memory_filled)
+    saved_start = len(differ._normalized_saved)
+    near_start = len(differ._near_changed)
+    segmented_start = len(differ._segmented)
+    ok = differ._diff_pair(raw_file, translated_file, diff_file, relative_path)
+    return DiffResult(
+        ok,
+        tuple(differ._csv_fallback_files[fallback_start:]),
+        sum(count for _, count in differ._memory_filled[filled_start:]),
+        sum(count for _, count in differ._normalized_saved[saved_start:]),
+        sum(count for _, count in differ._near_changed[near_start:]),
+        (
+            differ._segmented[segmented_start][1:]
+            if len(differ._segmented) > segmented_start
+            else None
+        ),
+    )
@@ -39,12 +39,13 @@ class Dumper:
             ".deleteAt(",
             ".splice(",
         }
-
-        asyncio.run(self._get_twees())
+        # .twee files are collected by the first dump, inside the event loop of the caller
+        self._twees_loaded = False
 
     """dump and cache variables from .twee files"""
 
     async def dump_variables(self) -> None:
+        await self._ensure_twees()
         results = await asyncio.gather(
             *[self._dump_variables(file) for file in self._twee_files]
         )
@@ -75,6 +76,7 @@ class Dumper:
             logger.info(f"No cache founded in {cache_path}: {e}")
 
         # dump sets
+        await self._ensure_twees()
         results = await asyncio.gather(
             *[self._dump_sets(file) for file in self._twee_files]
         )
@@ -269,6 +271,11 @@ class Dumper:
                     self._twee_files.add(Path(root).absolute() / file)
         return self._twee_files
 
+    async def _ensure_twees(self) -> None:
+        if not self._twees_loaded:
+            await self._get_twees()
+            self._twees_loaded = True
+
     async def _cache_variables(self) -> None:
         try:
             async with aopen(
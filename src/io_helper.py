@@ -1,9 +1,13 @@
 from pathlib import Path
 from typing import List, Optional, Union, Dict, Any, Tuple
 import csv
+import hashlib
+import mmap
 import os
 import shutil
 
+import numpy as np
+
 from loguru import logger
 
 
@@ -109,7 +113,7 @@ class IOHelper:
             return False
 
     def read_csv(
-        self, file_path: Path, with_header: bool = False
+        self, file_path: Path, with_header: bool = False, errors: str = "ignore"
     ) -> Tuple[List[List[str]], bool]:
         """
         Read CSV file and return data rows
@@ -117,12 +121,13 @@ class IOHelper:
         Args:
             file_path: CSV file path
             with_header: whether to include header row
+            errors: decoding error handling of open, "strict" fails on undecodable bytes instead of dropping them
 
         Returns:
             Tuple[List[List[str]], bool]: (CSV data rows list, invoke result)
         """
         try:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            with open(file_path, "r", encoding="utf-8", errors=errors) as f:
                 reader = csv.reader(f)
                 rows = list(reader)
 
@@ -194,6 +199,52 @@ class IOHelper:
             logger.error(f"Failed to count CSV file {file_path}: {str(e)}")
             return 0
 
+    def count_csv_records(self, file_path: Path) -> int:
+        """
+        Count CSV records without parsing them, same count as count_csv_rows for well formed files
+
+        A newline ends a record only outside quotes. Escaped quotes ("") toggle the quote state twice,
+        so a newline is outside quotes exactly when an even number of quotes precede it.
+
+        Args:
+            file_path: CSV file to count
+
+        Returns:
+            int: number of records, 0 for empty or unreadable files
+        """
+        try:
+            with open(file_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return 0
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # an unterminated last record still counts
+                    trailing = 0 if mm[-1:] == b"\n" else 1
+                    data = np.frombuffer(mm, dtype=np.uint8)
+                    newline_mask = data == ord("\n")
+                    if mm.find(b'"') == -1:
+                        del data
+                        return int(np.count_nonzero(newline_mask)) + trailing
+
+                    quotes = np.flatnonzero(data == ord('"'))
+                    newlines = np.flatnonzero(newline_mask)
+                    del data  # release the buffer before the mmap closes
+                    quotes_before = np.searchsorted(quotes, newlines)
+                    return int(np.count_nonzero(quotes_before % 2 == 0)) + trailing
+        except Exception as e:
+            logger.error(f"Failed to count CSV file {file_path}: {str(e)}")
+            return 0
+
+    def file_hash(self, file_path: Path, chunk_size: int = 1 << 20) -> Optional[str]:
+        """blake2b digest of the file content, None if the file does not exist"""
+        try:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(file_path, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    digest.update(chunk)
+            return digest.hexdigest()
+        except FileNotFoundError:
+            return None
+
     def count_csv_row_translations(
         self, file_path: str, check_translation: bool = False
     ) -> int:
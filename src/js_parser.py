@@ -1,7 +1,317 @@
+import re
+from bisect import bisect_right
+from enum import Enum
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set
+
+from loguru import logger
+
+"""
+    JSParser tokenises a whitelisted .js file once and yields every string and template literal with its position.
+    SPECIAL_FILES rules are matched against the lines of each literal, like the per-line scan of ParseJS,
+    but only lines holding a text literal are kept and multi-line template literals are kept whole.
+"""
+
+# File name patterns for special handling
+SPECIAL_FILES: Dict[str, Optional[Set[str]]] = {
+    # 01-setup
+    "weather-descriptions.js": {"'", '"', "`"},
+    # 02-Helpers
+    "macros.js": {"return `", "either(", "return '", 'return "'},
+    # 04-Variables
+    "feats.js": {"title: ", "desc: ", "hint: ", ".html"},
+    "colours.js": {'name_cap: "', 'name: "'},
+    "shop.js": {'"'},
+    "plant-setup.js": {"plural:", "singular:", "seed_name:"},
+    # special-masturbation
+    "macros-masturbation.js": {"namecap", "name : name"},
+    # 04-Pregnancy
+    "children-story-functions.js": {"const wordList", "wordList.push"},
+    "pregnancy.js": {
+        "names = ['",
+        "names.pushUnique",
+        "spermOwner.name +",
+        "spermOwner.fullDescription +",
+        ".replace(/[^a-zA-Z",
+    },
+    "story-functions.js": {"name = (caps ?", "name = caps ?", "name = name[0]"},
+    "pregnancy-types.js": {
+        'return "tiny";',
+        'return "small";',
+        'return "normal";',
+        'return "large";',
+        'return ["tiny",',
+    },
+    # 03-Templates
+    "t-actions.js": {"either("},
+    "t-bodyparts.js": {"either("},
+    # external
+    "color-namer.js": None,  # Special handling
+    # base-system
+    "widgets.js": {
+        ".name_cap,",
+        "addfemininityfromfactor(",
+        "playerAwareTheyArePregnant()",
+        "function formatList(",
+    },
+    "text.js": {".statChange", 'return "', "targetName"},
+    "stat-changes.js": {"return '", 'return "', ".statChange"},
+    # 01-main
+    "02-tooltips.js": {'"', "`", "Description", "Output", "<span", "<br>"},
+    # 05-renderer
+    "30-canvasmodel-editor.js": {
+        "CombatEditor.create",
+        "CombatEditor.Create",
+        "textContent",
+    },
+}
+
+# keywords after which a `/` starts a regex literal instead of a division
+_REGEX_KEYWORDS = {
+    "return",
+    "typeof",
+    "instanceof",
+    "in",
+    "of",
+    "new",
+    "delete",
+    "void",
+    "throw",
+    "case",
+    "do",
+    "else",
+    "yield",
+    "await",
+}
+
+
+class Regexes(Enum):
+    # complete string, template with simple substitutions, comment,
+    # or a single char opening a template, regex or unterminated string
+    TOKEN = re.compile(
+        r'"[^"\\\n]*(?:\\(?:\r\n|[\s\S])[^"\\\n]*)*"'
+        r"|'[^'\\\n]*(?:\\(?:\r\n|[\s\S])[^'\\\n]*)*'"
+        r"|`[^`\\$]*(?:(?:\\[\s\S]|\$(?!\{)|\$\{[^\"'`/{}]*\})[^`\\$]*)*`"
+        r"|//[^\n]*"
+        r"|/\*[\s\S]*?(?:\*/|\Z)"
+        r"|[`/\"']"
+    )
+    # same as TOKEN, plus braces to find the end of a template substitution
+    SUBSTITUTION_TOKEN = re.compile(TOKEN.pattern + r"|[{}]")
+    # substitution without nested literals, comments or braces, eg: ${name}
+    SIMPLE_SUBSTITUTION = re.compile(r"[^\"'`/{}]*\}")
+    TEMPLATE_CHUNK = re.compile(r"[^`\\$]*(?:(?:\\[\s\S]|\$(?!\{))[^`\\$]*)*")
+    REGEX_LITERAL = re.compile(
+        r"/(?![*/])(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[A-Za-z]*"
+    )
+    TRAILING_WORD = re.compile(r"[\w$]+$")
+    HAS_LETTER = re.compile(r"[A-Za-z]")
+
+
+class JSLiteral(NamedTuple):
+    kind: str  # opening delimiter: ', " or `
+    value: str  # literal body without delimiters, template substitutions kept raw
+    start: int  # offset of the opening delimiter
+    end: int  # offset after the closing delimiter
+    line: int  # 0-based line of the opening delimiter
+    column: int
+    end_line: int
+    context: str  # source from the line start up to and including the opening delimiter
+
+
 class JSParser:
-    def __init__(self):
+    def __init__(self, content: str, filepath: Path):
+        self._content = content
+        self._filepath = filepath
+        self._filename = filepath.name
+        self._literals: Optional[List[JSLiteral]] = None
+        self._token_search = Regexes.TOKEN.value.search
+        self._substitution_search = Regexes.SUBSTITUTION_TOKEN.value.search
+
+        # offset of every line start, accumulated from line lengths plus the newline
+        self._line_starts = list(
+            accumulate(map((1).__add__, map(len, content.split("\n")[:-1])), initial=0)
+        )
+
+    @classmethod
+    def from_file(cls, filepath: Path) -> "JSParser":
+        with open(filepath, "r", encoding="utf-8") as fp:
+            return cls(fp.read(), filepath)
+
+    def parse(self) -> List[JSLiteral]:
+        """Return literals kept by the SPECIAL_FILES rules of this file"""
+        if self._filename in SPECIAL_FILES:
+            return self.filter_literals(SPECIAL_FILES[self._filename])
+        return self.filter_literals(None)
+
+    def literals(self) -> Iterator[JSLiteral]:
+        """Yield every string and template literal in source order, tokenising the file only once"""
+        if self._literals is None:
+            self._literals = []
+            self._scan(0, in_template=False)
+            # templates are added after the literals nested in their substitutions
+            self._literals.sort(key=lambda literal: literal.start)
+        yield from self._literals
+
+    def filter_literals(self, patterns: Optional[Set[str]]) -> List[JSLiteral]:
+        """
+        Filter literals by surrounding context
+
+        Args:
+            patterns: SPECIAL_FILES rule, a literal is kept if any pattern occurs on its lines,
+                rules may reach past the literal, eg: 'return "tiny";'.
+                None keeps every literal which looks like human readable text.
+
+        Returns:
+            List[JSLiteral]: kept literals in source order
+        """
+        has_letter = Regexes.HAS_LETTER.value.search
+        if patterns is None:
+            kept = [lit for lit in self.literals() if self.is_text_literal(lit)]
+        else:
+            # one pass over the lines for all patterns of the rule
+            on_lines = re.compile(
+                "|".join(re.escape(p) for p in sorted(patterns))
+            ).search
+            kept = [
+                lit
+                for lit in self.literals()
+                if has_letter(lit.value) and on_lines(self.line_span(lit))
+            ]
+
+        # drop literals nested in the substitutions of an already kept template
+        results = []
+        covered_until = -1
+        for lit in kept:
+            if lit.start < covered_until:
+                continue
+            results.append(lit)
+            covered_until = lit.end
+        return results
+
+    def line_span(self, literal: JSLiteral) -> str:
+        """Source of the lines the literal starts and ends on, and every line between"""
+        line_starts = self._line_starts
+        start = line_starts[literal.line]
+        if literal.end_line + 1 < len(line_starts):
+            return self._content[start : line_starts[literal.end_line + 1] - 1]
+        return self._content[start:]
+
+    def to_line_flags(self, literals: List[JSLiteral]) -> List[bool]:
+        """Convert literals to the per-line flags used by ParseJS, multi-line literals mark every covered line"""
+        flags = [False] * len(self._line_starts)
+        for lit in literals:
+            for line in range(lit.line, lit.end_line + 1):
+                flags[line] = True
+        return flags
+
+    @staticmethod
+    def is_text_literal(literal: JSLiteral) -> bool:
+        """Literal contains words, not only keys, ids or css classes"""
+        value = literal.value
+        if not Regexes.HAS_LETTER.value.search(value):
+            return False
+        return " " in value or "<" in value or value[:1].isupper()
+
+    def _scan(self, pos: int, in_template: bool) -> int:
+        """Scan code from pos, returns offset after the closing brace of a template substitution or EOF"""
+        content = self._content
+        length = len(content)
+        # braces only matter inside template substitutions
+        search = self._substitution_search if in_template else self._token_search
+        add_literal = self._add_literal
+        depth = 0
+
+        while True:
+            token = search(content, pos)
+            if token is None:
+                return length
+
+            start = token.start()
+            text = token.group()
+            char = text[0]
+            pos = token.end()
+
+            if char == '"' or char == "'" or char == "`":
+                if len(text) > 1:
+                    add_literal(char, start, pos, text[1:-1])
+                elif char == "`":
+                    pos = self._scan_template(start)
+                else:
+                    pos = self._scan_unterminated(start, char)
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                if depth == 0:
+                    return pos
+                depth -= 1
+            elif len(text) == 1 and self._allows_regex(start):  # "/"
+                regex = Regexes.REGEX_LITERAL.value.match(content, start)
+                if regex:
+                    pos = regex.end()
+
+    def _scan_unterminated(self, pos: int, quote: str) -> int:
+        """Unterminated string, stop at the end of line"""
+        newline = self._content.find("\n", pos)
+        end = len(self._content) if newline == -1 else newline
+        logger.debug(f"Unterminated string in {self._filepath} at {pos}")
+        self._add_literal(quote, pos, end, self._content[pos + 1 : end])
+        return end
+
+    def _scan_template(self, pos: int) -> int:
+        content = self._content
+        length = len(content)
+        template_chunk = Regexes.TEMPLATE_CHUNK.value.match
+        simple_substitution = Regexes.SIMPLE_SUBSTITUTION.value.match
+        cursor = pos + 1
+
+        while cursor < length:
+            cursor = template_chunk(content, cursor).end()
+            if cursor >= length:
+                break
+            if content[cursor] == "`":
+                self._add_literal("`", pos, cursor + 1, content[pos + 1 : cursor])
+                return cursor + 1
+            # "${" substitution, nested literals are collected by the recursive scan
+            simple = simple_substitution(content, cursor + 2)
+            if simple:
+                cursor = simple.end()
+            else:
+                cursor = self._scan(cursor + 2, in_template=True)
+
+        logger.debug(f"Unterminated template literal in {self._filepath} at {pos}")
+        self._add_literal("`", pos, length, content[pos + 1 :])
+        return length
 
-        pass
+    def _add_literal(self, kind: str, start: int, end: int, value: str) -> None:
+        line_starts = self._line_starts
+        line = bisect_right(line_starts, start) - 1
+        end_line = line if "\n" not in value else bisect_right(line_starts, end - 1) - 1
+        line_start = line_starts[line]
+        self._literals.append(
+            JSLiteral(
+                kind,
+                value,
+                start,
+                end,
+                line,
+                start - line_start,
+                end_line,
+                self._content[line_start : start + 1],
+            )
+        )
 
-    def parse(self):
-        pass
+    def _allows_regex(self, pos: int) -> bool:
+        """Whether the `/` at pos starts a regex literal instead of a division"""
+        chunk = self._content[max(0, pos - 256) : pos].rstrip()
+        if not chunk:
+            return True
+        last = chunk[-1]
+        if last in ")]'\"`":
+            return False
+        if last.isalnum() or last in "_$":
+            # keywords are short, only the tail is needed
+            word = Regexes.TRAILING_WORD.value.search(chunk[-16:])
+            return word is not None and word.group() in _REGEX_KEYWORDS
+        return True
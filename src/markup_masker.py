@@ -0,0 +1,197 @@
+import re
+from enum import Enum
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+from .token_counter import estimate_tokens
+
+"""
+    MarkupMasker swaps the non-translatable spans of a row, <<macros>>, <tags>, `code`, $variables and link targets,
+    for short {n} placeholders before machine translation and puts them back afterwards.
+    The model sees less markup, so requests are shorter and macros can not be broken by the translation.
+    Labels of [[links]] and the quoted text of <<link>>, <<button>> and <<option>> stay translatable.
+"""
+
+
+class Regexes(Enum):
+    MARKUP = re.compile(
+        r"<<[\s\S]*?>>"
+        r"|\[\[[\s\S]*?\]\]"
+        # html tags need a tag name, a bare < or > in prose is text
+        r"|</?[A-Za-z][\w-]*(?:\s[^<>]*)?/?>"
+        r"|`[^`]*`"
+        # $var and _temp with .property and [index] chains, _emphasis_ in prose is not a variable
+        r"|(?<![\w$])(?:\$[A-Za-z_$][\w$]*|_[A-Za-z$][\w$]*(?<!_)(?![\w$]))"
+        r"(?:\.[A-Za-z_$][\w$]*|\[[^\]\s]*\])*"
+    )
+    # macros whose first argument is shown to the player
+    TEXT_MACRO = re.compile(
+        r"<<(?:link|button|option|linkreplace|linkappend|linkprepend)\s+"
+    )
+    # also matches placeholders the model wrote with spaces or full-width braces
+    PLACEHOLDER = re.compile(r"[{｛]\s*(\d+)\s*[}｝]")
+    LETTER = re.compile(r"[^\W\d_]")
+
+
+class MaskedText(NamedTuple):
+    text: str  # text sent to the model
+    spans: Tuple[str, ...]  # original of placeholder {n}
+    tokens_saved: int
+
+    @property
+    def has_text(self) -> bool:
+        """Whether the row needs the model, a masked row of markup only does not"""
+        return not self.spans or bool(
+            Regexes.LETTER.value.search(Regexes.PLACEHOLDER.value.sub("", self.text))
+        )
+
+
+class MarkupMasker:
+    """
+    Args:
+        count_tokens: token count of a text, used for the tokens saved report. Defaults to estimate_tokens
+    """
+
+    def __init__(self, count_tokens: Optional[Callable[[str], int]] = None):
+        self._count_tokens = count_tokens or estimate_tokens
+        self._rows = 0
+        self._masked_rows = 0
+        self._tokens_saved = 0
+        self._failures = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self._tokens_saved
+
+    @property
+    def failures(self) -> int:
+        """Translations whose placeholders did not come back intact"""
+        return self._failures
+
+    def mask(self, text: str) -> MaskedText:
+        """Replace markup with placeholders, texts which already contain placeholders are left as they are"""
+        self._rows += 1
+        if Regexes.PLACEHOLDER.value.search(text):
+            return MaskedText(text, (), 0)
+
+        spans: List[str] = []
+        parts: List[str] = []
+        # consecutive markup goes into one placeholder
+        pending: List[str] = []
+
+        def flush():
+            if pending:
+                parts.append(f"{{{len(spans)}}}")
+                spans.append("".join(pending))
+                pending.clear()
+
+        for piece, translatable in self._pieces(text):
+            if translatable:
+                flush()
+                parts.append(piece)
+            else:
+                pending.append(piece)
+        flush()
+
+        if not spans:
+            return MaskedText(text, (), 0)
+        masked = "".join(parts)
+        saved = self._count_tokens(text) - self._count_tokens(masked)
+        self._masked_rows += 1
+        self._tokens_saved += saved
+        logger.debug(f"Masked {len(spans)} spans, {saved} tokens saved: {masked}")
+        return MaskedText(masked, tuple(spans), saved)
+
+    def restore(self, masked: MaskedText, translation: str) -> Optional[str]:
+        """Put the markup back, None when a placeholder is missing, repeated or unknown"""
+        if not masked.spans:
+            return translation
+        found = [
+            int(match.group(1))
+            for match in Regexes.PLACEHOLDER.value.finditer(translation)
+        ]
+        if sorted(found) != list(range(len(masked.spans))):
+            self._failures += 1
+            logger.debug(
+                f"Placeholders {found} do not match {len(masked.spans)} spans: {translation}"
+            )
+            return None
+        return Regexes.PLACEHOLDER.value.sub(
+            lambda match: masked.spans[int(match.group(1))], translation
+        )
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Markup masking: {self._masked_rows} of {self._rows} rows masked, "
+            f"{self._tokens_saved} tokens saved, {self._failures} translations lost placeholders"
+        )
+
+    def _pieces(self, text: str) -> List[Tuple[str, bool]]:
+        """(piece, translatable) of text, joining the pieces gives back the text"""
+        pieces = []
+        start = 0
+        for token in Regexes.MARKUP.value.finditer(text):
+            if token.start() > start:
+                pieces.append((text[start : token.start()], True))
+            value = token.group()
+            if value.startswith("<<"):
+                pieces.extend(self._macro_pieces(value))
+            elif value.startswith("[["):
+                pieces.extend(self._link_pieces(value))
+            else:
+                pieces.append((value, False))
+            start = token.end()
+        if start < len(text):
+            pieces.append((text[start:], True))
+        return pieces
+
+    def _macro_pieces(self, macro: str) -> List[Tuple[str, bool]]:
+        head = Regexes.TEXT_MACRO.value.match(macro)
+        if head is None:
+            return [(macro, False)]
+        rest = macro[head.end() :]
+        if rest.startswith("[["):
+            end = rest.find("]]")
+            if end < 0:
+                return [(macro, False)]
+            return (
+                [(macro[: head.end()], False)]
+                + self._link_pieces(rest[: end + 2])
+                + [(rest[end + 2 :], False)]
+            )
+        quote = rest[:1]
+        end = rest.find(quote, 1) if quote in ("'", '"', "`") else -1
+        if end < 0:
+            return [(macro, False)]
+        return (
+            [(macro[: head.end() + 1], False)]
+            + self._label_pieces(rest[1:end])
+            + [(rest[end:], False)]
+        )
+
+    def _link_pieces(self, link: str) -> List[Tuple[str, bool]]:
+        """[[label|target]], [[label->target]] and [[target<-label]] keep their label translatable"""
+        inner = link[2:-2]
+        if "|" in inner:
+            label, target = inner.split("|", 1)
+            return (
+                [("[[", False)] + self._label_pieces(label) + [(f"|{target}]]", False)]
+            )
+        if "->" in inner:
+            label, target = inner.split("->", 1)
+            return (
+                [("[[", False)] + self._label_pieces(label) + [(f"->{target}]]", False)]
+            )
+        if "<-" in inner:
+            target, label = inner.rsplit("<-", 1)
+            return (
+                [(f"[[{target}<-", False)] + self._label_pieces(label) + [("]]", False)]
+            )
+        # [[Target]] shows the passage name, translating it would break the link
+        return [(link, False)]
+
+    def _label_pieces(self, label: str) -> List[Tuple[str, bool]]:
+        if not label.strip() or label.strip().startswith(("http://", "https://")):
+            return [(label, False)]
+        return self._pieces(label)
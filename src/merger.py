@@ -1,17 +1,23 @@
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Optional
 
 from loguru import logger
 from src.io_helper import IOHelper
+from src.runtime import Runtime
 
 
 class Merger:
-    def __init__(self, source_path: Path, target_path: Path):
+    def __init__(
+        self, source_path: Path, target_path: Path, runtime: Optional[Runtime] = None
+    ):
         self._source_path = source_path
         self._target_path = target_path
         self._io_helper = IOHelper()
-        pass
+        # the thread pool of the runtime is shared, without a runtime a pool is created per merge
+        self._runtime = runtime
 
     async def merge_translates(self):
         """merge col3 from source_path to target_path if col2 same"""
@@ -22,7 +28,11 @@ class Merger:
         )
 
         # Create a thread pool for file processing
-        with ThreadPoolExecutor() as executor:
+        with (
+            nullcontext(self._runtime.executor)
+            if self._runtime is not None
+            else ThreadPoolExecutor()
+        ) as executor:
             # Create tasks for processing each file
             tasks = []
             for source_file in source_files:
@@ -37,9 +47,7 @@ class Merger:
 
                 # Add task to process this file pair
                 task = asyncio.create_task(
-                    self._process_file_pair(
-                        executor, self._io_helper, source_file_path, target_file
-                    )
+                    self._process_file_pair(executor, source_file_path, target_file)
                 )
                 tasks.append(task)
 
@@ -0,0 +1,226 @@
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+"""
+    NearMatchIndex finds the previous version of a slightly edited english text.
+    Texts are compared as sets of character n-grams, MinHash signatures and LSH bands
+    narrow the candidates down before the exact n-gram similarity is computed.
+"""
+
+# odd 64-bit constants to mix code points into one n-gram hash
+_MIX = np.array(
+    [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93],
+    dtype=np.uint64,
+)
+
+
+class NearMatch(NamedTuple):
+    index: int  # row of the indexed texts, -1 if no text is similar enough
+    similarity: float  # n-gram jaccard similarity, 0.0 without match
+
+
+class NearMatchIndex:
+    """
+    MinHash/LSH index over character n-grams
+
+    Args:
+        ngram: n-gram length, at most 4
+        bands: LSH bands, more bands find less similar texts
+        rows_per_band: signature values per band, bands * rows_per_band is the signature size
+        max_candidates: candidates per band and query, caps the work for very common texts
+        seed: seed of the MinHash permutations
+    """
+
+    def __init__(
+        self,
+        ngram: int = 3,
+        bands: int = 8,
+        rows_per_band: int = 4,
+        max_candidates: int = 32,
+        seed: int = 1,
+    ):
+        if not 1 <= ngram <= len(_MIX):
+            raise ValueError(f"ngram must be between 1 and {len(_MIX)}")
+        self._ngram = ngram
+        self._bands = bands
+        self._rows_per_band = rows_per_band
+        self._max_candidates = max_candidates
+        rng = np.random.default_rng(seed)
+        perms = bands * rows_per_band
+        # multiply-shift hashing, a must be odd
+        self._a = rng.integers(1, 2**63, perms, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, perms, dtype=np.uint64)
+
+        self._texts: List[str] = []
+        self._signatures = np.empty((0, perms), dtype=np.uint32)
+        self._band_keys: List[np.ndarray] = []
+        self._band_orders: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def build(self, texts: pd.Series) -> "NearMatchIndex":
+        """Index texts, NaN is indexed as an empty text which never matches"""
+        self._texts = self._prepare(texts)
+        self._signatures = self._signatures_of(self._texts)
+        self._band_keys = []
+        self._band_orders = []
+        for keys in self._band_hashes(self._signatures):
+            order = np.argsort(keys)
+            self._band_orders.append(order)
+            self._band_keys.append(keys[order])
+        return self
+
+    def query(self, texts: pd.Series, threshold: float = 0.7) -> List[NearMatch]:
+        """
+        Most similar indexed text of every query text
+
+        Args:
+            texts: query texts
+            threshold: minimum n-gram jaccard similarity of a match
+
+        Returns:
+            List[NearMatch]: one result per query text
+        """
+        queries = self._prepare(texts)
+        results = [NearMatch(-1, 0.0)] * len(queries)
+        if not queries or not self._texts:
+            return results
+
+        signatures = self._signatures_of(queries)
+        query_ids, index_ids = self._candidates(signatures)
+        if len(query_ids) == 0:
+            return results
+
+        # estimated similarity of every candidate, best candidates first per query.
+        # the estimate of 32 values is off by about 0.1, clearly dissimilar candidates are dropped
+        estimates = (signatures[query_ids] == self._signatures[index_ids]).mean(axis=1)
+        close = estimates >= threshold - 0.25
+        query_ids, index_ids, estimates = (
+            query_ids[close],
+            index_ids[close],
+            estimates[close],
+        )
+        if len(query_ids) == 0:
+            return results
+        order = np.lexsort((-estimates, query_ids))
+        query_ids, index_ids = query_ids[order], index_ids[order]
+        firsts = np.flatnonzero(np.r_[True, query_ids[1:] != query_ids[:-1]])
+
+        # the exact similarity decides, checked for the best few estimates of each query
+        ends = np.r_[firsts[1:], len(query_ids)]
+        for first, end in zip(firsts, ends):
+            query = int(query_ids[first])
+            query_grams = self._ngrams(queries[query])
+            if not query_grams:
+                continue
+            best = results[query]
+            for candidate in index_ids[first : min(end, first + 3)]:
+                similarity = self._jaccard(
+                    query_grams, self._ngrams(self._texts[candidate])
+                )
+                if similarity >= threshold and similarity > best.similarity:
+                    best = NearMatch(int(candidate), similarity)
+            results[query] = best
+        return results
+
+    def _prepare(self, texts: pd.Series) -> List[str]:
+        # case does not matter for near matches, NaN becomes an empty text
+        return [
+            text.lower() if isinstance(text, str) else ""
+            for text in texts.where(texts.isna(), texts.astype(str)).tolist()
+        ]
+
+    def _ngrams(self, text: str) -> set:
+        if not text:
+            return set()
+        n = self._ngram
+        # padded like the signatures, texts shorter than n are one n-gram
+        text = text.ljust(n, "\0")
+        return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+    @staticmethod
+    def _jaccard(left: set, right: set) -> float:
+        if not left or not right:
+            return 0.0
+        intersection = len(left & right)
+        return intersection / (len(left) + len(right) - intersection)
+
+    def _signatures_of(self, texts: List[str]) -> np.ndarray:
+        """MinHash signature of every text, all n-grams of all texts are hashed in one vectorized pass"""
+        n = self._ngram
+        # texts shorter than n still get one n-gram
+        padded = [text.ljust(n, "\0") for text in texts]
+        lengths = np.fromiter(map(len, padded), dtype=np.int64, count=len(padded))
+        codes = np.frombuffer("".join(padded).encode("utf-32-le"), dtype=np.uint32)
+        codes = codes.astype(np.uint64)
+
+        # hash of the n-gram starting at every position
+        grams = codes[: len(codes) - n + 1] * _MIX[0]
+        for k in range(1, n):
+            grams ^= codes[k : len(codes) - n + 1 + k] * _MIX[k]
+
+        # keep n-grams inside one text
+        counts = lengths - n + 1
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        text_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        positions = np.repeat(text_starts - offsets, counts) + np.arange(counts.sum())
+        grams = grams[positions]
+
+        # one multiply-shift permutation after another keeps memory at one n-gram array
+        signatures = np.empty((len(texts), len(self._a)), dtype=np.uint32)
+        shift = np.uint64(32)
+        for k, (a, b) in enumerate(zip(self._a, self._b)):
+            values = ((grams * a + b) >> shift).astype(np.uint32)
+            signatures[:, k] = np.minimum.reduceat(values, offsets)
+
+        # empty texts must not collide with each other
+        empty = np.flatnonzero(
+            np.fromiter((not text for text in texts), dtype=bool, count=len(texts))
+        )
+        if len(empty):
+            signatures[empty] = (
+                np.arange(len(empty), dtype=np.uint32)[:, None] ^ 0xFFFFFFFF
+            )
+        return signatures
+
+    def _band_hashes(self, signatures: np.ndarray) -> List[np.ndarray]:
+        r = self._rows_per_band
+        hashes = []
+        for band in range(self._bands):
+            values = signatures[:, band * r : (band + 1) * r].astype(np.uint64)
+            keys = np.zeros(len(signatures), dtype=np.uint64)
+            for k in range(r):
+                keys = (keys ^ values[:, k]) * _MIX[k % len(_MIX)]
+            hashes.append(keys)
+        return hashes
+
+    def _candidates(self, signatures: np.ndarray):
+        """(query, index) pairs sharing at least one band"""
+        query_parts = []
+        index_parts = []
+        for keys, sorted_keys, order in zip(
+            self._band_hashes(signatures), self._band_keys, self._band_orders
+        ):
+            left = np.searchsorted(sorted_keys, keys, side="left")
+            right = np.searchsorted(sorted_keys, keys, side="right")
+            counts = np.minimum(right - left, self._max_candidates)
+            if not counts.any():
+                continue
+            # expand every [left, left + count) range
+            query_ids = np.repeat(np.arange(len(keys)), counts)
+            starts = np.repeat(left - np.cumsum(counts) + counts, counts)
+            query_parts.append(query_ids)
+            index_parts.append(order[starts + np.arange(counts.sum())])
+
+        if not query_parts:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        # one int64 per pair, a 1-D unique is much cheaper than unique rows
+        size = len(self._texts)
+        pairs = np.unique(
+            np.concatenate(query_parts).astype(np.int64) * size
+            + np.concatenate(index_parts)
+        )
+        return pairs // size, pairs % size
@@ -0,0 +1,40 @@
+from enum import Enum
+
+
+class Prompt(Enum):
+    SYSTEM = ""
+    ZH_HANS = """任务：将英文翻译成中文
+规则：
+1. 保留所有 HTML、Twee、JS 标签结构不变
+2. 所有 HTML、Twee、JS 标签不参与翻译
+3. 逐标签查找需要翻译的部分
+4. 所有形如 <<...>>、<...>、`...` 的标签结构完整保留，不翻译里面的文字
+5. 所有形如 [[...|...]] 的结构中，仅翻译左侧双括号内, 至管道标记符的部分到为中文, 不要混淆<<...>>
+6. 如果[[...|...]]内左侧是网址, 不翻译
+6. 专用名词对照表:  ["Degrees of Lewdity Plus", "dick", "penis", "vagina", "balls", "anus", "Next","Vanilla","moded", "Discord","plush"] => ["欲都孤儿威力加强版", "肉棒", "肉棒", "小穴", "蛋蛋", "菊穴","继续","原版","模组版","Discord","玩偶"]
+7. 人名对照表, 请确保人名对照翻译一致: ["Avery","Bailey","Briar","Charlie","Darryl","Doren","Eden","Gwylan","Harper","Jordan","Kylar","Landry","Leighton","Mason","Morgan","River","Robin","Sam","Sirris","Whitney","Winter","Black Wolf","Niki","Quinn","Remy","Alex","Great Hawk","Wren","Sydney","Ivory Wraith","Zephyr","Nona","Lake couple","the witch"] => ["艾弗里","贝利","布莱尔","查里","达里尔","多伦","伊甸","格威岚","哈珀","约旦","凯拉尔","兰德里","礼顿","梅森","摩根","瑞沃","罗宾","萨姆","西里斯","惠特尼","温特","黑狼","尼奇","奎恩","雷米","艾利克斯","巨鹰","伦恩","悉尼","象牙怨灵","泽菲尔","诺娜","湖边情侣","巫女"]
+9. 不要逐词逐句死板对照翻译，根据上下文选择恰当措辞搭配
+10. 英语原文中还会使用各种抽象表达，翻译需要表达指代的具体内容
+10. 在对原文词句之间、上下文逻辑上要连贯一致
+12. 英语中过长的插入语导致的长难句，要结合中文常用的表达方式，把长难句的主体部分和修饰部分拆开成短句，让句子的主体部分表述清晰
+13. 汉语表述中并不需要的语气词、抽象修饰不得出现，仅保留语句主体部分
+14. 英语中常用"静态"的表述，如"xx是xx的"，而中文的表达习惯往往更加"动态"，需要翻译为中文的表述风格，禁止滥用"的"或滥用被动语态
+15. 不要输出说明文字, 只需要翻译结果
+16. 对于没有列出的规则，请按照中文的表达习惯与常识进行翻译
+17. 情爱相关的描述可以信达雅一点, 但是不要过度
+
+翻译:
+"""
+
+    # appended to the language prompt when markup is masked, see MarkupMasker
+    PLACEHOLDERS = """
+原文中形如 {0}、{1} 的占位符代表标签，原样保留在译文中语义对应的位置，不要翻译、增加、删除或改写占位符。
+
+"""
+
+    # appended to the language prompt when several rows go in one request, rows are marked @@n@@
+    BATCH = """
+以下共 {count} 段原文，每段以单独一行的 @@编号@@ 开头。
+逐段翻译，每段译文前输出同样的 @@编号@@ 单独一行，不要合并、拆分或遗漏任何一段，不要输出其它内容。
+
+"""
@@ -0,0 +1,342 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Union
+
+import httpx
+from loguru import logger
+
+from src.rate_limiter import RateLimiter, RateLimits, parse_retry_after
+from src.token_counter import estimate_tokens
+
+"""
+    Chat providers answer TranslationEngine requests over one shared, pooled httpx.AsyncClient.
+    Every provider has the chat(model, messages, stream) interface of ollama.AsyncClient,
+    so any of them can replace the Ollama client of the engine.
+    Requests are paced by the RateLimiter of the provider, throttled and failed attempts are retried after a backoff.
+"""
+
+# HTTP/2 needs the optional h2 package, connections fall back to HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+Messages = List[Dict[str, str]]
+
+# answers worth another attempt, the provider is throttling or briefly unavailable
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def create_http_client(
+    max_connections: int = 32, timeout: float = 300.0
+) -> httpx.AsyncClient:
+    """Pooled client with keep-alive connections, HTTP/2 when available"""
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        timeout=httpx.Timeout(timeout, connect=10.0),
+    )
+
+
+class ChatProvider(ABC):
+    """
+    Args:
+        base_url: API root, eg: https://api.openai.com/v1
+        api_key: sent as a bearer token when given
+        http: shared client, a client of its own is created and closed by aclose() when None
+        limiter: paces the requests, unlimited with retries when None
+    """
+
+    name = "provider"
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str] = None,
+        http: Optional[httpx.AsyncClient] = None,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self._base_url = base_url.rstrip("/")
+        self._headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._own_http = http is None
+        self._http = http or create_http_client()
+        self._limiter = limiter or RateLimiter()
+        self._requests = 0
+
+    @property
+    def requests(self) -> int:
+        return self._requests
+
+    @property
+    def limiter(self) -> RateLimiter:
+        return self._limiter
+
+    async def chat(
+        self, model: str, messages: Messages, stream: bool = False
+    ) -> Union[dict, AsyncIterator[dict]]:
+        """
+        Answer in the ollama.AsyncClient shape: {"message": {"content": ...}}
+
+        With stream, an async iterator of such chunks, each holding the next piece of the answer.
+        Closing it early closes the response, the server stops generating
+        """
+        if stream:
+            return self._stream(model, messages)
+        start = time.perf_counter()
+        reserved = self._reserve(messages)
+        response = await self._send(self._payload(model, messages, False), reserved)
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        body = response.json()
+        self._limiter.settle(reserved, self._usage(body))
+        logger.debug(
+            f"{self.name} answered in {time.perf_counter() - start:.4f}s over {response.http_version}"
+        )
+        return {"message": {"role": "assistant", "content": self._content(body)}}
+
+    async def aclose(self) -> None:
+        if self._own_http:
+            await self._http.aclose()
+
+    async def _stream(self, model: str, messages: Messages) -> AsyncIterator[dict]:
+        start = time.perf_counter()
+        reserved = self._reserve(messages)
+        response = await self._send(self._payload(model, messages, True), reserved)
+        used = None
+        try:
+            async for line in response.aiter_lines():
+                chunk = self._chunk(line)
+                if chunk is None:
+                    continue
+                used = self._usage(chunk) or used
+                content = self._delta(chunk)
+                if content:
+                    yield {"message": {"role": "assistant", "content": content}}
+        finally:
+            await response.aclose()
+            self._limiter.settle(reserved, used)
+            logger.debug(
+                f"{self.name} streamed for {time.perf_counter() - start:.4f}s over {response.http_version}"
+            )
+
+    @staticmethod
+    def _reserve(messages: Messages) -> int:
+        # the answer of a translation is about as long as the row, the reported usage corrects it
+        return 2 * sum(estimate_tokens(m["content"]) for m in messages)
+
+    async def _send(self, payload: dict, reserved: int) -> httpx.Response:
+        """Response with its body still unread, throttled and failed attempts are retried"""
+        request = self._http.build_request(
+            "POST",
+            f"{self._base_url}{self._path()}",
+            json=payload,
+            headers=self._headers,
+        )
+        attempt = 0
+        while True:
+            await self._limiter.acquire(reserved)
+            self._requests += 1
+            try:
+                response = await self._http.send(request, stream=True)
+            except httpx.TransportError as e:
+                # a request that never got an answer used none of the token budget
+                self._limiter.settle(reserved, 0)
+                if (delay := self._limiter.backoff(attempt, None)) is None:
+                    raise
+                logger.warning(
+                    f"{self.name} request failed: {e}, retrying in {delay:.2f}s"
+                )
+                attempt += 1
+                continue
+            if response.is_error:
+                # the body holds the error message, read it before the response is closed
+                await response.aread()
+                await response.aclose()
+                # a rejected request used none of the token budget
+                self._limiter.settle(reserved, 0)
+                if response.status_code in RETRY_STATUS:
+                    retry_after = parse_retry_after(response.headers.get("retry-after"))
+                    delay = self._limiter.backoff(attempt, retry_after)
+                    if delay is not None:
+                        logger.warning(
+                            f"{self.name} answered {response.status_code}, retrying in {delay:.2f}s"
+                        )
+                        attempt += 1
+                        continue
+                response.raise_for_status()
+            return response
+
+    @abstractmethod
+    def _path(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _payload(self, model: str, messages: Messages, stream: bool) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _content(self, body: dict) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _chunk(self, line: str) -> Optional[dict]:
+        """Body of one line of a streamed response, None for lines without one"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def _delta(self, chunk: dict) -> Optional[str]:
+        """Piece of the answer in a streamed chunk"""
+        raise NotImplementedError
+
+    def _usage(self, body: dict) -> Optional[int]:
+        """Tokens the request used, None when the answer does not tell"""
+        return None
+
+
+class OllamaProvider(ChatProvider):
+    """Ollama /api/chat, streamed as one JSON object per line"""
+
+    name = "ollama"
+
+    def _path(self) -> str:
+        return "/api/chat"
+
+    def _payload(self, model: str, messages: Messages, stream: bool) -> dict:
+        return {"model": model, "messages": messages, "stream": stream}
+
+    def _content(self, body: dict) -> str:
+        return body["message"]["content"]
+
+    def _chunk(self, line: str) -> Optional[dict]:
+        return json.loads(line) if line.strip() else None
+
+    def _delta(self, chunk: dict) -> Optional[str]:
+        return (chunk.get("message") or {}).get("content")
+
+    def _usage(self, body: dict) -> Optional[int]:
+        if "eval_count" not in body:
+            return None
+        return body.get("prompt_eval_count", 0) + body["eval_count"]
+
+
+class OpenAIProvider(ChatProvider):
+    """OpenAI-compatible /chat/completions, also used by DeepSeek, Gemini and local servers. Streamed as server-sent events"""
+
+    name = "openai"
+
+    def _path(self) -> str:
+        return "/chat/completions"
+
+    def _payload(self, model: str, messages: Messages, stream: bool) -> dict:
+        return {"model": model, "messages": messages, "stream": stream}
+
+    def _content(self, body: dict) -> str:
+        return body["choices"][0]["message"]["content"]
+
+    def _chunk(self, line: str) -> Optional[dict]:
+        if not line.startswith("data:"):
+            return None
+        data = line[len("data:") :].strip()
+        return None if data == "[DONE]" else json.loads(data)
+
+    def _delta(self, chunk: dict) -> Optional[str]:
+        # the last chunk may only carry the usage, without choices
+        choices = chunk.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content")
+
+    def _usage(self, body: dict) -> Optional[int]:
+        return (body.get("usage") or {}).get("total_tokens")
+
+
+class ProviderSpec(NamedTuple):
+    provider: type
+    base_url: str
+    api_key_env: Optional[str]  # key in .env
+    model: str  # default model
+    limits: RateLimits = RateLimits()  # budgets of the default model on the entry tier
+
+
+PROVIDERS: Dict[str, ProviderSpec] = {
+    "ollama": ProviderSpec(OllamaProvider, "http://127.0.0.1:11434", None, "qwen3:8b"),
+    "gpt": ProviderSpec(
+        OpenAIProvider,
+        "https://api.openai.com/v1",
+        "OPENAI_API_KEY",
+        "gpt-4o-mini",
+        RateLimits(rpm=500, tpm=200000),
+    ),
+    "deepseek": ProviderSpec(
+        OpenAIProvider,
+        "https://api.deepseek.com/v1",
+        "DEEPSEEK_API_KEY",
+        "deepseek-chat",
+    ),
+    "gemini": ProviderSpec(
+        OpenAIProvider,
+        "https://generativelanguage.googleapis.com/v1beta/openai",
+        "GEMINI_API_KEY",
+        "gemini-2.0-flash",
+        RateLimits(rpm=15, tpm=1000000),
+    ),
+    # any OpenAI-compatible server, give its url
+    "openai": ProviderSpec(OpenAIProvider, "http://127.0.0.1:8000/v1", None, ""),
+}
+
+# names --provider took before the HTTP providers, kept so they fail with a way forward
+RETIRED_PROVIDERS: Dict[str, str] = {
+    "cursor": "cursor has no API to send rows to, use gpt, deepseek or gemini, "
+    "or openai with --provider-url for any OpenAI-compatible server",
+    "X-ALMA": "X-ALMA is a local model, serve it from an OpenAI-compatible server (eg. vLLM) "
+    "and use --provider openai --provider-url <its /v1 url> --mt-model <its model name>",
+}
+
+
+def create_provider(
+    name: str,
+    env: Optional[Dict[str, str]] = None,
+    http: Optional[httpx.AsyncClient] = None,
+    base_url: Optional[str] = None,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+) -> ChatProvider:
+    """
+    Provider by name
+
+    Args:
+        name: key of PROVIDERS
+        env: .env values, the API key is read from them
+        http: shared client
+        base_url: overrides the default url of the provider
+        rpm: overrides the requests per minute of PROVIDERS[name].limits
+        tpm: overrides the tokens per minute of PROVIDERS[name].limits
+
+    Returns:
+        ChatProvider: provider, its default model is PROVIDERS[name].model
+    """
+    if name in RETIRED_PROVIDERS:
+        raise ValueError(
+            f"Provider {name} is no longer supported: {RETIRED_PROVIDERS[name]}"
+        )
+    spec = PROVIDERS.get(name)
+    if spec is None:
+        raise ValueError(
+            f"Unsupported provider: {name}, available: {', '.join(PROVIDERS)}"
+        )
+    api_key = (env or {}).get(spec.api_key_env) if spec.api_key_env else None
+    if spec.api_key_env and not api_key:
+        raise ValueError(f"{spec.api_key_env} is not set in .env")
+    limits = RateLimits(rpm or spec.limits.rpm, tpm or spec.limits.tpm)
+    return spec.provider(
+        base_url or spec.base_url,
+        api_key=api_key,
+        http=http,
+        limiter=RateLimiter(limits),
+    )
@@ -0,0 +1,191 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple, Optional
+
+from loguru import logger
+
+"""
+    RateLimiter paces the requests of a chat provider to its requests-per-minute and tokens-per-minute limits.
+    Both limits are token buckets that refill continuously, a request waits until both hold its share.
+    A throttled answer (429, Retry-After) pauses every request of the provider, not only the throttled one,
+    so the run slows down to the sustainable rate instead of stopping.
+"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds of a Retry-After header, given as seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Args:
+        rate: tokens added per second
+        capacity: tokens the bucket holds, the largest burst
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity <= 0:
+            raise ValueError(
+                f"rate and capacity must be positive, got {rate}, {capacity}"
+            )
+        self._rate = rate
+        self._capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+
+    @property
+    def level(self) -> float:
+        self._refill()
+        return self._level
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available, amounts over the capacity wait for a full bucket"""
+        missing = min(amount, self._capacity) - self.level
+        return max(missing / self._rate, 0.0)
+
+    def consume(self, amount: float) -> None:
+        """Take amount, the level may go below zero, later requests wait for the debt"""
+        self._refill()
+        self._level -= amount
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self._level = min(self._level + amount, self._capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(
+            self._level + (now - self._updated) * self._rate, self._capacity
+        )
+        self._updated = now
+
+
+class RateLimits(NamedTuple):
+    rpm: Optional[float] = None  # requests per minute, None is unlimited
+    tpm: Optional[float] = None  # tokens per minute, None is unlimited
+
+
+class RateLimiter:
+    """
+    Args:
+        limits: budgets of the provider
+        burst: share of a minute of budget that can go out at once
+        max_retries: throttled or failed attempts of one request before it fails
+        base_delay: first backoff in seconds when the answer has no Retry-After, doubled per attempt
+        max_delay: longest backoff in seconds
+    """
+
+    def __init__(
+        self,
+        limits: RateLimits = RateLimits(),
+        burst: float = 0.1,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self._limits = limits
+        self._requests = (
+            TokenBucket(limits.rpm / 60, max(limits.rpm * burst, 1.0))
+            if limits.rpm
+            else None
+        )
+        self._tokens = (
+            TokenBucket(limits.tpm / 60, max(limits.tpm * burst, 1.0))
+            if limits.tpm
+            else None
+        )
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+        self._acquired = 0
+        self._throttled = 0
+        self._waited = 0.0
+
+    @property
+    def limits(self) -> RateLimits:
+        return self._limits
+
+    @property
+    def throttled(self) -> int:
+        return self._throttled
+
+    @property
+    def waited(self) -> float:
+        """Seconds requests spent waiting for their budget"""
+        return self._waited
+
+    async def acquire(self, tokens: float) -> None:
+        """Wait until the budget has room for one request of about tokens tokens, then take it"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # one waiter at a time, requests go out in arrival order and a large one is not starved
+        async with self._lock:
+            while (wait := self._wait_time(tokens)) > 0:
+                self._waited += wait
+                await asyncio.sleep(wait)
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                self._tokens.consume(tokens)
+            self._acquired += 1
+
+    def settle(self, reserved: float, used: Optional[float]) -> None:
+        """Correct the token budget by the usage the provider reported, reserved stays taken when used is None"""
+        if self._tokens is None or used is None:
+            return
+        if used > reserved:
+            self._tokens.consume(used - reserved)
+        else:
+            self._tokens.refund(reserved - used)
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        """
+        Pause every request after a throttled or failed attempt
+
+        Args:
+            attempt: failed attempts of the request so far, from 0
+            retry_after: seconds asked by the provider, exponential backoff with jitter when None
+
+        Returns:
+            Optional[float]: seconds paused, None when the request is out of retries
+        """
+        if attempt >= self._max_retries:
+            return None
+        self._throttled += 1
+        delay = (
+            retry_after
+            if retry_after is not None
+            else min(self._base_delay * 2**attempt, self._max_delay)
+            * random.uniform(0.5, 1.0)
+        )
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Rate limiter {self._limits}: {self._acquired} requests, {self._throttled} throttled, "
+            f"{self._waited:.2f}s waited for budget"
+        )
+
+    def _wait_time(self, tokens: float) -> float:
+        wait = self._paused_until - time.monotonic()
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(tokens))
+        return wait
@@ -0,0 +1,158 @@
+import re
+from enum import Enum
+from typing import Set
+
+"""
+    ResponseStream reads a streamed model answer chunk by chunk.
+    Thinking is dropped as it arrives, only its length is kept, the answer is kept as it grows.
+    feed() tells the reader to stop once the answer of a batch is complete, or when the response runs away:
+    an answer longer than max_ratio times the source plus slack, or thinking longer than its own budget.
+    A runaway is a failed request, its rows are not translated.
+"""
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+# thinking of a reasoning model does not scale with the row, it has a budget of its own
+MAX_THINK_CHARS = 32768
+
+
+class RunawayResponse(Exception):
+    """A streamed response passed its length limit and was cut off"""
+
+
+class Regexes(Enum):
+    # a whole line holding a batch marker, eg: @@3@@
+    BATCH_MARKER_LINE = re.compile(r"[ \t]*@@(\d+)@@[ \t\r]*")
+
+
+class ResponseStream:
+    """
+    Args:
+        source: text sent for translation without the prompt, bounds the response length
+        rows: rows of a batch request, the answer is complete when a marker after all of them starts.
+            0 for a single row, its answer is complete when the stream ends
+        max_ratio: answer chars allowed per source char, thinking excluded
+        slack: answer chars allowed on top, room for the answer of short rows
+        max_think_chars: thinking chars allowed
+    """
+
+    def __init__(
+        self,
+        source: str,
+        rows: int = 0,
+        max_ratio: float = 4.0,
+        slack: int = 256,
+        max_think_chars: int = MAX_THINK_CHARS,
+    ):
+        self._rows = rows
+        self._max_chars = int(len(source) * max_ratio) + slack
+        self._max_think_chars = max_think_chars
+        self._answer = []
+        self._answer_chars = 0
+        # text that may still be the start of a tag, eg: "<thi"
+        self._pending = ""
+        self._in_think = False
+        self._thought = False
+        self._think_chars = 0
+        # answer line not checked for a batch marker yet, and its offset in the answer
+        self._line = ""
+        self._line_start = 0
+        self._markers: Set[int] = set()
+
+        self._complete = False
+        self._runaway = False
+
+    @property
+    def complete(self) -> bool:
+        """The answer of every batch row is in, the rest of the stream is not needed"""
+        return self._complete
+
+    @property
+    def runaway(self) -> bool:
+        return self._runaway
+
+    @property
+    def think_chars(self) -> int:
+        """Thinking chars dropped"""
+        return self._think_chars
+
+    @property
+    def response(self) -> str:
+        """
+        The answer as a full response, an empty thinking block stands for the dropped thinking,
+        so extract_translation and parse_batch read it like the unstreamed response
+        """
+        answer = "".join(self._answer)
+        return f"{THINK_OPEN}{THINK_CLOSE}{answer}" if self._thought else answer
+
+    def feed(self, delta: str) -> bool:
+        """Add a chunk, returns False when the reader should stop the stream"""
+        if self._complete or self._runaway:
+            return False
+        text = self._pending + delta
+        self._pending = ""
+        while text:
+            tag = THINK_CLOSE if self._in_think else THINK_OPEN
+            found = text.find(tag)
+            if found < 0:
+                # keep a possible partial tag for the next chunk
+                keep = _partial_tag(text, tag)
+                self._take(text[: len(text) - keep])
+                self._pending = text[len(text) - keep :]
+                break
+            self._take(text[:found])
+            text = text[found + len(tag) :]
+            self._in_think = not self._in_think
+            self._thought = True
+            if self._complete:
+                break
+
+        if (
+            self._answer_chars > self._max_chars
+            or self._think_chars > self._max_think_chars
+        ):
+            self._runaway = True
+        return not (self._complete or self._runaway)
+
+    def _take(self, text: str) -> None:
+        if not text or self._complete:
+            return
+        if self._in_think:
+            self._think_chars += len(text)
+            return
+        self._answer.append(text)
+        self._answer_chars += len(text)
+        if self._rows:
+            self._check_markers(text)
+
+    def _check_markers(self, text: str) -> None:
+        """Cut the answer at the marker line that follows a complete batch"""
+        self._line += text
+        while (newline := self._line.find("\n")) >= 0:
+            if self._is_extra_marker(self._line[:newline]):
+                answer = "".join(self._answer)[: self._line_start]
+                self._answer = [answer]
+                self._answer_chars = len(answer)
+                return
+            self._line = self._line[newline + 1 :]
+            self._line_start += newline + 1
+
+    def _is_extra_marker(self, line: str) -> bool:
+        marker = Regexes.BATCH_MARKER_LINE.value.fullmatch(line)
+        if marker is None:
+            return False
+        number = int(marker.group(1))
+        if 1 <= number <= self._rows and number not in self._markers:
+            self._markers.add(number)
+            return False
+        # out of range or repeated, once every row is in the model is only adding rows or starting over
+        self._complete = len(self._markers) == self._rows
+        return self._complete
+
+
+def _partial_tag(text: str, tag: str) -> int:
+    """Length of the longest end of text that starts tag"""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
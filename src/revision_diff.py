@@ -0,0 +1,245 @@
+import asyncio
+import csv
+import importlib
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from .differentiator import Differentiator
+from .js_parser import JSParser
+from .twee_parser import TweeParser
+
+"""
+    RevisionDiff extracts only the .twee/.js files changed between two git revisions of the game
+    and writes the rows which are not in the previous raw dicts as delta CSVs.
+    Files are read from git objects, the game checkout does not need to be at either revision.
+    The built-in .twee rule only approximates the rules of the raw dict extraction (ParseTwee), which are not part
+    of this package. The delta can hold rows the extraction never writes and miss rows it writes,
+    pass the real rules as line_flags, eg: with load_line_flags, for a delta matching the raw dicts.
+"""
+
+GAME_SUFFIXES = (".twee", ".js")
+
+# (file path, lines) -> whether each line is translatable, the contract of ParseTwee.parse and ParseJS.parse
+LineFlags = Callable[[Path, List[str]], List[bool]]
+
+
+def load_line_flags(spec: str) -> LineFlags:
+    """LineFlags callable named "module:function", eg: my_rules.twee:line_flags"""
+    module_name, _, function_name = spec.partition(":")
+    if not module_name or not function_name:
+        raise ValueError(f"Expected module:function, got {spec}")
+    line_flags = getattr(importlib.import_module(module_name), function_name)
+    if not callable(line_flags):
+        raise TypeError(f"{spec} is not callable")
+    return line_flags
+
+
+def default_line_flags(file_path: Path, lines: List[str]) -> List[bool]:
+    """
+    Line flags of the built-in parsers: JSParser literals for .js, text lines for .twee.
+    The .twee rule is a heuristic, not the rules of ParseTwee
+    """
+    if file_path.suffix == ".js":
+        parser = JSParser("\n".join(lines), file_path)
+        return parser.to_line_flags(parser.parse())
+
+    flags = []
+    for line in lines:
+        line = line.strip()
+        flags.append(
+            bool(line)
+            and not TweeParser.is_comment(line)
+            and not TweeParser.is_event(line)
+            and not TweeParser.is_only_marks(line)
+            and not TweeParser.is_only_widgets(line)
+        )
+    return flags
+
+
+class RevisionDelta(NamedTuple):
+    path: Path  # game file relative to the game root
+    rows: int  # rows extracted at the new revision, 0 for deleted files
+    delta_rows: int  # rows not in the previous raw dict
+    deleted: bool
+
+
+class RevisionDiff:
+    """
+    Delta of the raw dicts between two game revisions
+
+    Args:
+        repo_path: git checkout of the game
+        old_rev: revision the raw dicts were dumped from, eg: a release tag
+        new_rev: revision to extract
+        raw_files_path: raw dicts of old_rev
+        delta_files_path: output, one CSV per changed file with its new rows
+        game_dir: game root inside the repository, raw dict paths are relative to it
+        updated_raw_path: optional output of the complete re-extracted raw dicts of the changed files
+        blacklist: .twee files to skip, same format as dicts/blacklists.json
+        whitelist: .js files to extract, same format as dicts/whitelists.json. None extracts every .js file
+        line_flags: extraction rule, defaults to default_line_flags
+        max_workers: concurrent git reads
+    """
+
+    def __init__(
+        self,
+        repo_path: Path,
+        old_rev: str,
+        new_rev: str,
+        raw_files_path: Path,
+        delta_files_path: Path,
+        game_dir: str = "game",
+        updated_raw_path: Optional[Path] = None,
+        blacklist: Optional[List[str]] = None,
+        whitelist: Optional[List[str]] = None,
+        line_flags: Optional[LineFlags] = None,
+        max_workers: int = 8,
+    ):
+        self._repo_path = Path(repo_path)
+        self._old_rev = old_rev
+        self._new_rev = new_rev
+        self._raw_files_path = Path(raw_files_path)
+        self._delta_files_path = Path(delta_files_path)
+        self._game_dir = PurePosixPath(game_dir)
+        self._updated_raw_path = updated_raw_path
+        # list entries use backslashes, like the paths DictionaryHelper compares them with
+        self._blacklist: Set[str] = set(blacklist or [])
+        self._whitelist: Optional[Set[str]] = (
+            set(whitelist) if whitelist is not None else None
+        )
+        self._line_flags = line_flags or default_line_flags
+        self._max_workers = max_workers
+        self._deltas: List[RevisionDelta] = []
+
+    @property
+    def deltas(self) -> List[RevisionDelta]:
+        return self._deltas
+
+    async def create_delta(self) -> List[RevisionDelta]:
+        """Extract the changed files at new_rev and write their delta CSVs"""
+        changed = await self.changed_files()
+        logger.info(
+            f"{len(changed)} game files changed between {self._old_rev} and {self._new_rev}"
+        )
+
+        semaphore = asyncio.Semaphore(self._max_workers)
+
+        async def process(relative_path: Path) -> RevisionDelta:
+            async with semaphore:
+                content = await self._show(relative_path)
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self._delta_file, relative_path, content
+            )
+
+        self._deltas = list(await asyncio.gather(*(process(p) for p in changed)))
+
+        deleted = sum(delta.deleted for delta in self._deltas)
+        delta_rows = sum(delta.delta_rows for delta in self._deltas)
+        extracted = sum(delta.rows for delta in self._deltas)
+        logger.info(
+            f"Wrote {delta_rows} delta rows of {extracted} extracted rows "
+            f"from {len(self._deltas) - deleted} files, {deleted} files deleted"
+        )
+        return self._deltas
+
+    async def changed_files(self) -> List[Path]:
+        """Extractable game files changed between the revisions, relative to the game root"""
+        output = await self._git(
+            "diff",
+            "--name-only",
+            "--no-renames",
+            "-z",
+            self._old_rev,
+            self._new_rev,
+            "--",
+            str(self._game_dir),
+        )
+        files = []
+        for name in output.decode("utf-8").split("\0"):
+            if not name:
+                continue
+            relative_path = Path(PurePosixPath(name).relative_to(self._game_dir))
+            if self._is_extractable(relative_path):
+                files.append(relative_path)
+        return sorted(files)
+
+    def _is_extractable(self, relative_path: Path) -> bool:
+        """Same rule as DictionaryHelper.get_preprocess_files_list"""
+        listed_path = str(relative_path).replace("/", "\\")
+        if relative_path.suffix == ".twee":
+            return listed_path not in self._blacklist
+        if relative_path.suffix == ".js":
+            return self._whitelist is None or listed_path in self._whitelist
+        return False
+
+    async def _show(self, relative_path: Path) -> Optional[str]:
+        """Content of the file at new_rev, None if the file was deleted"""
+        git_path = (self._game_dir / PurePosixPath(relative_path.as_posix())).as_posix()
+        try:
+            content = await self._git("show", f"{self._new_rev}:{git_path}")
+        except RuntimeError:
+            return None
+        return content.decode("utf-8")
+
+    def _delta_file(self, relative_path: Path, content: Optional[str]) -> RevisionDelta:
+        """Extract one file and write the rows which are not in its previous raw dict"""
+        csv_path = relative_path.with_suffix(".csv")
+        delta_file = self._delta_files_path / csv_path
+        delta_file.unlink(missing_ok=True)
+        if content is None:
+            return RevisionDelta(relative_path, 0, 0, True)
+
+        rows = self.extract_rows(relative_path, content)
+        if self._updated_raw_path is not None:
+            self._write_rows(Path(self._updated_raw_path) / csv_path, rows)
+
+        old_texts = self._read_raw_texts(self._raw_files_path / csv_path)
+        new_texts = pd.Series([english for _, english in rows], dtype=object)
+        mask = Differentiator.hash_diff_mask(new_texts, old_texts)
+        delta = [row for row, changed in zip(rows, mask) if changed]
+        if delta:
+            self._write_rows(delta_file, delta)
+        return RevisionDelta(relative_path, len(rows), len(delta), False)
+
+    def extract_rows(self, relative_path: Path, content: str) -> List[Tuple[int, str]]:
+        """(line number, text) raw dict rows of a game file"""
+        lines = content.split("\n")
+        flags = self._line_flags(relative_path, lines)
+        return [
+            (number, line.strip())
+            for number, (line, flag) in enumerate(zip(lines, flags), start=1)
+            if flag
+        ]
+
+    @staticmethod
+    def _read_raw_texts(raw_file: Path) -> pd.Series:
+        if not raw_file.is_file() or raw_file.stat().st_size == 0:
+            return pd.Series([], dtype=object)
+        return pd.read_csv(
+            raw_file, header=None, usecols=[1], dtype=str, keep_default_na=False
+        )[1]
+
+    @staticmethod
+    def _write_rows(file_path: Path, rows: List[Tuple[int, str]]) -> None:
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(file_path, "w", encoding="utf-8", newline="") as fp:
+            csv.writer(fp).writerows(rows)
+
+    async def _git(self, *args: str) -> bytes:
+        process = await asyncio.create_subprocess_exec(
+            "git",
+            "-C",
+            str(self._repo_path),
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(
+                f"git {' '.join(args)} failed: {stderr.decode('utf-8', 'replace').strip()}"
+            )
+        return stdout
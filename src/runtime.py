@@ -0,0 +1,122 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+from loguru import logger
+
+from src.providers import create_http_client
+
+"""
+    Runtime owns the event loop, the thread pool, the process pool and the HTTP client of a CLI run.
+    Every stage gets the same runtime, so pools are sized once and closed once at the end of the run.
+"""
+
+
+class Runtime:
+    """
+    Args:
+        max_workers: threads of the shared thread pool, defaults to the number of cores
+        max_processes: processes of the shared process pool, defaults to the number of cores.
+            The process pool is only started when a stage asks for it
+    """
+
+    def __init__(
+        self, max_workers: Optional[int] = None, max_processes: Optional[int] = None
+    ):
+        self._max_workers = max_workers or os.cpu_count()
+        self._max_processes = max_processes or os.cpu_count()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            raise RuntimeError("Runtime is not started, use it with async with")
+        return self._executor
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        """Shared spawn process pool, started on first use"""
+        if self._executor is None:
+            raise RuntimeError("Runtime is not started, use it with async with")
+        if self._process_pool is None:
+            start = time.perf_counter()
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self._max_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.debug(
+                f"Process pool of {self._max_processes} started in {(time.perf_counter() - start) * 1000:.2f}ms"
+            )
+        return self._process_pool
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """Shared pooled HTTP client of the chat providers, created on first use"""
+        if self._executor is None:
+            raise RuntimeError("Runtime is not started, use it with async with")
+        if self._http_client is None:
+            self._http_client = create_http_client()
+        return self._http_client
+
+    async def run_in_thread(self, func: Callable, *args, **kwargs) -> Any:
+        """Run function in the shared thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    async def __aenter__(self) -> "Runtime":
+        start = time.perf_counter()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        # the default executor of the loop is the shared pool, run_in_executor(None, ...) uses it too
+        asyncio.get_running_loop().set_default_executor(self._executor)
+        logger.debug(
+            f"Runtime started with {self._max_workers} threads in {(time.perf_counter() - start) * 1000:.2f}ms"
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        if self._process_pool is not None:
+            # shutdown joins the workers, keep the loop free meanwhile
+            await loop.run_in_executor(None, self._process_pool.shutdown)
+            self._process_pool = None
+        executor, self._executor = self._executor, None
+        executor.shutdown(wait=True)
+        logger.debug(f"Runtime closed in {(time.perf_counter() - start) * 1000:.2f}ms")
+
+    @asynccontextmanager
+    async def stage(self, name: str) -> AsyncIterator[None]:
+        """Log the duration of a pipeline stage"""
+        logger.info(f"{name} started")
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            logger.info(f"{name} finished in {time.perf_counter() - start:.2f}s")
+
+    def run(self, main: Callable[["Runtime"], Awaitable[Any]]) -> Any:
+        """Run main(runtime) in one event loop, the pools are closed afterwards"""
+
+        async def _main():
+            async with self:
+                return await main(self)
+
+        start = time.perf_counter()
+        try:
+            return asyncio.run(_main())
+        finally:
+            logger.info(f"Run finished in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,74 @@
+import re
+from difflib import SequenceMatcher
+from enum import Enum
+from typing import List, NamedTuple, Tuple
+
+"""
+    Split english passages into sentence segments without breaking macros, links or tags,
+    and diff two versions of a passage segment by segment.
+    Segments keep their trailing whitespace, joining all segments gives back the text.
+"""
+
+
+class Regexes(Enum):
+    # protected spans first, so punctuation inside <<macros>>, [[links]] and <tags> never ends a sentence
+    SEGMENT_TOKEN = re.compile(
+        r"<<[\s\S]*?>>"
+        r"|\[\[[\s\S]*?\]\]"
+        r"|<[^<>]*>"
+        # a sentence end takes closing macros and tags right after it, eg: window.<</if>>
+        r"|[.!?…]+[\"'”’)\]]*(?:<</[^<>]*>>|</[^<>]*>)*(?:\s+|$)"
+        r"|\n+"
+    )
+    LINE_BREAK_TAG = re.compile(r"<br\s*/?>", re.IGNORECASE)
+
+
+class SegmentChange(NamedTuple):
+    tag: str  # replace, insert or delete
+    old: Tuple[int, int]  # segment range in the old text
+    new: Tuple[int, int]  # segment range in the new text
+
+
+def split_segments(text: str) -> List[Tuple[int, int]]:
+    """(start, end) of every segment of text"""
+    spans = []
+    start = 0
+    for token in Regexes.SEGMENT_TOKEN.value.finditer(text):
+        value = token.group()
+        if value[0] == "<" and value[:2] != "<<":
+            # tags end a segment only when they break the line
+            if not Regexes.LINE_BREAK_TAG.value.fullmatch(value):
+                continue
+        elif value[:2] in ("<<", "[["):
+            continue
+        if token.end() > start:
+            spans.append((start, token.end()))
+            start = token.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def diff_segments(
+    old_text: str, new_text: str
+) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]], List[SegmentChange]]:
+    """
+    Segment level diff of two versions of a passage
+
+    Returns:
+        Tuple: old segments, new segments, changes. Segments are compared ignoring surrounding whitespace
+    """
+    old_spans = split_segments(old_text)
+    new_spans = split_segments(new_text)
+    matcher = SequenceMatcher(
+        None,
+        [old_text[start:end].strip() for start, end in old_spans],
+        [new_text[start:end].strip() for start, end in new_spans],
+        autojunk=False,
+    )
+    changes = [
+        SegmentChange(tag, (i1, i2), (j1, j2))
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+    return old_spans, new_spans, changes
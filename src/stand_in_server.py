@@ -0,0 +1,316 @@
+import asyncio
+import json
+import time
+from typing import Callable, List, Optional
+
+import click
+from loguru import logger
+
+from src.rate_limiter import TokenBucket
+from src.token_counter import estimate_tokens
+from src.translation_engine import parse_batch
+
+"""
+    StandInServer is a local chat server for tests and throughput benchmarks of the providers.
+    It speaks the OpenAI /v1/chat/completions and the Ollama /api/chat APIs over HTTP/1.1 keep-alive,
+    and answers after a fixed latency without any model.
+    With rpm set it throttles like a hosted API, requests over the limit get 429 and a Retry-After.
+    Streamed requests get the answer in small chunked pieces, a client closing the stream early is counted.
+"""
+
+
+def stand_in_reply(content: str) -> str:
+    """Upper-cased rows of a batch request, or the upper-cased last line of a single row request"""
+    rows = parse_batch(content, len(content))
+    if rows:
+        return "\n".join(f"@@{n}@@\n{text.upper()}" for n, text in rows.items())
+    return content.rsplit("\n", 1)[-1].upper()
+
+
+class StandInServer:
+    """
+    Args:
+        latency: seconds before every answer
+        reply: answer to the last user message, defaults to stand_in_reply
+        host: interface to listen on
+        port: 0 picks a free port
+        rpm: requests per minute before answering 429, unlimited when None
+        piece_chars: chars of the answer per streamed piece
+        piece_latency: seconds to generate a piece, an unstreamed answer waits for all of its pieces
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        reply: Optional[Callable[[str], str]] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        rpm: Optional[float] = None,
+        piece_chars: int = 8,
+        piece_latency: float = 0.0,
+    ):
+        self._latency = latency
+        self._reply = reply or stand_in_reply
+        self._host = host
+        self._port = port
+        self._server: Optional[asyncio.base_events.Server] = None
+        # a little burst room, clients pacing at exactly rpm are not throttled by network jitter
+        self._budget = TokenBucket(rpm / 60, 2) if rpm else None
+        self._piece_chars = piece_chars
+        self._piece_latency = piece_latency
+
+        self._requests = 0
+        self._connections = 0
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._throttled = 0
+        self._streams_cut = 0
+        self._pieces_sent = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self._host}:{self._port}"
+
+    @property
+    def requests(self) -> int:
+        return self._requests
+
+    @property
+    def connections(self) -> int:
+        """TCP connections accepted, lower than requests when clients keep connections alive"""
+        return self._connections
+
+    @property
+    def max_in_flight(self) -> int:
+        return self._max_in_flight
+
+    @property
+    def throttled(self) -> int:
+        """Requests answered 429"""
+        return self._throttled
+
+    @property
+    def streams_cut(self) -> int:
+        """Streamed answers the client closed before their end"""
+        return self._streams_cut
+
+    @property
+    def pieces_sent(self) -> int:
+        return self._pieces_sent
+
+    async def __aenter__(self) -> "StandInServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Stand-in server listening on {self.url}")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload, extra = await self._answer(method, path, body)
+                if isinstance(payload, list):
+                    if not await self._write_stream(reader, writer, payload):
+                        break
+                    continue
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"{extra}"
+                    f"Connection: keep-alive\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _write_stream(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        pieces: List[bytes],
+    ) -> bool:
+        """Send pieces with chunked encoding, False when the client closed the connection first"""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+        )
+        for piece in pieces:
+            await asyncio.sleep(self._piece_latency)
+            if reader.at_eof():
+                self._streams_cut += 1
+                return False
+            writer.write(f"{len(piece):x}\r\n".encode("latin-1") + piece + b"\r\n")
+            await writer.drain()
+            self._pieces_sent += 1
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    def _pieces(self, path: str, model: str, content: str, usage: dict) -> List[bytes]:
+        """Streamed answer, JSON lines for Ollama and server-sent events for OpenAI"""
+        texts = [
+            content[i : i + self._piece_chars]
+            for i in range(0, len(content), self._piece_chars)
+        ]
+        if path == "/api/chat":
+            chunks = [
+                {
+                    "model": model,
+                    "message": {"role": "assistant", "content": text},
+                    "done": False,
+                }
+                for text in texts
+            ]
+            chunks.append(
+                {
+                    "model": model,
+                    "message": {"role": "assistant", "content": ""},
+                    "done": True,
+                    "prompt_eval_count": usage["prompt_tokens"],
+                    "eval_count": usage["completion_tokens"],
+                }
+            )
+            return [
+                json.dumps(c, ensure_ascii=False).encode("utf-8") + b"\n"
+                for c in chunks
+            ]
+        chunks = [
+            {
+                "id": f"chatcmpl-{self._requests}",
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": {"content": text}, "finish_reason": None}
+                ],
+            }
+            for text in texts
+        ]
+        chunks.append(
+            {
+                "id": f"chatcmpl-{self._requests}",
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [],
+                "usage": usage,
+            }
+        )
+        return [
+            b"data: " + json.dumps(c, ensure_ascii=False).encode("utf-8") + b"\n\n"
+            for c in chunks
+        ] + [b"data: [DONE]\n\n"]
+
+    async def _answer(self, method: str, path: str, body: bytes):
+        """Status line, JSON body and extra header lines of the answer, the body is a list of pieces when streamed"""
+        if method != "POST" or path not in ("/v1/chat/completions", "/api/chat"):
+            return "404 Not Found", {"error": f"no route {method} {path}"}, ""
+
+        if self._budget is not None:
+            if (wait := self._budget.wait_time(1)) > 0:
+                self._throttled += 1
+                return (
+                    "429 Too Many Requests",
+                    {"error": {"message": "Rate limit reached", "type": "requests"}},
+                    f"Retry-After: {wait:.3f}\r\n",
+                )
+            self._budget.consume(1)
+
+        self._requests += 1
+        self._in_flight += 1
+        self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        try:
+            request = json.loads(body)
+            await asyncio.sleep(self._latency)
+            content = self._reply(request["messages"][-1]["content"])
+        finally:
+            self._in_flight -= 1
+
+        message = {"role": "assistant", "content": content}
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in request["messages"])
+        completion_tokens = estimate_tokens(content)
+        if request.get("stream"):
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+            return "200 OK", self._pieces(path, request["model"], content, usage), ""
+        await asyncio.sleep(self._piece_latency * -(-len(content) // self._piece_chars))
+        if path == "/api/chat":
+            return (
+                "200 OK",
+                {
+                    "model": request["model"],
+                    "message": message,
+                    "done": True,
+                    "prompt_eval_count": prompt_tokens,
+                    "eval_count": completion_tokens,
+                },
+                "",
+            )
+        return (
+            "200 OK",
+            {
+                "id": f"chatcmpl-{self._requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+            "",
+        )
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8000, show_default=True)
+@click.option("--latency", default=0.2, show_default=True, help="Seconds per answer.")
+@click.option("--rpm", type=float, help="Requests per minute before answering 429.")
+def main(host: str, port: int, latency: float, rpm: Optional[float]):
+    """Run a stand-in chat server, eg: --provider openai --provider-url http://127.0.0.1:8000/v1"""
+
+    async def serve():
+        async with StandInServer(latency=latency, host=host, port=port, rpm=rpm):
+            await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import re
+import time
+from enum import Enum
+from functools import lru_cache
+from pathlib import Path
+
+from loguru import logger
+
+"""
+    TokenCounter counts the tokens of the rows sent to the model, for the token budget and batch sizes.
+    The tokenizer is loaded on the first count, a local tokenizer directory loads without network.
+    The estimate mode never loads a tokenizer, it is meant for budget planning.
+"""
+
+DEFAULT_TOKENIZER = "Qwen/Qwen3-8B"
+
+
+class Regexes(Enum):
+    # CJK ideographs, kana, hangul and full-width forms are about one token each
+    WIDE_CHAR = re.compile(
+        r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]"
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Token estimate without a tokenizer, 4 latin chars or 1 CJK char per token"""
+    wide = len(Regexes.WIDE_CHAR.value.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+class TokenCounter:
+    """
+    Args:
+        tokenizer: Hugging Face model name or local tokenizer directory
+        estimate: count with estimate_tokens, the tokenizer is never loaded
+        use_fast: load the fast (Rust) tokenizer
+        cache_size: memoised counts, rows are counted again for the budget and the batch size
+    """
+
+    def __init__(
+        self,
+        tokenizer: str = DEFAULT_TOKENIZER,
+        estimate: bool = False,
+        use_fast: bool = True,
+        cache_size: int = 1 << 16,
+    ):
+        self._tokenizer_name = str(tokenizer)
+        self._estimate = estimate
+        self._use_fast = use_fast
+        self._tokenizer = None
+        self._count = lru_cache(maxsize=cache_size)(self._count_uncached)
+
+    @property
+    def estimate(self) -> bool:
+        return self._estimate
+
+    @property
+    def tokenizer(self):
+        """The tokenizer, loaded on first use"""
+        if self._tokenizer is None:
+            # transformers takes seconds to import, only pay for it when a count needs it
+            from transformers import AutoTokenizer
+
+            start = time.perf_counter()
+            local = Path(self._tokenizer_name).is_dir()
+            self._tokenizer = AutoTokenizer.from_pretrained(
+                self._tokenizer_name,
+                trust_remote_code=True,
+                use_fast=self._use_fast,
+                local_files_only=local,
+            )
+            logger.info(
+                f"Loaded tokenizer {self._tokenizer_name} in {time.perf_counter() - start:.2f}s"
+            )
+        return self._tokenizer
+
+    def count(self, text: str) -> int:
+        return self._count(text)
+
+    def cache_info(self):
+        return self._count.cache_info()
+
+    def _count_uncached(self, text: str) -> int:
+        if self._estimate:
+            return estimate_tokens(text)
+        return len(self.tokenizer.tokenize(text))
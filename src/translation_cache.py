@@ -0,0 +1,140 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+"""
+    TranslationCache is a persistent exact-match translation memory of the machine translator.
+    Rows are keyed by (normalised english, model, prompt hash), so a string is sent to the model once
+    for every model and prompt, across files and across runs.
+"""
+
+
+def normalize_source(text: str) -> str:
+    """Cache key of an english text, the same rules as the TextNormalizer defaults"""
+    text = text.replace("\ufeff", "").replace('""', '"')
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def prompt_hash(prompt: str) -> str:
+    """Short stable hash of a prompt, a changed prompt starts a new cache scope"""
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    writes: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TranslationCache:
+    """
+    Args:
+        db_file: SQLite database, created if missing
+        model: model the translations come from
+        prompt: prompt the translations come from, only its hash is stored
+    """
+
+    def __init__(self, db_file: Path, model: str, prompt: str):
+        self._db_file = Path(db_file)
+        self._model = model
+        self._prompt_hash = prompt_hash(prompt)
+
+        self._db_file.parent.mkdir(parents=True, exist_ok=True)
+        # the sync translator runs in a worker thread, the async engine on the loop thread
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self._db_file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous NORMAL survives a crashed process, only an OS crash loses the last commits
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS translations (
+                source TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (source, model, prompt_hash)
+            ) WITHOUT ROWID""")
+        self._connection.commit()
+
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+
+    def __enter__(self) -> "TranslationCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        """Translations of this model and prompt"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM translations WHERE model = ? AND prompt_hash = ?",
+                (self._model, self._prompt_hash),
+            ).fetchone()[0]
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(self._hits, self._misses, self._writes)
+
+    def get(self, text: str) -> Optional[str]:
+        """Cached translation of text, counted as a hit or a miss"""
+        translation = self._select(normalize_source(text))
+        if translation is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return translation
+
+    def put(self, text: str, translation: str) -> None:
+        self.put_many([(text, translation)])
+
+    def put_many(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        """Store (text, translation) pairs in one transaction, a newer translation replaces the old one"""
+        now = time.time()
+        rows: Dict[str, str] = {
+            normalize_source(text): translation for text, translation in pairs
+        }
+        if not rows:
+            return
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                [
+                    (source, self._model, self._prompt_hash, translation, now)
+                    for source, translation in rows.items()
+                ],
+            )
+            self._connection.commit()
+        self._writes += len(rows)
+
+    def log_stats(self) -> None:
+        stats = self.stats
+        logger.info(
+            f"Translation cache: {stats.hits} hits, {stats.misses} misses "
+            f"({stats.hit_rate:.1%} hit rate), {stats.writes} translations stored in {self._db_file}"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _select(self, source: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT translation FROM translations WHERE source = ? AND model = ? AND prompt_hash = ?",
+                (source, self._model, self._prompt_hash),
+            ).fetchone()
+        return row[0] if row else None
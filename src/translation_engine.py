@@ -0,0 +1,436 @@
+import asyncio
+import re
+import time
+from collections import deque
+from enum import Enum
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from loguru import logger
+from ollama import AsyncClient, ChatResponse
+
+from src.markup_masker import MarkupMasker, MaskedText
+from src.providers import ChatProvider
+from src.response_stream import MAX_THINK_CHARS, ResponseStream, RunawayResponse
+from src.prompts import Prompt
+from src.token_counter import estimate_tokens
+from src.translation_cache import TranslationCache
+
+"""
+    TranslationEngine sends rows to an Ollama server concurrently with ollama.AsyncClient,
+    or to any other backend through a ChatProvider of src.providers.
+    At most `concurrency` requests are in flight, match it to the parallel slots of the server (OLLAMA_NUM_PARALLEL).
+    Results are yielded in input order, so an output CSV is always a prefix of its input and resume keeps working.
+    With batch_rows > 1 several rows share one request and one copy of the prompt, marked @@n@@ in and out.
+    With a TranslationCache rows are looked up before any request, only answered rows are stored.
+    With a MarkupMasker markup is sent as {n} placeholders, a row whose placeholders do not come back is retried.
+    With stream answers are read as they are generated, thinking is dropped on the way, a batch stops once
+    every row is in, and an answer longer than max_response_ratio times its rows or thinking past max_think_chars
+    is cut off. The rows of a cut off response are yielded as None, they are not translated nor cached.
+"""
+
+
+class Regexes(Enum):
+    THINK_BLOCK = re.compile(r"<think>[\s\S]*?</think>")
+    # a batch marker on its own line, eg: @@3@@
+    BATCH_MARKER = re.compile(r"^[ \t]*@@(\d+)@@[ \t]*$", re.MULTILINE)
+
+
+def extract_translation(full_response: str) -> str:
+    """trim thinking block from full response"""
+    if "<think>" in full_response and "</think>" in full_response:
+        return full_response.split("</think>", 1)[1].strip()
+
+    # leave last line as result
+    paragraphs = [p.strip() for p in full_response.split("\n\n")]
+    return next((p for p in reversed(paragraphs) if p), full_response)
+
+
+def format_batch(texts: List[str]) -> str:
+    """Rows of a batch request, each after its own @@n@@ line, numbered from 1"""
+    return "\n".join(f"@@{n}@@\n{text}" for n, text in enumerate(texts, start=1))
+
+
+def parse_batch(full_response: str, count: int) -> Dict[int, str]:
+    """
+    Split a batch response into rows
+
+    Args:
+        full_response: model output, thinking blocks are ignored
+        count: rows sent
+
+    Returns:
+        Dict[int, str]: translation by row number (1-based). Numbers out of range, repeated numbers
+            and empty rows are left out, the caller retries them
+    """
+    response = Regexes.THINK_BLOCK.value.sub("", full_response)
+    markers = list(Regexes.BATCH_MARKER.value.finditer(response))
+    rows: Dict[int, str] = {}
+    repeated = set()
+    for marker, following in zip(markers, markers[1:] + [None]):
+        number = int(marker.group(1))
+        end = following.start() if following else len(response)
+        text = response[marker.end() : end].strip()
+        if not 1 <= number <= count or not text:
+            continue
+        if number in rows:
+            repeated.add(number)
+        rows[number] = text
+    for number in repeated:
+        del rows[number]
+    return rows
+
+
+class TranslationEngine:
+    """
+    Args:
+        model: Ollama model name
+        prompt: instruction put in front of every request
+        concurrency: requests in flight at the same time
+        window: rows translated ahead of the oldest unfinished row, defaults to 4 * concurrency * batch_rows.
+            A slow request only stalls the output when the whole window is done behind it
+        host: Ollama server, defaults to OLLAMA_HOST
+        client: AsyncClient or src.providers.ChatProvider to use instead of creating one
+        batch_rows: rows packed into one request, 1 sends every row on its own
+        batch_tokens: token budget of the rows of one request, a longer row goes alone
+        batch_retries: requests for rows missing from a batch answer before they are sent one by one
+        count_tokens: token count of a row, defaults to estimate_tokens
+        cache: translations of the same model and prompt, cached rows are not sent
+        masker: masks markup before sending, the prompt should include Prompt.PLACEHOLDERS
+        stream: read answers as streams, the client needs the stream argument of ollama.AsyncClient.chat
+        max_response_ratio: answer chars allowed per char of the rows sent when streaming, thinking excluded
+        max_think_chars: thinking chars allowed per streamed response
+    """
+
+    def __init__(
+        self,
+        model: str = "qwen3:8b",
+        prompt: str = Prompt.ZH_HANS.value,
+        concurrency: int = 4,
+        window: Optional[int] = None,
+        host: Optional[str] = None,
+        client: Optional[Union[AsyncClient, ChatProvider]] = None,
+        batch_rows: int = 1,
+        batch_tokens: int = 2000,
+        batch_retries: int = 1,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        cache: Optional[TranslationCache] = None,
+        masker: Optional[MarkupMasker] = None,
+        stream: bool = False,
+        max_response_ratio: float = 4.0,
+        max_think_chars: int = MAX_THINK_CHARS,
+    ):
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be positive, got {concurrency}")
+        if batch_rows < 1:
+            raise ValueError(f"batch_rows must be positive, got {batch_rows}")
+        self._model = model
+        self._prompt = prompt
+        self._concurrency = concurrency
+        self._batch_rows = batch_rows
+        self._batch_tokens = batch_tokens
+        self._batch_retries = batch_retries
+        self._count_tokens = count_tokens or estimate_tokens
+        self._window = max(window or concurrency * 4 * batch_rows, concurrency)
+        self._client = client or AsyncClient(host=host)
+        self._slots: Optional[asyncio.Semaphore] = None
+        # point lookups on a local database, fast enough to run on the loop
+        self._cache = cache
+        self._masker = masker
+        self._stream = stream
+        self._max_response_ratio = max_response_ratio
+        self._max_think_chars = max_think_chars
+
+        self._requests = 0
+        self._retried_rows = 0
+        self._runaways = 0
+        self._stopped_early = 0
+        self._think_chars = 0
+
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency
+
+    @property
+    def requests(self) -> int:
+        """Requests sent, retries included"""
+        return self._requests
+
+    @property
+    def retried_rows(self) -> int:
+        """Rows sent again because a batch answer missed them"""
+        return self._retried_rows
+
+    @property
+    def runaways(self) -> int:
+        """Streamed responses cut off for growing past max_response_ratio or max_think_chars"""
+        return self._runaways
+
+    @property
+    def stopped_early(self) -> int:
+        """Streamed batch answers closed once every row was in"""
+        return self._stopped_early
+
+    @property
+    def think_chars(self) -> int:
+        """Thinking chars dropped from streamed responses"""
+        return self._think_chars
+
+    async def translate(self, text: str, lookup: bool = True) -> Optional[str]:
+        """
+        Translate one row, the input is returned when the request fails, None when the response ran away
+
+        Args:
+            text: row to translate
+            lookup: look the row up in the cache first, False when the caller already missed it
+        """
+        if lookup and self._cache is not None:
+            cached = self._cache.get(text)
+            if cached is not None:
+                return cached
+        return await self._translate_uncached(text)
+
+    async def translate_batch(
+        self, texts: List[str], lookup: bool = True
+    ) -> List[Optional[str]]:
+        """
+        Translate rows in one request
+
+        Rows missing from the answer, or answered twice, are sent again as a smaller batch,
+        rows still missing after batch_retries go one per request.
+        Rows whose single request ran away are None. lookup is the one of translate.
+        """
+        results: List[Optional[str]] = [None] * len(texts)
+        todo = list(range(len(texts)))
+        if lookup and self._cache is not None:
+            for index, text in enumerate(texts):
+                results[index] = self._cache.get(text)
+            todo = [index for index in todo if results[index] is None]
+        masked = {index: self._mask(texts[index]) for index in todo}
+        for index in todo:
+            if not masked[index].has_text:
+                # only markup, nothing to translate
+                results[index] = texts[index]
+        todo = [index for index in todo if results[index] is None]
+        sent = False
+        for attempt in range(self._batch_retries + 1):
+            if len(todo) < 2:
+                break
+            if attempt:
+                self._retried_rows += len(todo)
+            sent = True
+            batch = [masked[index].text for index in todo]
+            rows = format_batch(batch)
+            try:
+                response = await self._chat(
+                    self._prompt + Prompt.BATCH.value.format(count=len(batch)) + rows,
+                    rows,
+                    len(batch),
+                )
+            except RunawayResponse:
+                # one row may be to blame, the rows go alone
+                break
+            if response is None:
+                break
+            rows = parse_batch(response, len(batch))
+            missing = []
+            answered = []
+            for number, index in enumerate(todo, start=1):
+                translation = rows.get(number)
+                if translation is not None:
+                    translation = self._unmask(masked[index], translation)
+                if translation is None:
+                    missing.append(index)
+                    continue
+                results[index] = translation
+                answered.append((texts[index], translation))
+            if self._cache is not None:
+                self._cache.put_many(answered)
+            if missing:
+                logger.debug(f"Batch answer missed {len(missing)} of {len(batch)} rows")
+            todo = missing
+
+        if todo:
+            if sent:
+                self._retried_rows += len(todo)
+            singles = await asyncio.gather(
+                *(self._translate_uncached(texts[i], masked[i]) for i in todo)
+            )
+            for index, translation in zip(todo, singles):
+                results[index] = translation
+        return results
+
+    async def translate_ordered(
+        self, texts: Iterable[str], lookup: bool = True
+    ) -> AsyncIterator[Tuple[int, Optional[str]]]:
+        """
+        Translate texts concurrently
+
+        Args:
+            texts: rows to translate, consumed lazily as the window moves on
+            lookup: look the rows up in the cache first, False when the caller already missed them
+
+        Returns:
+            AsyncIterator[Tuple[int, Optional[str]]]: (index, translation) in input order,
+                the translation is None when the response ran away.
+                Requests still in flight are cancelled when the caller stops iterating
+        """
+        # (row indexes, task) per request, oldest first
+        pending: deque = deque()
+        pending_rows = 0
+        batches = self._batches(texts)
+        try:
+            while True:
+                # keep the window full, the semaphore limits what actually runs
+                while pending_rows < self._window:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    indexes = [index for index, _ in batch]
+                    batch_texts = [text for _, text in batch]
+                    job = (
+                        self.translate_batch(batch_texts, lookup)
+                        if len(batch) > 1
+                        else self._translate_one(batch_texts[0], lookup)
+                    )
+                    pending.append((indexes, asyncio.ensure_future(job)))
+                    pending_rows += len(batch)
+                if not pending:
+                    return
+                indexes, task = pending.popleft()
+                translations = await task
+                pending_rows -= len(indexes)
+                for index, translation in zip(indexes, translations):
+                    yield index, translation
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def _translate_one(self, text: str, lookup: bool) -> List[Optional[str]]:
+        return [await self.translate(text, lookup)]
+
+    async def _translate_uncached(
+        self, text: str, masked: Optional[MaskedText] = None
+    ) -> Optional[str]:
+        masked = masked or self._mask(text)
+        if not masked.has_text:
+            return text
+        try:
+            response = await self._chat(self._prompt + masked.text, masked.text)
+            if response is None:
+                return text
+            translated = self._unmask(masked, extract_translation(response))
+            if translated is None:
+                # placeholders lost, ask again with the markup in place
+                response = await self._chat(self._prompt + text, text)
+                if response is None:
+                    return text
+                translated = extract_translation(response)
+        except RunawayResponse:
+            return None
+        logger.debug(f"Input: {text}")
+        logger.debug(f"Output: {translated}")
+        if self._cache is not None:
+            self._cache.put(text, translated)
+        return translated
+
+    async def _read_stream(self, messages: list, source: str, rows: int) -> str:
+        """Streamed answer without its thinking, closed as soon as it is complete, RunawayResponse when it runs away"""
+        reader = ResponseStream(
+            source,
+            rows,
+            max_ratio=self._max_response_ratio,
+            max_think_chars=self._max_think_chars,
+        )
+        chunks = await self._client.chat(
+            model=self._model, messages=messages, stream=True
+        )
+        try:
+            async for chunk in chunks:
+                if not reader.feed(chunk["message"]["content"] or ""):
+                    break
+        finally:
+            # closing the stream ends the request, the server stops generating
+            await chunks.aclose()
+        self._think_chars += reader.think_chars
+        if reader.runaway:
+            self._runaways += 1
+            message = (
+                f"Thinking passed {self._max_think_chars} chars"
+                if reader.think_chars > self._max_think_chars
+                else f"Answer passed {self._max_response_ratio}x its {len(source)} source chars"
+            )
+            logger.warning(f"{message}, cut off")
+            raise RunawayResponse(message)
+        if reader.complete:
+            self._stopped_early += 1
+        return reader.response
+
+    def _mask(self, text: str) -> MaskedText:
+        if self._masker is None:
+            return MaskedText(text, (), 0)
+        return self._masker.mask(text)
+
+    def _unmask(self, masked: MaskedText, translation: str) -> Optional[str]:
+        if self._masker is None:
+            return translation
+        return self._masker.restore(masked, translation)
+
+    def _batches(self, texts: Iterable[str]) -> Iterator[List[Tuple[int, str]]]:
+        """Consecutive rows grouped up to batch_rows rows and batch_tokens tokens"""
+        batch: List[Tuple[int, str]] = []
+        tokens = 0
+        for index, text in enumerate(texts):
+            row_tokens = self._count_tokens(text) if self._batch_rows > 1 else 0
+            if batch and (
+                len(batch) >= self._batch_rows
+                or tokens + row_tokens > self._batch_tokens
+            ):
+                yield batch
+                batch, tokens = [], 0
+            batch.append((index, text))
+            tokens += row_tokens
+        if batch:
+            yield batch
+
+    async def _chat(self, content: str, source: str, rows: int = 0) -> Optional[str]:
+        """
+        Model answer to one user message, None when the request fails,
+        RunawayResponse when a streamed response runs away
+
+        Args:
+            content: the message, prompt included
+            source: the rows in the message, bounds a streamed response
+            rows: rows of a batch message, 0 for a single row
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._concurrency)
+        async with self._slots:
+            start_time = time.perf_counter()
+            self._requests += 1
+            messages = [{"role": "user", "content": content}]
+            try:
+                if self._stream:
+                    return await self._read_stream(messages, source, rows)
+                response: ChatResponse = await self._client.chat(
+                    model=self._model, messages=messages
+                )
+                return response["message"]["content"]
+            except RunawayResponse:
+                raise
+            except Exception as e:
+                logger.error(f"Translation error: {e}")
+                return None
+            finally:
+                logger.debug(
+                    f"translate execution time: {time.perf_counter() - start_time:.4f} seconds"
+                )
@@ -0,0 +1,293 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from loguru import logger
+
+"""
+    TranslationJournal is an append-only JSONL log of finished machine translations, one line per row.
+    Rows of a file are journaled in order, so the progress of a file is a count of its leading rows.
+    A checkpoint next to the journal stores that progress and the journal size, a resume reads only the lines after it.
+    The translated CSVs are materialised from the journal in one pass at the end of a run.
+"""
+
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+# progress digest, a polynomial rolling hash over the source hashes of the journaled rows
+DIGEST_BASE = 1000003
+DIGEST_MOD = 1 << 64
+
+
+def source_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def roll_digest(digest: int, hashed: str) -> int:
+    return (digest * DIGEST_BASE + int(hashed, 16)) % DIGEST_MOD
+
+
+class FileProgress(NamedTuple):
+    rows: int  # leading rows of the file that are journaled
+    digest: int  # roll_digest over their source hashes
+
+
+class TranslationJournal:
+    """
+    Args:
+        journal_file: JSONL journal, created if missing
+        sync_every: journaled rows between fsyncs
+        sync_interval: seconds between fsyncs, whichever comes first
+        checkpoint_every: journaled rows between checkpoints, bounds the tail read on resume after a crash
+    """
+
+    def __init__(
+        self,
+        journal_file: Path,
+        sync_every: int = 256,
+        sync_interval: float = 1.0,
+        checkpoint_every: int = 8192,
+    ):
+        self._journal_file = Path(journal_file)
+        self._checkpoint_file = self._journal_file.with_name(
+            self._journal_file.name + CHECKPOINT_SUFFIX
+        )
+        self._sync_every = sync_every
+        self._sync_interval = sync_interval
+        self._checkpoint_every = checkpoint_every
+
+        self._progress: Dict[str, FileProgress] = {}
+        # files journaled by this session, their CSVs are materialised
+        self._touched: Set[str] = set()
+        self._unsynced = 0
+        self._since_checkpoint = 0
+        self._last_sync = time.monotonic()
+
+        self._journal_file.parent.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        tail = self._load()
+        self._fp = open(self._journal_file, "ab")
+        logger.info(
+            f"Journal {self._journal_file}: {sum(p.rows for p in self._progress.values())} rows "
+            f"of {len(self._progress)} files, {tail} tail lines read in {(time.perf_counter() - start) * 1000:.2f}ms"
+        )
+
+    def __enter__(self) -> "TranslationJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def progress(self, file: str) -> FileProgress:
+        return self._progress.get(file, FileProgress(0, 0))
+
+    def verify(self, file: str, sources: List[str]) -> int:
+        """
+        Journaled leading rows of a file
+
+        Args:
+            file: file key, the path relative to the input root
+            sources: english of every row of the file, in order
+
+        Returns:
+            int: rows already translated. 0 when the journaled rows are not the leading rows of sources any more,
+                the file is reset and translated again
+        """
+        progress = self.progress(file)
+        if not progress.rows:
+            return 0
+        digest = 0
+        for text in sources[: progress.rows]:
+            digest = roll_digest(digest, source_hash(text))
+        if progress.rows <= len(sources) and digest == progress.digest:
+            return progress.rows
+        logger.warning(f"{file} changed since it was journaled, translating it again")
+        self.reset(file)
+        return 0
+
+    def append(self, file: str, row_id: str, source: str, translation: str) -> None:
+        """Journal the next row of a file"""
+        hashed = source_hash(source)
+        # progress first, the write may checkpoint it
+        progress = self.progress(file)
+        self._progress[file] = FileProgress(
+            progress.rows + 1, roll_digest(progress.digest, hashed)
+        )
+        self._write(
+            {
+                "file": file,
+                "row_id": row_id,
+                "source_hash": hashed,
+                "translation": translation,
+            }
+        )
+
+    def reset(self, file: str) -> None:
+        """Forget the journaled rows of a file"""
+        self._progress.pop(file, None)
+        self._write({"file": file, "reset": True})
+
+    def sync(self) -> None:
+        """Flush and fsync the journal"""
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def checkpoint(self) -> None:
+        """Store the progress, a resume reads the journal from here"""
+        self.sync()
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "offset": self._fp.tell(),
+            "files": {file: list(p) for file, p in self._progress.items()},
+        }
+        tmp_file = self._checkpoint_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as fp:
+            json.dump(state, fp, ensure_ascii=False)
+        os.replace(tmp_file, self._checkpoint_file)
+        self._since_checkpoint = 0
+
+    def close(self) -> None:
+        if self._fp.closed:
+            return
+        self.checkpoint()
+        self._fp.close()
+
+    def materialize(
+        self, input_path: Path, output_path: Path, only_touched: bool = True
+    ) -> int:
+        """
+        Write the translated CSVs from the journal in one pass over it
+
+        Args:
+            input_path: padding files, the journal stores their relative paths
+            output_path: translated files, written atomically
+            only_touched: skip files not journaled by this session whose CSV already exists
+
+        Returns:
+            int: rows written
+        """
+        self.sync()
+        translations = self._read_translations()
+        written = 0
+        for file, rows in sorted(translations.items()):
+            output_file = Path(output_path) / file
+            if not rows or (
+                only_touched and file not in self._touched and output_file.exists()
+            ):
+                continue
+            padding_file = Path(input_path) / file
+            if not padding_file.is_file():
+                logger.warning(f"No padding file for journaled {file}, skipping")
+                continue
+            written += self._write_csv(padding_file, output_file, rows)
+        logger.info(f"Materialised {written} rows from {self._journal_file}")
+        return written
+
+    def _write(self, record: dict) -> None:
+        self._fp.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._touched.add(record["file"])
+        self._unsynced += 1
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self._checkpoint_every:
+            self.checkpoint()
+        elif (
+            self._unsynced >= self._sync_every
+            or time.monotonic() - self._last_sync >= self._sync_interval
+        ):
+            self.sync()
+
+    def _load(self) -> int:
+        """Progress from the checkpoint and the journal lines after it, returns the lines read"""
+        if not self._journal_file.exists():
+            return 0
+        offset = 0
+        if self._checkpoint_file.exists():
+            with open(self._checkpoint_file, "r", encoding="utf-8") as fp:
+                state = json.load(fp)
+            if (
+                state.get("version") == CHECKPOINT_VERSION
+                and state["offset"] <= self._journal_file.stat().st_size
+            ):
+                offset = state["offset"]
+                self._progress = {
+                    file: FileProgress(*p) for file, p in state["files"].items()
+                }
+
+        lines = 0
+        with open(self._journal_file, "rb+") as fp:
+            fp.seek(offset)
+            for line in fp:
+                record = self._parse(line)
+                if record is None:
+                    # torn write of a crashed run, only the last line can be incomplete
+                    logger.warning(f"Dropping incomplete journal line at byte {offset}")
+                    fp.truncate(offset)
+                    break
+                self._apply(record)
+                offset += len(line)
+                lines += 1
+        return lines
+
+    def _apply(self, record: dict) -> None:
+        file = record["file"]
+        if record.get("reset"):
+            self._progress.pop(file, None)
+            return
+        progress = self.progress(file)
+        self._progress[file] = FileProgress(
+            progress.rows + 1, roll_digest(progress.digest, record["source_hash"])
+        )
+
+    @staticmethod
+    def _parse(line: bytes) -> Optional[dict]:
+        if not line.endswith(b"\n"):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def _read_translations(self) -> Dict[str, List[Tuple[str, str, str]]]:
+        """(row id, source hash, translation) of the journaled rows of every file"""
+        translations: Dict[str, List[Tuple[str, str, str]]] = {}
+        with open(self._journal_file, "rb") as fp:
+            for line in fp:
+                record = self._parse(line)
+                if record is None:
+                    break
+                if record.get("reset"):
+                    translations[record["file"]] = []
+                    continue
+                translations.setdefault(record["file"], []).append(
+                    (record["row_id"], record["source_hash"], record["translation"])
+                )
+        return translations
+
+    @staticmethod
+    def _write_csv(
+        padding_file: Path, output_file: Path, rows: List[Tuple[str, str, str]]
+    ) -> int:
+        with open(padding_file, "r", encoding="utf-8") as fp:
+            padding_rows = [row for row in csv.reader(fp) if len(row) >= 2]
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = output_file.with_suffix(".tmp")
+        written = 0
+        # same dialect as the rows written by Translator without a journal
+        with open(tmp_file, "w", encoding="utf-8", newline="") as fp:
+            writer = csv.writer(fp)
+            for row, (row_id, hashed, translation) in zip(padding_rows, rows):
+                if row[0] != row_id or source_hash(row[1]) != hashed:
+                    logger.warning(
+                        f"{padding_file} does not match its journal from row {row_id}, stopping there"
+                    )
+                    break
+                writer.writerow(row + [translation])
+                written += 1
+        os.replace(tmp_file, output_file)
+        return written
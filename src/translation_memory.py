@@ -0,0 +1,190 @@
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.util import hash_array
+
+"""
+    TranslationMemory is a global english -> translation index over a whole translated dicts tree.
+    The Differentiator builds it once per run, so a string translated in any file is not sent to MT again.
+"""
+
+
+def hash_texts(texts: pd.Series) -> np.ndarray:
+    """64-bit hashes of the texts as strings"""
+    return hash_array(texts.astype(str).to_numpy(dtype=object), categorize=False)
+
+
+def hash_lookup(
+    values: np.ndarray,
+    hashes: np.ndarray,
+    key_values: np.ndarray,
+    sorted_hashes: np.ndarray,
+    order: np.ndarray,
+) -> np.ndarray:
+    """
+    Find values in a hashed key table
+
+    Args:
+        values: texts to look up
+        hashes: hashes of values
+        key_values: texts of the key table
+        sorted_hashes: hashes of key_values in ascending order
+        order: argsort of the key hashes, sorted_hashes[i] belongs to key_values[order[i]]
+
+    Returns:
+        np.ndarray: index into key_values of every value, -1 if the value is not a key
+    """
+    result = np.full(len(values), -1, dtype=np.intp)
+    if len(sorted_hashes) == 0 or len(values) == 0:
+        return result
+
+    # binary search on the sorted key hashes,
+    # searching with sorted needles keeps the lookups cache friendly
+    needle_order = np.argsort(hashes)
+    positions = np.empty(len(hashes), dtype=np.intp)
+    positions[needle_order] = np.searchsorted(sorted_hashes, hashes[needle_order])
+    positions[positions == len(sorted_hashes)] = 0
+    hits = np.flatnonzero(sorted_hashes[positions] == hashes)
+
+    # collision check, hash hits must also have the same text
+    key_index = order[positions[hits]]
+    same_text = values[hits] == key_values[key_index]
+    result[hits[same_text]] = key_index[same_text]
+    for idx in hits[~same_text]:
+        # rare collision, look through every key with this hash
+        right = np.searchsorted(sorted_hashes, hashes[idx], side="right")
+        for candidate in order[positions[idx] : right]:
+            if key_values[candidate] == values[idx]:
+                result[idx] = candidate
+                break
+
+    return result
+
+
+class TextNormalizer:
+    """
+    Comparison key for english texts, differences which do not change the meaning are removed
+
+    Args:
+        strip_bom: remove byte order marks
+        unescape_quotes: treat doubled quotes ("") as one quote
+        collapse_whitespace: treat every whitespace run as one space
+        strip: ignore leading and trailing whitespace
+    """
+
+    def __init__(
+        self,
+        strip_bom: bool = True,
+        unescape_quotes: bool = True,
+        collapse_whitespace: bool = True,
+        strip: bool = True,
+    ):
+        self._strip_bom = strip_bom
+        self._unescape_quotes = unescape_quotes
+        self._collapse_whitespace = collapse_whitespace
+        self._strip = strip
+
+    def __repr__(self) -> str:
+        return (
+            f"TextNormalizer(strip_bom={self._strip_bom}, unescape_quotes={self._unescape_quotes}, "
+            f"collapse_whitespace={self._collapse_whitespace}, strip={self._strip})"
+        )
+
+    def __call__(self, texts: pd.Series) -> pd.Series:
+        """Normalised key of every text, NaN stays NaN"""
+        keys = texts.where(texts.isna(), texts.astype(str))
+        if self._strip_bom:
+            keys = keys.str.replace("\ufeff", "", regex=False)
+        if self._unescape_quotes:
+            keys = keys.str.replace('""', '"', regex=False)
+        if self._collapse_whitespace:
+            keys = keys.str.replace(r"\s+", " ", regex=True)
+        if self._strip:
+            keys = keys.str.strip()
+        return keys
+
+
+class TranslationMemory:
+    def __init__(self, normalizer: Optional[Callable[[pd.Series], pd.Series]] = None):
+        # texts are matched on normalizer(text) when a normalizer is given
+        self._normalizer = normalizer
+        self._english = np.empty(0, dtype=object)
+        self._translations = np.empty(0, dtype=object)
+        self._sorted_hashes = np.empty(0, dtype=np.uint64)
+        self._order = np.empty(0, dtype=np.intp)
+        self._file_count = 0
+
+    def __len__(self) -> int:
+        return len(self._english)
+
+    @property
+    def file_count(self) -> int:
+        return self._file_count
+
+    def build(self, frames: Iterable[Optional[pd.DataFrame]]) -> "TranslationMemory":
+        """
+        Index every translated row of the frames
+
+        Args:
+            frames: translated CSV files read without header, None for unreadable files.
+                Earlier frames win when the same english text has different translations.
+
+        Returns:
+            TranslationMemory: self
+        """
+        frames = list(frames)
+        self._file_count = len(frames)
+        frames = [
+            df.iloc[:, [1, 2]].set_axis(["eng", "translated_text"], axis=1)
+            for df in frames
+            if df is not None and not df.empty and len(df.columns) >= 3
+        ]
+
+        if not frames:
+            return self
+
+        # rows without text or translation can not fill anything
+        rows = pd.concat(frames, ignore_index=True).dropna()
+        rows = rows[rows["translated_text"].astype(str).str.strip() != ""]
+        rows = rows.astype(str)
+        if self._normalizer is not None:
+            rows["eng"] = self._normalizer(rows["eng"])
+        # keep the first translation of every english text
+        rows = rows.drop_duplicates("eng", keep="first")
+
+        self._english = rows["eng"].to_numpy(dtype=object)
+        self._translations = rows["translated_text"].to_numpy(dtype=object)
+        hashes = hash_texts(rows["eng"])
+        self._order = np.argsort(hashes)
+        self._sorted_hashes = hashes[self._order]
+        return self
+
+    def lookup(self, texts: pd.Series) -> np.ndarray:
+        """
+        Find translations of texts
+
+        Args:
+            texts: english texts, NaN never matches. Normalised first if the memory has a normalizer
+
+        Returns:
+            np.ndarray: translation for every text, None where the text is not in the memory
+        """
+        result = np.full(len(texts), None, dtype=object)
+        if self._normalizer is not None:
+            texts = self._normalizer(texts)
+        missing = texts.isna().to_numpy()
+        if len(self) == 0 or missing.all():
+            return result
+
+        values = texts.astype(str).to_numpy(dtype=object)
+        index = hash_lookup(
+            values,
+            hash_array(values, categorize=False),
+            self._english,
+            self._sorted_hashes,
+            self._order,
+        )
+        found = (index >= 0) & ~missing
+        result[found] = self._translations[index[found]]
+        return result
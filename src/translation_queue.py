@@ -0,0 +1,125 @@
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from .translation_cache import normalize_source
+
+"""
+    TranslationQueue plans a translation run over every pending file at once.
+    Each english text is queued once with back-references to all of its (file, row) occurrences,
+    its translation is fanned out to every occurrence. Rows of a file are released in row order,
+    so every translates file is still a prefix of its padding file and resume keeps working.
+    Files are released independently, a row that is never translated holds back the rest of its file only.
+"""
+
+
+class PendingFile(NamedTuple):
+    padding_file: str
+    translates_file: str
+    mode: str  # "w" for a new translates file, "a" to resume one
+    rows: List[List[str]]  # untranslated csv rows, english in column 1
+
+
+class Occurrence(NamedTuple):
+    file: int  # index into TranslationQueue.files
+    row: int  # index into PendingFile.rows
+
+
+class TranslationQueue:
+    """
+    Args:
+        key: rows with the same key share one translation, defaults to the translation cache key
+    """
+
+    def __init__(self, key: Callable[[str], str] = normalize_source):
+        self._key = key
+        self._files: List[PendingFile] = []
+        self._sources: List[str] = []
+        self._references: List[List[Occurrence]] = []
+        self._source_index: Dict[str, int] = {}
+        # source of every row, per file
+        self._row_sources: List[List[int]] = []
+
+        # fan out state: translations still referenced by unwritten rows
+        self._translations: Dict[int, str] = {}
+        self._remaining: List[int] = []
+        # next unreleased row, per file
+        self._row_cursors: List[int] = []
+
+    def __len__(self) -> int:
+        """Unique sources"""
+        return len(self._sources)
+
+    @property
+    def files(self) -> List[PendingFile]:
+        return self._files
+
+    @property
+    def sources(self) -> List[str]:
+        """Unique english texts in order of first occurrence"""
+        return self._sources
+
+    @property
+    def references(self) -> List[List[Occurrence]]:
+        """Occurrences of every source"""
+        return self._references
+
+    @property
+    def row_count(self) -> int:
+        return sum(len(rows) for rows in self._row_sources)
+
+    def add_file(self, pending: PendingFile) -> None:
+        """Queue the rows of a file, files are written in the order they are added"""
+        file_index = len(self._files)
+        self._files.append(pending)
+        row_sources = []
+        for row_index, row in enumerate(pending.rows):
+            key = self._key(row[1])
+            source = self._source_index.get(key)
+            if source is None:
+                source = len(self._sources)
+                self._source_index[key] = source
+                self._sources.append(row[1])
+                self._references.append([])
+                self._remaining.append(0)
+            self._references[source].append(Occurrence(file_index, row_index))
+            self._remaining[source] += 1
+            row_sources.append(source)
+        self._row_sources.append(row_sources)
+        self._row_cursors.append(0)
+
+    def complete(
+        self, source: int, translation: str
+    ) -> List[Tuple[int, List[str], str]]:
+        """
+        Record the translation of a source
+
+        Args:
+            source: index into sources
+            translation: translation of the source
+
+        Returns:
+            List[Tuple[int, List[str], str]]: (file index, csv row, translation) of every row which can be written now,
+                in file and row order. A row waits until every row before it in its file is translated
+        """
+        self._translations[source] = translation
+        released = []
+        # only a file waiting for this source can move on
+        for file_index in sorted(
+            {occurrence.file for occurrence in self._references[source]}
+        ):
+            row_sources = self._row_sources[file_index]
+            rows = self._files[file_index].rows
+            cursor = self._row_cursors[file_index]
+            while cursor < len(row_sources):
+                row_source = row_sources[cursor]
+                if row_source not in self._translations:
+                    break
+                released.append(
+                    (file_index, rows[cursor], self._translations[row_source])
+                )
+                # forget translations once every occurrence is released
+                self._remaining[row_source] -= 1
+                if not self._remaining[row_source]:
+                    del self._translations[row_source]
+                cursor += 1
+            self._row_cursors[file_index] = cursor
+        return released
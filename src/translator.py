@@ -1,38 +1,86 @@
-from enum import Enum
 import os
 import csv
+from contextlib import ExitStack, aclosing, closing
 from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
 from loguru import logger
 from ollama import ChatResponse, chat
 from src.io_helper import IOHelper
-from transformers import AutoTokenizer
+from src.markup_masker import MarkupMasker
+from src.prompts import Prompt
+from src.providers import ChatProvider
+from src.response_stream import MAX_THINK_CHARS, ResponseStream, RunawayResponse
+from src.token_counter import DEFAULT_TOKENIZER, TokenCounter
+from src.translation_cache import TranslationCache
+from src.translation_engine import TranslationEngine, extract_translation
+from src.translation_journal import TranslationJournal
+from src.translation_queue import PendingFile, TranslationQueue
 import time
 
 
-class Prompt(Enum):
-    SYSTEM = ""
-    ZH_HANS = """任务：将英文翻译成中文
-规则：
-1. 保留所有 HTML、Twee、JS 标签结构不变
-2. 所有 HTML、Twee、JS 标签不参与翻译
-3. 逐标签查找需要翻译的部分
-4. 所有形如 <<...>>、<...>、`...` 的标签结构完整保留，不翻译里面的文字
-5. 所有形如 [[...|...]] 的结构中，仅翻译左侧双括号内, 至管道标记符的部分到为中文, 不要混淆<<...>>
-6. 如果[[...|...]]内左侧是网址, 不翻译
-6. 专用名词对照表:  ["Degrees of Lewdity Plus", "dick", "penis", "vagina", "balls", "anus", "Next","Vanilla","moded", "Discord","plush"] => ["欲都孤儿威力加强版", "肉棒", "肉棒", "小穴", "蛋蛋", "菊穴","继续","原版","模组版","Discord","玩偶"]
-7. 人名对照表, 请确保人名对照翻译一致: ["Avery","Bailey","Briar","Charlie","Darryl","Doren","Eden","Gwylan","Harper","Jordan","Kylar","Landry","Leighton","Mason","Morgan","River","Robin","Sam","Sirris","Whitney","Winter","Black Wolf","Niki","Quinn","Remy","Alex","Great Hawk","Wren","Sydney","Ivory Wraith","Zephyr","Nona","Lake couple","the witch"] => ["艾弗里","贝利","布莱尔","查里","达里尔","多伦","伊甸","格威岚","哈珀","约旦","凯拉尔","兰德里","礼顿","梅森","摩根","瑞沃","罗宾","萨姆","西里斯","惠特尼","温特","黑狼","尼奇","奎恩","雷米","艾利克斯","巨鹰","伦恩","悉尼","象牙怨灵","泽菲尔","诺娜","湖边情侣","巫女"]
-9. 不要逐词逐句死板对照翻译，根据上下文选择恰当措辞搭配
-10. 英语原文中还会使用各种抽象表达，翻译需要表达指代的具体内容
-10. 在对原文词句之间、上下文逻辑上要连贯一致
-12. 英语中过长的插入语导致的长难句，要结合中文常用的表达方式，把长难句的主体部分和修饰部分拆开成短句，让句子的主体部分表述清晰
-13. 汉语表述中并不需要的语气词、抽象修饰不得出现，仅保留语句主体部分
-14. 英语中常用"静态"的表述，如"xx是xx的"，而中文的表达习惯往往更加"动态"，需要翻译为中文的表述风格，禁止滥用"的"或滥用被动语态
-15. 不要输出说明文字, 只需要翻译结果
-16. 对于没有列出的规则，请按照中文的表达习惯与常识进行翻译
-17. 情爱相关的描述可以信达雅一点, 但是不要过度
-
-翻译:
-"""
+def journal_key(padding_file: str, input_path: Path) -> str:
+    return Path(os.path.relpath(padding_file, input_path)).as_posix()
+
+
+class _QueueWriter:
+    """
+    Writes the rows released by a TranslationQueue, one translates file is open at a time,
+    a file released again later is reopened for appending.
+    With a journal rows are appended to the journal instead, keyed by the padding file relative to input_path
+    """
+
+    def __init__(
+        self,
+        io_helper: IOHelper,
+        queue: TranslationQueue,
+        save: bool,
+        journal: Optional[TranslationJournal] = None,
+        input_path: Optional[Path] = None,
+    ):
+        self._io_helper = io_helper
+        self._queue = queue
+        self._save_to_file = save
+        self._journal = journal
+        self._input_path = input_path
+        self._stack = ExitStack()
+        self._file_index: Optional[int] = None
+        self._writer = None
+        self._journal_key: Optional[str] = None
+        self._opened: set = set()
+
+    def __enter__(self) -> "_QueueWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stack.close()
+
+    def write(self, released: List[Tuple[int, List[str], str]]) -> int:
+        """Append the translation to every released row and write it, returns the rows written"""
+        for file_index, row, translation in released:
+            if file_index != self._file_index:
+                self._stack.close()
+                pending = self._queue.files[file_index]
+                if self._journal is not None:
+                    self._journal_key = journal_key(
+                        pending.padding_file, self._input_path
+                    )
+                else:
+                    # a new file is truncated by its first write only
+                    mode = "a" if file_index in self._opened else pending.mode
+                    self._writer = self._stack.enter_context(
+                        self._io_helper.safe_csv_writer(
+                            pending.translates_file, mode, self._save_to_file
+                        )
+                    )
+                self._opened.add(file_index)
+                self._file_index = file_index
+            if self._journal is not None:
+                self._journal.append(self._journal_key, row[0], row[1], translation)
+            elif self._writer:
+                row.append(translation)
+                self._writer.writerow(row)
+                logger.debug(f"Translation {row[0]}: {translation} -> saved")
+        return len(released)
 
 
 class Translator:
@@ -43,6 +91,19 @@ class Translator:
         save: bool = False,
         input_path: Path = None,
         output_path: Path = Path("tests/test_data/mt_translates"),
+        concurrency: int = 1,
+        host: Optional[str] = None,
+        batch_rows: int = 1,
+        batch_tokens: int = 2000,
+        cache_path: Optional[Path] = None,
+        mask_markup: bool = False,
+        tokenizer: str = DEFAULT_TOKENIZER,
+        token_estimate: bool = False,
+        journal_path: Optional[Path] = None,
+        client: Optional[ChatProvider] = None,
+        stream: bool = False,
+        max_response_ratio: float = 4.0,
+        max_think_chars: int = MAX_THINK_CHARS,
     ):
         self._io_helper = IOHelper()
 
@@ -52,19 +113,64 @@ class Translator:
         self._input_files_path = input_path
         self._output_files_path = output_path
 
-        self._tokenizer = AutoTokenizer.from_pretrained(
-            "Qwen/Qwen3-8B", trust_remote_code=True, use_fast=False
-        )
-        self._qwen_token_limit = 40000
+        # loaded on the first count, estimate mode never loads it
+        self._token_counter = TokenCounter(tokenizer, estimate=token_estimate)
+        # the local model stops a run after this many tokens, a provider paces its requests to its rate limits instead
+        self._qwen_token_limit = 40000 if client is None else float("inf")
         self._total_translated_rows = 0
         self._token_limit_hit = False
 
         self._system_prompt = Prompt.SYSTEM.value
         self._zh_hans_prompt = Prompt.ZH_HANS.value
-        self._prompt_token_length = len(
-            self._tokenizer.tokenize(self._system_prompt + self._zh_hans_prompt)
+        # markup goes to the model as {n} placeholders, the prompt asks to keep them
+        self._masker: Optional[MarkupMasker] = None
+        if mask_markup:
+            self._zh_hans_prompt += Prompt.PLACEHOLDERS.value
+            self._masker = MarkupMasker(count_tokens=self._token_counter.count)
+
+        # rows in flight against the Ollama server, used by the *_async methods
+        self._concurrency = concurrency
+        self._host = host
+        # provider of the *_async methods, the local Ollama server when None
+        self._client = client
+        # answers are read as they are generated, thinking is dropped and runaway answers are cut off
+        self._stream = stream
+        self._max_response_ratio = max_response_ratio
+        self._max_think_chars = max_think_chars
+        # rows sharing one request and one copy of the prompt
+        self._batch_rows = batch_rows
+        self._batch_tokens = batch_tokens
+        self._engine: Optional[TranslationEngine] = None
+
+        # exact-match translations of this model and prompt, cached rows cost no request and no tokens
+        self._cache: Optional[TranslationCache] = (
+            TranslationCache(cache_path, self._model, self._zh_hans_prompt)
+            if cache_path is not None
+            else None
         )
 
+        # finished rows go to an append-only journal, the CSVs are materialised from it
+        self._journal: Optional[TranslationJournal] = (
+            TranslationJournal(journal_path) if journal_path is not None else None
+        )
+
+    def materialize(self) -> None:
+        """Write the translated CSVs of the rows journaled in this run"""
+        if self._journal is not None and self._save_to_file:
+            self._journal.materialize(self._input_files_path, self._output_files_path)
+
+    def close(self) -> None:
+        """Log the cache and masking stats, close the cache and the journal"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._masker is not None:
+            self._masker.log_stats()
+        if self._cache is not None:
+            self._cache.log_stats()
+            self._cache.close()
+            self._cache = None
+
     def resume_translate(self):
         logger.info("Starting translation resume loop...")
 
@@ -89,7 +195,63 @@ class Translator:
             else:
                 logger.info(f"Translated {translated_this_round} rows this round.")
 
+    async def resume_translate_async(self):
+        logger.info("Starting translation resume loop...")
+
+        while True:
+            self._token_limit_hit = False  # Reset before each scan
+            translated_before = self._total_translated_rows
+
+            await self.search_and_translate_async()
+
+            translated_this_round = self._total_translated_rows - translated_before
+            if translated_this_round == 0:
+                logger.info("No new rows translated this round.")
+                if not self._token_limit_hit:
+                    logger.info("All translations complete.")
+                else:
+                    logger.info("Token limit hit immediately; pausing until next call.")
+                break
+            logger.info(f"Translated {translated_this_round} rows this round.")
+
     def search_and_translate(self) -> None:
+        self.translate_queue(self._plan())
+
+    async def search_and_translate_async(self) -> None:
+        """search_and_translate with concurrent requests"""
+        await self.translate_queue_async(self._plan())
+
+    def _plan(self) -> TranslationQueue:
+        """One queue over every pending file, each english text is translated once per run"""
+        queue = TranslationQueue()
+        for padding_file, translates_file, start_idx, mode in self._pending_files():
+            self._queue_file(queue, padding_file, translates_file, start_idx, mode)
+        if queue.files:
+            logger.info(
+                f"Planned {queue.row_count} rows of {len(queue.files)} files, "
+                f"{len(queue)} unique texts to translate"
+            )
+        return queue
+
+    def _queue_file(
+        self,
+        queue: TranslationQueue,
+        padding_file: str,
+        translates_file: str,
+        start_idx: int,
+        mode: str,
+    ) -> None:
+        with open(padding_file, "r", encoding="utf-8") as input_file:
+            rows = [
+                row
+                for row_idx, row in enumerate(csv.reader(input_file))
+                if row_idx >= start_idx and len(row) >= 2
+            ]
+        if rows:
+            queue.add_file(PendingFile(padding_file, translates_file, mode, rows))
+
+    def _pending_files(self) -> Iterator[Tuple[str, str, int, str]]:
+        """(padding file, translates file, first row, write mode) of every file with rows left"""
         if self._save_to_file:
             os.makedirs(self._output_files_path, exist_ok=True)
 
@@ -105,12 +267,18 @@ class Translator:
                 rel_path = os.path.relpath(padding_file, self._input_files_path)
                 translates_file = os.path.join(self._output_files_path, rel_path)
 
+                if self._journal is not None:
+                    start_idx = self._journal_start(padding_file)
+                    if start_idx is not None:
+                        yield padding_file, translates_file, start_idx, "a"
+                    continue
+
                 if not os.path.exists(translates_file):
                     os.makedirs(os.path.dirname(translates_file), exist_ok=True)
                     logger.info(
                         f"No translates found in {padding_file}, starting new run"
                     )
-                    self.do_batch_translate(padding_file, translates_file, 0, "w")
+                    yield padding_file, translates_file, 0, "w"
                     continue
 
                 padding_rows = self._io_helper.count_csv_row_translations(
@@ -128,9 +296,26 @@ class Translator:
                 self._io_helper.truncate_csv_newline(
                     translates_file, translated_rows
                 )  # append to new line
-                self.do_batch_translate(
-                    padding_file, translates_file, translated_rows, "a"
-                )
+                yield padding_file, translates_file, translated_rows, "a"
+
+    def _journal_start(self, padding_file: str) -> Optional[int]:
+        """First row of the padding file missing from the journal, None if the file is done"""
+        with open(padding_file, "r", encoding="utf-8") as input_file:
+            rows = [
+                (row_idx, row[1])
+                for row_idx, row in enumerate(csv.reader(input_file))
+                if len(row) >= 2
+            ]
+        done = self._journal.verify(
+            journal_key(padding_file, self._input_files_path),
+            [text for _, text in rows],
+        )
+        if done >= len(rows):
+            logger.info(f"File {padding_file} translation complete, skipping")
+            return None
+        if done:
+            logger.info(f"Resuming {padding_file} from line {rows[done][0] + 1}")
+        return rows[done][0]
 
     def do_batch_translate(
         self,
@@ -139,35 +324,139 @@ class Translator:
         start_idx: int,
         mode: str,
     ) -> None:
+        queue = TranslationQueue()
+        self._queue_file(queue, padding_file, translates_file, start_idx, mode)
+        self.translate_queue(queue)
+
+    async def do_batch_translate_async(
+        self,
+        padding_file: str,
+        translates_file: str,
+        start_idx: int,
+        mode: str,
+    ) -> None:
+        queue = TranslationQueue()
+        self._queue_file(queue, padding_file, translates_file, start_idx, mode)
+        await self.translate_queue_async(queue)
+
+    def translate_queue(self, queue: TranslationQueue) -> None:
+        """Translate every unique text of the queue, rows are written in input order"""
         batch_token_count = 0
 
-        with self._io_helper.safe_csv_writer(
-            translates_file, mode, self._save_to_file
+        with _QueueWriter(
+            self._io_helper,
+            queue,
+            self._save_to_file,
+            self._journal,
+            self._input_files_path,
         ) as writer:
             try:
-                with open(padding_file, "r", encoding="utf-8") as input_file:
-                    reader = csv.reader(input_file)
-
-                    for row_idx, row in enumerate(reader):
-                        if row_idx < start_idx or len(row) < 2:
-                            continue  # skip invalid row
-
-                        input_text = row[1]
-                        input_token_count = self.token_counter(input_text)
-
-                        # estimate total token size
-                        estimated_total = (
-                            batch_token_count + input_token_count * 2
-                        )  # assume output smaller 2 times than input
-                        if estimated_total > self._qwen_token_limit:
-                            logger.info("Estimated token limit reached, stopping batch")
-                            self._token_limit_hit = True
-                            return
-
-                        translation = self.use_qwen(input_text)
-                        output_token_count = self.token_counter(translation)
+                for index, input_text in enumerate(queue.sources):
+                    cached = self._cached(input_text)
+                    if cached is not None:
+                        # no request and no tokens
+                        self._total_translated_rows += writer.write(
+                            queue.complete(index, cached)
+                        )
+                        continue
+                    input_token_count = self.token_counter(input_text)
+
+                    # estimate total token size
+                    estimated_total = (
+                        batch_token_count + input_token_count * 2
+                    )  # assume output smaller 2 times than input
+                    if estimated_total > self._qwen_token_limit:
+                        logger.info("Estimated token limit reached, stopping batch")
+                        self._token_limit_hit = True
+                        return
+
+                    translation = self._use_qwen_uncached(input_text)
+                    if translation is None:
+                        # not translated, the rows after it in its file wait for the next run, other files go on
+                        continue
+                    output_token_count = self._token_counter.count(translation)
+
+                    total_token_count = input_token_count + output_token_count
+                    if batch_token_count + total_token_count > self._qwen_token_limit:
+                        logger.info("Token limit reached, stop this batch")
+                        self._token_limit_hit = True
+                        return
+
+                    batch_token_count += total_token_count
+                    self._total_translated_rows += writer.write(
+                        queue.complete(index, translation)
+                    )
+            except Exception as e:
+                logger.error(f"Error in batch translation: {str(e)}")
+                raise
 
-                        total_token_count = input_token_count + output_token_count
+    async def translate_queue_async(self, queue: TranslationQueue) -> None:
+        """translate_queue with up to concurrency requests in flight"""
+        if self._engine is None:
+            self._engine = TranslationEngine(
+                model=self._model,
+                prompt=self._zh_hans_prompt,
+                concurrency=self._concurrency,
+                host=self._host,
+                client=self._client,
+                batch_rows=self._batch_rows,
+                batch_tokens=self._batch_tokens,
+                count_tokens=self._token_counter.count,
+                cache=self._cache,
+                masker=self._masker,
+                stream=self._stream,
+                max_response_ratio=self._max_response_ratio,
+                max_think_chars=self._max_think_chars,
+            )
+        batch_token_count = 0
+        # estimated tokens of the texts sent but not answered yet
+        reserved: dict = {}
+        # source index of every text sent, texts answered from the cache are not sent
+        sent: List[int] = []
+
+        def budgeted_texts(writer: _QueueWriter):
+            # stop sending once the estimate of the texts in flight would pass the limit
+            for index, text in enumerate(queue.sources):
+                cached = self._cached(text)
+                if cached is not None:
+                    # no request and no tokens
+                    self._total_translated_rows += writer.write(
+                        queue.complete(index, cached)
+                    )
+                    continue
+                estimate = self.token_counter(text) * 2
+                if batch_token_count + sum(reserved.values()) + estimate > (
+                    self._qwen_token_limit
+                ):
+                    logger.info("Estimated token limit reached, stopping batch")
+                    self._token_limit_hit = True
+                    return
+                reserved[index] = estimate
+                sent.append(index)
+                yield text
+
+        with _QueueWriter(
+            self._io_helper,
+            queue,
+            self._save_to_file,
+            self._journal,
+            self._input_files_path,
+        ) as writer:
+            try:
+                # closing the generator cancels the texts still in flight when the limit is hit
+                async with aclosing(
+                    # the cache was looked up above, the engine only sees misses
+                    self._engine.translate_ordered(budgeted_texts(writer), lookup=False)
+                ) as translations:
+                    async for position, translation in translations:
+                        index = sent[position]
+                        reserved.pop(index, None)
+                        if translation is None:
+                            # not translated, the rows after it in its file wait for the next run, other files go on
+                            continue
+                        total_token_count = self.token_counter(
+                            queue.sources[index]
+                        ) + self._token_counter.count(translation)
                         if (
                             batch_token_count + total_token_count
                             > self._qwen_token_limit
@@ -177,41 +466,42 @@ class Translator:
                             return
 
                         batch_token_count += total_token_count
-                        self._total_translated_rows += 1
-
-                        if writer:
-                            row.append(translation)
-                            writer.writerow(row)
-                            logger.debug(
-                                f"Translation {row_idx}: {translation} -> saved"
-                            )
+                        self._total_translated_rows += writer.write(
+                            queue.complete(index, translation)
+                        )
             except Exception as e:
                 logger.error(f"Error in batch translation: {str(e)}")
                 raise
 
-    def use_qwen(self, input: str) -> str:
+    def use_qwen(self, input: str) -> Optional[str]:
+        """Translation of input, the input when the request fails, None when the streamed response ran away"""
+        cached = self._cached(input)
+        if cached is not None:
+            return cached
+        return self._use_qwen_uncached(input)
+
+    def _use_qwen_uncached(self, input: str) -> Optional[str]:
         start_time = time.time()
-        model = self._model
-        content = Prompt.ZH_HANS.value + input
+        masked = self._masker.mask(input) if self._masker is not None else None
 
         try:
-            response: ChatResponse = chat(
-                model=model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": content,
-                    },
-                ],
-            )
+            if masked is not None and not masked.has_text:
+                return input  # only markup
 
-            full_response = response["message"]["content"]
-            translated = self._extract_translation(full_response)
+            translated = self._ask_qwen(masked.text if masked is not None else input)
+            if masked is not None:
+                restored = self._masker.restore(masked, translated)
+                # placeholders lost, ask again with the markup in place
+                translated = restored if restored is not None else self._ask_qwen(input)
 
             logger.debug(f"Input: {input}")
             logger.debug(f"Output: {translated}")
+            if self._cache is not None:
+                self._cache.put(input, translated)
             return translated
 
+        except RunawayResponse:
+            return None
         except Exception as e:
             logger.error(f"Translation error: {e}")
             return input
@@ -220,15 +510,47 @@ class Translator:
             duration = end_time - start_time
             logger.debug(f"use_qwen execution time: {duration:.4f} seconds")
 
+    def _ask_qwen(self, text: str) -> str:
+        messages = [
+            {
+                "role": "user",
+                "content": self._zh_hans_prompt + text,
+            },
+        ]
+        if not self._stream:
+            response: ChatResponse = chat(model=self._model, messages=messages)
+            return self._extract_translation(response["message"]["content"])
+
+        reader = ResponseStream(
+            text,
+            max_ratio=self._max_response_ratio,
+            max_think_chars=self._max_think_chars,
+        )
+        # closing the stream ends the request, the server stops generating
+        with closing(chat(model=self._model, messages=messages, stream=True)) as chunks:
+            for chunk in chunks:
+                if not reader.feed(chunk["message"]["content"] or ""):
+                    break
+        if reader.runaway:
+            message = (
+                f"Thinking passed {self._max_think_chars} chars"
+                if reader.think_chars > self._max_think_chars
+                else f"Answer passed {self._max_response_ratio}x its {len(text)} source chars"
+            )
+            logger.warning(f"{message}, cut off")
+            raise RunawayResponse(message)
+        return self._extract_translation(reader.response)
+
     def token_counter(self, input: str) -> int:
-        input_tokens = len(self._tokenizer.tokenize(input))
-        return self._prompt_token_length + input_tokens
+        """Tokens of a request for input, the prompt included"""
+        return self._token_counter.count(
+            self._system_prompt + self._zh_hans_prompt
+        ) + self._token_counter.count(input)
+
+    def _cached(self, text: str) -> Optional[str]:
+        """Cached translation of text, None on a miss or without a cache"""
+        return self._cache.get(text) if self._cache is not None else None
 
     def _extract_translation(self, full_response: str) -> str:
         """trim thinking block from full response"""
-        if "<think>" in full_response and "</think>" in full_response:
-            return full_response.split("</think>", 1)[1].strip()
-
-        # leave last line as result
-        paragraphs = [p.strip() for p in full_response.split("\n\n")]
-        return next((p for p in reversed(paragraphs) if p), full_response)
+        return extract_translation(full_response)
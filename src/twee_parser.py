@@ -1,3 +1,109 @@
+import re
+from enum import Enum
+from functools import lru_cache
+from typing import Dict, Tuple
+
+"""
+    Compiled patterns for the TweeParser line predicates.
+    Predicates tested together are merged into one pattern by PredicateSet, so a line is scanned once for all of them.
+"""
+
+
+class Regexes(Enum):
+    JSON_LINE = re.compile(r"^[\w\"]*\s*:\s*[ `\'/\$\.\w\":,\|\(\)\{\}\[\]]+,*$")
+    ALNUM = re.compile(r"[A-Za-z\d]")
+    TAG_SPAN = re.compile(r"<span.*?>[\"\w\.\-+\$]")
+    TAG_LABEL = re.compile(r"<label>[\w\-+]|\w</label>")
+    TAG_INPUT = re.compile(r"<input.*?value=\"")
+    WIDGET_PRINT = re.compile(
+        r"<<(?:print|=|-)\s[^<]*[\"\'`\w]+[\-\?\s\w\.\$,\'\"<>\[\]\(\)/]+(?:\)>>|\">>|\'>>|`>>|\]>>|>>)"
+    )
+    WIDGET_OPTION = re.compile(r"<<option\s\"")
+    WIDGET_BUTTON = re.compile(r"<<button ")
+    WIDGET_LINK = re.compile(r"<<link\s*(?:\[\[|\"\w|`\w|\'\w|\"\(|`\(|\'\(|_\w|`)")
+    WIDGET_HIGH_RATE_LINK = re.compile(
+        r"<<link \[\[(?:Next\||Next\s\||Leave\||Refuse\||Return\||Resume\||Confirm\||Continue\||Stop\||Phase\|)"
+    )
+    # is_only_widgets strips these one after another
+    WIDGETS = re.compile(r"(<<(?:[^<>]*?|run.*?|for.*?)>>)")
+    HTML_TAGS = re.compile(r"(<[/\s\w\"=\-@\$\+\'\.]*>)")
+    VARIABLES = re.compile(r"((?:\$|_)[^_][#;\w\.\(\)\[\]\"\'`]*)")
+
+
+# predicate name -> (pattern, negated), negated predicates are true when the pattern does not match
+PREDICATES: Dict[str, Tuple[Regexes, bool]] = {
+    "json_line": (Regexes.JSON_LINE, False),
+    "only_marks": (Regexes.ALNUM, True),
+    "tag_span": (Regexes.TAG_SPAN, False),
+    "tag_label": (Regexes.TAG_LABEL, False),
+    "tag_input": (Regexes.TAG_INPUT, False),
+    "widget_print": (Regexes.WIDGET_PRINT, False),
+    "widget_option": (Regexes.WIDGET_OPTION, False),
+    "widget_button": (Regexes.WIDGET_BUTTON, False),
+    "widget_link": (Regexes.WIDGET_LINK, False),
+    "widget_high_rate_link": (Regexes.WIDGET_HIGH_RATE_LINK, False),
+}
+
+
+class PredicateSet:
+    """Evaluate several line predicates with one combined pattern"""
+
+    def __init__(self, *names: str):
+        unknown = [name for name in names if name not in PREDICATES]
+        if unknown:
+            raise ValueError(f"Unknown predicates: {unknown}")
+
+        self._names = names
+        self._negated = [name for name in names if PREDICATES[name][1]]
+        positives = [name for name in names if not PREDICATES[name][1]]
+
+        # every predicate as an optional lookahead from the line start, the named group is set when it matches
+        self._all_regex = re.compile(
+            "".join(
+                f"(?=[\\s\\S]*?(?P<{name}>{PREDICATES[name][0].value.pattern}))?"
+                for name in names
+            )
+        )
+        # plain alternation of the positive predicates, stops at the first hit
+        self._any_regex = (
+            re.compile(
+                "|".join(
+                    f"(?:{PREDICATES[name][0].value.pattern})" for name in positives
+                )
+            )
+            if positives
+            else None
+        )
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return self._names
+
+    def evaluate(self, line: str) -> Dict[str, bool]:
+        """Answer all predicates in one pass"""
+        if self._any_regex is not None and not self._negated:
+            # most lines match none of the predicates, skip the lookahead scan for them
+            if not self._any_regex.search(line):
+                return dict.fromkeys(self._names, False)
+
+        groups = self._all_regex.match(line).groupdict()
+        return {
+            name: (groups[name] is None) == PREDICATES[name][1] for name in self._names
+        }
+
+    def any(self, line: str) -> bool:
+        """Whether at least one predicate is true"""
+        if self._any_regex is not None and self._any_regex.search(line):
+            return True
+        return any(not PREDICATES[name][0].value.search(line) for name in self._negated)
+
+
+@lru_cache(maxsize=None)
+def predicate_set(*names: str) -> PredicateSet:
+    """Shared PredicateSet for a predicate combination"""
+    return PredicateSet(*names)
+
+
 class TweeParser:
     def __init__(self):
 
@@ -5,3 +111,126 @@ class TweeParser:
 
     def parse(self):
         pass
+
+    @staticmethod
+    def is_comment(line: str) -> bool:
+        """Check if line is a comment"""
+        if line.startswith("*") or line.startswith("*/") or line.startswith("-->"):
+            return True
+        return (line.startswith("/*") or line.startswith("<!--")) and (
+            line.endswith("*/") or line.endswith("-->")
+        )
+
+    @staticmethod
+    def is_json_line(line: str) -> bool:
+        """Check if line follows JSON property format"""
+        return Regexes.JSON_LINE.value.search(line) is not None
+
+    @staticmethod
+    def is_only_marks(line: str) -> bool:
+        """Check if line contains only symbols (no alphanumeric chars)"""
+        return Regexes.ALNUM.value.search(line) is None
+
+    @staticmethod
+    def is_event(line: str) -> bool:
+        """Check if line contains an event marker"""
+        return "::" in line
+
+    @staticmethod
+    def is_tag_span(line: str) -> bool:
+        """Check if line contains a span tag with content"""
+        return Regexes.TAG_SPAN.value.search(line) is not None
+
+    @staticmethod
+    def is_tag_label(line: str) -> bool:
+        """Check if line contains a label tag with content"""
+        return Regexes.TAG_LABEL.value.search(line) is not None
+
+    @staticmethod
+    def is_tag_input(line: str) -> bool:
+        """Check if line contains an input tag with value"""
+        return Regexes.TAG_INPUT.value.search(line) is not None
+
+    @staticmethod
+    def is_widget_print(line: str) -> bool:
+        """Check if line contains print widget"""
+        return Regexes.WIDGET_PRINT.value.search(line) is not None
+
+    @staticmethod
+    def is_widget_option(line: str) -> bool:
+        """Check if line contains option widget"""
+        return Regexes.WIDGET_OPTION.value.search(line) is not None
+
+    @staticmethod
+    def is_widget_button(line: str) -> bool:
+        """Check if line contains button widget"""
+        return Regexes.WIDGET_BUTTON.value.search(line) is not None
+
+    @staticmethod
+    def is_widget_link(line: str) -> bool:
+        """Check if line contains link widget"""
+        return Regexes.WIDGET_LINK.value.search(line) is not None
+
+    @staticmethod
+    def is_widget_high_rate_link(line: str) -> bool:
+        """Check if line contains a high-frequency link widget"""
+        return Regexes.WIDGET_HIGH_RATE_LINK.value.search(line) is not None
+
+    @staticmethod
+    def is_any(line: str, *names: str) -> bool:
+        """Check if any of the named predicates is true, eg: is_any(line, "tag_span", "widget_print")"""
+        return predicate_set(*names).any(line)
+
+    @staticmethod
+    def is_only_widgets(line: str) -> bool:
+        """Check if line contains only widgets, tags or variables (no text content)"""
+        # Quick check for lines that definitely aren't just widgets
+        if "<" not in line and "$" not in line and not line.startswith("_"):
+            return False
+
+        # Special cases that are known to be widgets-only
+        if line in {
+            "<<print either(",
+            "<<= either(",
+            "<<- either(",
+            "<<print [",
+            "<<= [",
+            "<<- [",
+        }:
+            return True
+
+        # Remove all widget patterns
+        cleaned_line = line
+        for widget in Regexes.WIDGETS.value.findall(line):
+            if widget:
+                cleaned_line = cleaned_line.replace(widget, "", 1)
+
+        # If all widgets removed and no other content remains
+        if (
+            "<" not in cleaned_line
+            and "$" not in cleaned_line
+            and not cleaned_line.startswith("_")
+        ):
+            return TweeParser._is_blank_text(cleaned_line)
+
+        # Remove all HTML tags
+        for tag in Regexes.HTML_TAGS.value.findall(cleaned_line):
+            if tag:
+                cleaned_line = cleaned_line.replace(tag, "", 1)
+
+        # If all tags removed and no variables remain
+        if "$" not in cleaned_line and not cleaned_line.startswith("_"):
+            return TweeParser._is_blank_text(cleaned_line)
+
+        # Remove all variable references
+        for var in Regexes.VARIABLES.value.findall(cleaned_line):
+            if var:
+                cleaned_line = cleaned_line.replace(var, "", 1)
+
+        # If what remains is empty or just marks, it's only widgets/vars
+        return TweeParser._is_blank_text(cleaned_line)
+
+    @staticmethod
+    def _is_blank_text(line: str) -> bool:
+        line = line.strip()
+        return not line or TweeParser.is_comment(line) or TweeParser.is_only_marks(line)
@@ -0,0 +1,103 @@
+import asyncio
+import csv
+from pathlib import Path
+
+import pandas as pd
+
+from src.compactor import CompactionResult, Compactor
+from src.translation_memory import TranslationMemory
+
+
+def _write(file_path: Path, text: str):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_text(text, encoding="utf-8")
+
+
+def test_compact(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    _write(
+        translated / "a" / "x.csv",
+        "1,Next,下一步\n2,Old line,旧行\n3,Run,跑\n4,Dropped,\n",
+    )
+    _write(raw / "a" / "x.csv", "1,Next\n3,Run\n5,New line\n")
+    _write(translated / "y.csv", "1,Stay,留下\n")
+    _write(raw / "y.csv", "1,Stay\n")
+    _write(translated / "gone.csv", "1,Removed file,删除\n")
+    _write(translated / "emptied.csv", "1,Removed line,删除\n")
+    _write(raw / "emptied.csv", "1,Other line\n")
+    before = (translated / "a" / "x.csv").stat().st_size
+
+    compactor = Compactor(translated, raw, tmp_path / "archive" / "archive.csv")
+    results = sorted(asyncio.run(compactor.compact()))
+
+    assert results[0] == CompactionResult(
+        Path("a/x.csv"), 4, 2, 1, before, (translated / "a" / "x.csv").stat().st_size
+    )
+    assert results[1][:4] == (Path("emptied.csv"), 1, 1, 1)
+    # no raw dict, left untouched
+    assert results[2][:4] == (Path("gone.csv"), 1, 0, 0)
+    assert results[3][:4] == (Path("y.csv"), 1, 0, 0)
+    assert (translated / "a" / "x.csv").read_text(encoding="utf-8") == (
+        "1,Next,下一步\n3,Run,跑\n"
+    )
+    assert (translated / "gone.csv").read_text(encoding="utf-8") == (
+        "1,Removed file,删除\n"
+    )
+    # every row obsolete, the dict is emptied in place but not deleted
+    assert (translated / "emptied.csv").read_text(encoding="utf-8") == ""
+    assert (translated / "y.csv").read_text(encoding="utf-8") == "1,Stay,留下\n"
+
+    archive = sorted(
+        csv.reader(open(tmp_path / "archive" / "archive.csv", encoding="utf-8"))
+    )
+    assert archive == [
+        ["a/x.csv:2", "Old line", "旧行"],
+        ["emptied.csv:1", "Removed line", "删除"],
+    ]
+
+    # the archive is a translation memory file
+    memory = TranslationMemory().build(
+        [pd.read_csv(tmp_path / "archive" / "archive.csv", header=None)]
+    )
+    assert memory.lookup(pd.Series(["Old line"]))[0] == "旧行"
+
+
+def test_compact_to_output(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    _write(translated / "x.csv", "1,Next,下一步\n2,Old line,旧行\n")
+    _write(raw / "x.csv", "1,Next\n")
+    _write(translated / "y.csv", "1,Stay,留下\n")
+    _write(raw / "y.csv", "1,Stay\n")
+
+    asyncio.run(
+        Compactor(translated, raw, tmp_path / "archive.csv", tmp_path / "out").compact()
+    )
+
+    # the translated dicts are left alone
+    assert (translated / "x.csv").read_text(encoding="utf-8").count("\n") == 2
+    assert (tmp_path / "out" / "x.csv").read_text(encoding="utf-8").split() == [
+        "1,Next,下一步"
+    ]
+    assert (tmp_path / "out" / "y.csv").is_file()
+
+
+def test_undecodable_dict_is_left_untouched(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    broken = "1,Next,下一步\n2,Old line,旧行\n".encode("utf-8") + b"3,Run,\xff\xfe\n"
+    translated.mkdir(parents=True)
+    (translated / "x.csv").write_bytes(broken)
+    _write(raw / "x.csv", "1,Next\n3,Run\n")
+    _write(translated / "y.csv", "1,Stay,留下\n2,Old line,旧行\n")
+    _write(raw / "y.csv", "1,Stay\n")
+
+    compactor = Compactor(translated, raw, tmp_path / "archive.csv")
+    results = asyncio.run(compactor.compact())
+
+    assert (translated / "x.csv").read_bytes() == broken
+    assert [result.path for result in results] == [Path("y.csv")]
+    assert list(csv.reader(open(tmp_path / "archive.csv", encoding="utf-8"))) == [
+        ["y.csv:2", "Old line", "旧行"]
+    ]
@@ -1,9 +1,17 @@
+import asyncio
+import json
+import time
+import tracemalloc
+import numpy as np
 import pandas as pd
+import pytest
 import os
 from pathlib import Path
 import csv
 
+from loguru import logger
 from src.differentiator import Differentiator
+from src.translation_memory import TextNormalizer
 
 
 def test_diff():
@@ -13,10 +21,524 @@ def test_diff():
     diff_helper.create_diff()
 
 
-def test_count_diff_rows():
-    diff_helper = Differentiator(
-        Path("dicts/translated/zh-Hans/utf8/"),
-        Path("dicts/raw/dolp"),
-        Path("dicts/diff/dolp"),
+def test_count_diff_rows(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "x.csv").write_text('1,"two\nlines"\n2,Next\n', encoding="utf-8")
+    (tmp_path / "y.csv").write_text("1,Leave", encoding="utf-8")
+
+    diff_helper = Differentiator(tmp_path, tmp_path, tmp_path)
+    assert asyncio.run(diff_helper.count_diff_rows()) == 3
+    # no diff files, nothing to count
+    diff_helper = Differentiator(tmp_path, tmp_path, tmp_path / "missing")
+    assert asyncio.run(diff_helper.count_diff_rows()) == 0
+
+
+def test_count_diff_rows_per_file(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "x.csv").write_text('1,"two\nlines"\n2,Next\n', encoding="utf-8")
+    (tmp_path / "y.csv").write_text("1,Leave", encoding="utf-8")
+
+    diff_helper = Differentiator(tmp_path, tmp_path, tmp_path)
+    assert asyncio.run(diff_helper.count_diff_rows_per_file()) == {
+        tmp_path / "a" / "x.csv": 2,
+        tmp_path / "y.csv": 1,
+    }
+    assert asyncio.run(diff_helper.count_diff_rows()) == 3
+
+
+def test_hash_diff_mask():
+    raw = pd.Series(["Next", "Leave", None, "You walk home.", "nan"])
+    translated = pd.Series(["Leave", "You walk home.", None, "Stay"])
+
+    mask = Differentiator.hash_diff_mask(raw, translated)
+    expected = ~raw.isin(set(translated.dropna()))
+    assert mask.tolist() == expected.tolist()
+
+
+def test_hash_diff_mask_collision(monkeypatch):
+    import src.differentiator as differentiator
+
+    # every text gets the same hash, only the collision check can tell them apart
+    monkeypatch.setattr(
+        differentiator,
+        "hash_array",
+        lambda values, **kwargs: np.zeros(len(values), "uint64"),
+    )
+    raw = pd.Series(["a", "b", "c"])
+    translated = pd.Series(["c", "a"])
+    assert Differentiator.hash_diff_mask(raw, translated).tolist() == [
+        False,
+        True,
+        False,
+    ]
+
+
+def test_benchmark_hash_diff():
+    texts = [f"You say line {i} to the crowd." for i in range(300000)]
+    raw = pd.Series(texts[50000:] + [f"New line {i}" for i in range(5000)])
+    translated = pd.Series(texts)
+
+    start = time.perf_counter()
+    expected = ~raw.isin(set(translated.dropna()))
+    isin_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mask = Differentiator.hash_diff_mask(raw, translated)
+    hash_time = time.perf_counter() - start
+
+    assert mask.tolist() == expected.tolist()
+    logger.info(
+        f"{len(raw)} rows: set + isin {isin_time * 1000:.2f}ms, hash diff {hash_time * 1000:.2f}ms"
+    )
+
+
+def test_translation_memory_diff(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    diff = tmp_path / "diff"
+    autofill = tmp_path / "autofill"
+    for directory in (translated / "a", raw / "a", raw / "b"):
+        directory.mkdir(parents=True)
+
+    (translated / "a" / "old.csv").write_text(
+        '1,Next,下一步\n2,"You walk home.",你走回家。\n', encoding="utf-8"
+    )
+    # "You walk home." moved to another file, "Next" is new in a file without translation
+    (raw / "a" / "old.csv").write_text("1,Next\n3,Run\n", encoding="utf-8")
+    (raw / "b" / "new.csv").write_text('1,"You walk home."\n2,Stay\n', encoding="utf-8")
+
+    differ = Differentiator(
+        translated, raw, diff, translation_memory=True, autofill_path=autofill
+    )
+    assert asyncio.run(differ.create_diff()) == 2
+
+    assert (diff / "a" / "old.csv").read_text(encoding="utf-8").split() == ["3,Run"]
+    assert (diff / "b" / "new.csv").read_text(encoding="utf-8").split() == ["2,Stay"]
+    assert (autofill / "b" / "new.csv").read_text(encoding="utf-8").splitlines() == [
+        "1,You walk home.,你走回家。"
+    ]
+    assert differ.memory_filled == [(Path("b/new.csv"), 1)]
+
+    # without an autofill path the row has nowhere to go, it stays in the diff
+    differ = Differentiator(translated, raw, tmp_path / "kept", translation_memory=True)
+    asyncio.run(differ.create_diff())
+    assert (tmp_path / "kept" / "b" / "new.csv").read_text(encoding="utf-8").split(
+        "\n"
+    ) == ['1,"You walk home."', "2,Stay", ""]
+    assert differ.memory_filled == []
+
+
+def test_normalized_diff(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    translated.mkdir()
+    raw.mkdir()
+    (translated / "a.csv").write_text(
+        '1,"Say ""hi"" now",说“嗨”\n2,Leave,离开\n', encoding="utf-8"
+    )
+    (raw / "a.csv").write_text(
+        '1,"Say ""hi""  now "\n2,Leave\n3,Run\n', encoding="utf-8"
+    )
+
+    outputs = {}
+    for normalizer in (None, TextNormalizer()):
+        diff = tmp_path / f"diff-{normalizer is not None}"
+        differ = Differentiator(
+            translated,
+            raw,
+            diff,
+            normalizer=normalizer,
+            autofill_path=tmp_path / "autofill",
+        )
+        asyncio.run(differ.create_diff())
+        outputs[normalizer is not None] = (
+            (diff / "a.csv").read_text(encoding="utf-8").splitlines()
+        )
+
+    assert outputs[False] == ['1,"Say ""hi""  now "', "3,Run"]
+    assert outputs[True] == ["3,Run"]
+    assert differ.normalized_saved == [(Path("a.csv"), 1)]
+    assert (tmp_path / "autofill" / "a.csv").read_text(
+        encoding="utf-8"
+    ).splitlines() == ['1,"Say ""hi""  now ",说“嗨”']
+
+    # without an autofill path the row stays in the diff
+    differ = Differentiator(
+        translated, raw, tmp_path / "kept", normalizer=TextNormalizer()
+    )
+    asyncio.run(differ.create_diff())
+    assert (tmp_path / "kept" / "a.csv").read_text(
+        encoding="utf-8"
+    ).splitlines() == outputs[False]
+    assert differ.normalized_saved == []
+
+
+def test_near_match_diff(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    translated.mkdir()
+    raw.mkdir()
+    (translated / "a.csv").write_text(
+        "7,You walk home through the quiet park.,你穿过安静的公园走回家。\n",
+        encoding="utf-8",
+    )
+    (raw / "a.csv").write_text(
+        "1,You walk home through the quiet old park.\n2,Something else entirely.\n",
+        encoding="utf-8",
+    )
+
+    differ = Differentiator(
+        translated, raw, tmp_path / "diff", near_match_path=tmp_path / "near"
+    )
+    asyncio.run(differ.create_diff())
+
+    rows = list(csv.reader(open(tmp_path / "near" / "a.csv", encoding="utf-8")))
+    assert rows[0][:3] == ["1", "You walk home through the quiet old park.", "changed"]
+    assert float(rows[0][3]) >= 0.7
+    assert rows[0][4:] == ["7", "你穿过安静的公园走回家。"]
+    assert rows[1] == ["2", "Something else entirely.", "new", "", "", ""]
+    assert differ.near_changed == [(Path("a.csv"), 1)]
+
+
+def test_segment_diff(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    translated.mkdir()
+    raw.mkdir()
+    old = "You wake up early. <<if $rain>>Rain taps the window.<</if>> You get dressed. The house is quiet."
+    new = "You wake up early. <<if $rain>>Rain taps the window.<</if>> You get dressed slowly. The house is quiet."
+    (translated / "a.csv").write_text(f'3,"{old}",你很早醒来……\n', encoding="utf-8")
+    (raw / "a.csv").write_text(f'1,"{new}"\n2,Brand new line.\n', encoding="utf-8")
+
+    differ = Differentiator(
+        translated, raw, tmp_path / "diff", segment_path=tmp_path / "segments"
+    )
+    asyncio.run(differ.create_diff())
+
+    # the passage stays in the diff, its changed sentence is an extra output
+    assert (tmp_path / "diff" / "a.csv").read_text(encoding="utf-8").split("\n") == [
+        f"1,{new}",
+        "2,Brand new line.",
+        "",
+    ]
+    segment_rows = list(
+        csv.reader(open(tmp_path / "segments" / "a.csv", encoding="utf-8"))
+    )
+    assert segment_rows == [["1#2", "You get dressed slowly. "]]
+
+    alignment = json.loads(
+        (tmp_path / "segments" / "a.alignment.json").read_text(encoding="utf-8")
+    )
+    assert alignment[0]["id_r"] == "1" and alignment[0]["old_id"] == "3"
+    assert alignment[0]["changes"] == [{"tag": "replace", "old": [2, 3], "new": [2, 3]}]
+    start, end = alignment[0]["segments"][2]
+    assert new[start:end] == "You get dressed slowly. "
+    assert differ.segmented == [(Path("a.csv"), 1, len(new), end - start)]
+
+
+def test_segment_diff_without_changed_segment(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    translated.mkdir()
+    raw.mkdir()
+    old = (
+        "You wake up early. Rain taps the window. You get dressed. The house is quiet."
+    )
+    rows = {
+        # a deleted sentence
+        1: "You wake up early. You get dressed. The house is quiet.",
+        # a whitespace edit
+        2: "You wake up early.  Rain taps the window. You get dressed. The house is quiet.",
+    }
+    (translated / "a.csv").write_text(f"3,{old},你很早醒来……\n", encoding="utf-8")
+    (raw / "a.csv").write_text(
+        "".join(f"{id_r},{english}\n" for id_r, english in rows.items()),
+        encoding="utf-8",
+    )
+
+    differ = Differentiator(
+        translated, raw, tmp_path / "diff", segment_path=tmp_path / "segments"
+    )
+    asyncio.run(differ.create_diff())
+
+    assert len(
+        (tmp_path / "diff" / "a.csv").read_text(encoding="utf-8").splitlines()
+    ) == len(rows)
+    # no changed segment, the passages are written whole as one segment
+    segment_rows = list(
+        csv.reader(open(tmp_path / "segments" / "a.csv", encoding="utf-8"))
+    )
+    assert segment_rows == [["1#0", rows[1]], ["2#0", rows[2]]]
+    alignment = json.loads(
+        (tmp_path / "segments" / "a.alignment.json").read_text(encoding="utf-8")
+    )
+    assert alignment[0]["segments"] == [[0, len(rows[1])]]
+    assert alignment[0]["changes"] == [{"tag": "replace", "old": [0, 4], "new": [0, 1]}]
+
+
+def test_diff_manifest(tmp_path):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    diff = tmp_path / "diff"
+    translated.mkdir()
+    raw.mkdir()
+    (translated / "a.csv").write_text("1,Next,下一步\n", encoding="utf-8")
+    (raw / "a.csv").write_text("1,Next\n2,Run\n", encoding="utf-8")
+    (raw / "b.csv").write_text("1,Next\n", encoding="utf-8")
+
+    def run():
+        differ = Differentiator(translated, raw, diff)
+        assert asyncio.run(differ.create_diff()) == 2
+        return sorted(differ.reused_files), sorted(differ.recomputed_files)
+
+    assert run() == ([], [Path("a.csv"), Path("b.csv")])
+    assert (diff / ".diff-manifest.json").is_file()
+    assert run() == ([Path("a.csv"), Path("b.csv")], [])
+
+    # changed input and deleted output are recomputed
+    (raw / "b.csv").write_text("1,Next\n2,Stay\n", encoding="utf-8")
+    (diff / "a.csv").unlink()
+    assert run() == ([], [Path("a.csv"), Path("b.csv")])
+    assert (diff / "a.csv").read_text(encoding="utf-8").split() == ["2,Run"]
+
+    # the diff of b.csv is gone after its new row got translated
+    (translated / "b.csv").write_text("1,Next,下一步\n2,Stay,留下\n", encoding="utf-8")
+    assert run() == ([Path("a.csv")], [Path("b.csv")])
+    assert not (diff / "b.csv").exists()
+
+
+def _write_tree(base: Path, files: int, rows: int, translated: bool):
+    for i in range(files):
+        file_path = base / f"d{i % 4}" / f"f{i}.csv"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(file_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            for j in range(rows):
+                # every 10th raw row is new, every 7th moved from the next file
+                if translated:
+                    writer.writerow([j, f"Line {j} of file {i}.", f"第 {j} 行"])
+                elif j % 10 == 0:
+                    writer.writerow([j, f"New line {j} of file {i}, said loudly."])
+                else:
+                    source = (i + 1) % files if j % 7 == 0 else i
+                    writer.writerow([j, f"Line {j} of file {source}."])
+
+
+def test_process_backend(tmp_path):
+    _write_tree(tmp_path / "translated", 4, 200, translated=True)
+    _write_tree(tmp_path / "raw", 4, 200, translated=False)
+
+    outputs = {}
+    for backend in ("thread", "process"):
+        differ = Differentiator(
+            tmp_path / "translated",
+            tmp_path / "raw",
+            tmp_path / backend,
+            max_workers=2,
+            backend=backend,
+            translation_memory=True,
+            autofill_path=tmp_path / f"{backend}-autofill",
+        )
+        assert asyncio.run(differ.create_diff()) == 4
+        outputs[backend] = {
+            (kind, f.relative_to(tmp_path / name)): f.read_bytes()
+            for kind, name in (("diff", backend), ("autofill", f"{backend}-autofill"))
+            for f in (tmp_path / name).rglob("*.csv")
+        }
+        filled = sorted(differ.memory_filled)
+        assert sum(count for _, count in filled) > 0
+
+    assert outputs["thread"] == outputs["process"]
+    assert len([kind for kind, _ in outputs["thread"] if kind == "diff"]) == 4
+
+
+def test_benchmark_diff_backends(tmp_path):
+    _write_tree(tmp_path / "translated", 16, 20000, translated=True)
+    _write_tree(tmp_path / "raw", 16, 20000, translated=False)
+
+    timings = {}
+    for backend in ("thread", "process"):
+        differ = Differentiator(
+            tmp_path / "translated",
+            tmp_path / "raw",
+            tmp_path / backend,
+            backend=backend,
+            manifest=False,
+        )
+        start = time.perf_counter()
+        assert asyncio.run(differ.create_diff()) == 16
+        timings[backend] = time.perf_counter() - start
+
+    # the speedup is only measured, the outputs must match on any core count
+    assert _tree_outputs(tmp_path / "thread") == _tree_outputs(tmp_path / "process")
+    assert len(_tree_outputs(tmp_path / "thread")) == 16
+    logger.info(
+        f"16 files x 20000 rows on {os.cpu_count()} cores: "
+        + ", ".join(f"{k} {v * 1000:.2f}ms" for k, v in timings.items())
+    )
+
+
+def _tree_outputs(base: Path):
+    return {f.relative_to(base): f.read_bytes() for f in base.rglob("*") if f.is_file()}
+
+
+def test_chunked_diff(tmp_path):
+    _write_tree(tmp_path / "translated", 4, 50, translated=True)
+    _write_tree(tmp_path / "raw", 4, 50, translated=False)
+    # whitespace edits, near matches and partly changed passages in the same file
+    with open(tmp_path / "raw" / "d0" / "f0.csv", "a", encoding="utf-8") as f:
+        f.write('100,"Line  1 of file 0."\n101,"Line 2 of file 0!"\n')
+
+    outputs = {}
+    for chunk_rows in (None, 7):
+        out = tmp_path / f"out-{chunk_rows}"
+        differ = Differentiator(
+            tmp_path / "translated",
+            tmp_path / "raw",
+            out / "diff",
+            translation_memory=True,
+            autofill_path=out / "autofill",
+            normalizer=TextNormalizer(),
+            near_match_path=out / "near",
+            segment_path=out / "segments",
+            chunk_rows=chunk_rows,
+            manifest=False,
+        )
+        assert asyncio.run(differ.create_diff()) == 4
+        outputs[chunk_rows] = (
+            _tree_outputs(out),
+            sorted(differ.memory_filled),
+            sorted(differ.normalized_saved),
+            sorted(differ.near_changed),
+        )
+
+    assert outputs[None] == outputs[7]
+    assert outputs[7][2] == [(Path("d0/f0.csv"), 1)]
+
+
+def test_inflight_budget(tmp_path):
+    _write_tree(tmp_path / "translated", 4, 50, translated=True)
+    _write_tree(tmp_path / "raw", 4, 50, translated=False)
+
+    outputs = {}
+    for budget in (None, 1):
+        differ = Differentiator(
+            tmp_path / "translated",
+            tmp_path / "raw",
+            tmp_path / f"diff-{budget}",
+            max_workers=4,
+            max_inflight_bytes=budget,
+            chunk_rows=10,
+        )
+        # a budget smaller than every pair runs the pairs one by one
+        assert asyncio.run(differ.create_diff()) == 4
+        outputs[budget] = _tree_outputs(tmp_path / f"diff-{budget}")
+    assert outputs[None] == outputs[1]
+
+
+def test_benchmark_chunked_diff(tmp_path):
+    _write_tree(tmp_path / "translated", 2, 100000, translated=True)
+    _write_tree(tmp_path / "raw", 2, 100000, translated=False)
+
+    results = {}
+    for chunk_rows in (None, 10000):
+        differ = Differentiator(
+            tmp_path / "translated",
+            tmp_path / "raw",
+            tmp_path / f"diff-{chunk_rows}",
+            max_workers=1,
+            chunk_rows=chunk_rows,
+            manifest=False,
+        )
+        tracemalloc.start()
+        start = time.perf_counter()
+        asyncio.run(differ.create_diff())
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[chunk_rows] = (elapsed, peak)
+
+    logger.info(
+        "2 files x 100000 rows: "
+        + ", ".join(
+            f"chunk_rows={k} {t * 1000:.2f}ms peak {p / 2**20:.1f}MiB"
+            for k, (t, p) in results.items()
+        )
+    )
+    assert results[10000][1] < results[None][1]
+
+
+def test_load_csv_fallback(tmp_path, monkeypatch):
+    import src.differentiator as differentiator
+
+    csv_file = tmp_path / "a.csv"
+    csv_file.write_text('1,Next\n2,"You say ""hi""."\n', encoding="utf-8")
+    diff_helper = Differentiator(tmp_path, tmp_path, tmp_path)
+
+    df = diff_helper._load_csv_to_dataframe(
+        csv_file, ["id_r", "english"], Path("a.csv"), "raw"
+    )
+    assert df["english"].tolist() == ["Next", 'You say "hi".']
+    assert diff_helper.csv_fallback_files == []
+
+    # a failing fast engine falls back to the python engine and is recorded
+    monkeypatch.setattr(differentiator, "FAST_CSV_ENGINES", ["missing-engine"])
+    df = diff_helper._load_csv_to_dataframe(
+        csv_file, ["id_r", "english"], Path("a.csv"), "raw"
+    )
+    assert df["english"].tolist() == ["Next", 'You say "hi".']
+    assert diff_helper.csv_fallback_files == [csv_file]
+
+
+def test_malformed_file_does_not_abort_diff(tmp_path, monkeypatch):
+    translated = tmp_path / "translated"
+    raw = tmp_path / "raw"
+    translated.mkdir()
+    raw.mkdir()
+    for name in ("bad.csv", "good.csv"):
+        (translated / name).write_text("1,Next,继续\n", encoding="utf-8")
+        (raw / name).write_text("1,Next\n2,Leave\n", encoding="utf-8")
+
+    diff_chunk = Differentiator._diff_chunk
+
+    def failing_chunk(self, df_raw, translated, diff_file, relative_path, stats):
+        if relative_path.name == "bad.csv":
+            raise pd.errors.ParserError("Error tokenizing data")
+        return diff_chunk(self, df_raw, translated, diff_file, relative_path, stats)
+
+    monkeypatch.setattr(Differentiator, "_diff_chunk", failing_chunk)
+    differ = Differentiator(translated, raw, tmp_path / "diff")
+
+    # the malformed file is logged and copied whole, the other files are still diffed
+    assert asyncio.run(differ.create_diff()) == 2
+    assert (tmp_path / "diff" / "bad.csv").read_text(encoding="utf-8") == (
+        "1,Next\n2,Leave\n"
+    )
+    assert (tmp_path / "diff" / "good.csv").read_text(encoding="utf-8") == "2,Leave\n"
+
+
+def test_benchmark_load_csv():
+    trees = [Path("dicts/raw"), Path("dicts/translated")]
+    csv_files = [f for tree in trees if tree.is_dir() for f in tree.rglob("*.csv")]
+    if not csv_files:
+        pytest.skip("dicts/raw and dicts/translated not found")
+
+    diff_helper = Differentiator(*trees, Path("dicts/diff"))
+
+    start = time.perf_counter()
+    for csv_file in csv_files:
+        try:
+            pd.read_csv(csv_file, header=None, engine="python", sep=",")
+        except Exception:
+            pass
+    python_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for csv_file in csv_files:
+        diff_helper._load_csv_to_dataframe(csv_file, None, csv_file, "benchmark")
+    fast_time = time.perf_counter() - start
+
+    logger.info(
+        f"{len(csv_files)} files: python engine {python_time:.2f}s, "
+        f"fast loader {fast_time:.2f}s, {len(diff_helper.csv_fallback_files)} fallbacks"
     )
-    diff_helper.count_diff_rows()
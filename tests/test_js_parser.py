@@ -0,0 +1,173 @@
+import re
+import time
+from pathlib import Path
+
+from loguru import logger
+
+from src.js_parser import JSParser, SPECIAL_FILES
+
+SAMPLE = """// "comment string"
+/* 'block comment' */
+const half = total / 2, quotes = /["'`]/g;
+function greet(name) {
+    return `Hello ${name + "!"} and
+welcome to ${ {town: `the ${place}`}.town }`;
+}
+let s = 'it\\'s'; either("One thing", "Two");
+"""
+
+
+def test_literals_positions():
+    parser = JSParser(SAMPLE, Path("macros.js"))
+    literals = list(parser.literals())
+    values = [lit.value for lit in literals]
+
+    # comments and regex literals are not strings
+    assert "comment string" not in values
+    assert "block comment" not in values
+    assert values[0].startswith("Hello ${name")
+    assert literals[0].line == 4 and literals[0].end_line == 5
+    assert literals[0].context == "    return `"
+    assert "One thing" in values and "Two" in values
+
+
+def test_special_files_rules():
+    parser = JSParser(SAMPLE, Path("macros.js"))
+    kept = [lit.value for lit in parser.parse()]
+
+    # nested "!" belongs to the kept template, 'it\'s' shares the line of either(
+    assert kept == [kept[0], "it\\'s", "One thing", "Two"]
+    assert "!" not in kept
+    assert parser.to_line_flags(parser.parse()) == [
+        False,
+        False,
+        False,
+        False,
+        True,
+        True,
+        False,
+        True,
+        False,
+    ]
+
+
+BENCH_SAMPLE = """/* eslint-disable no-undef */
+function statDisplay(stat, value, caps) {
+	const output = [];
+	if (V.options.numberify_stats > 0 && value !== undefined) {
+		output.push(Math.clamp(value + 1, 0, 1000));
+	}
+	for (let i = 0; i < stat.list.length; i++) {
+		const total = stat.list[i].amount / 2 + stat.list[i].bonus;
+		if (total > stat.max) stat.max = total;
+	}
+	const name = caps ? stat.name_cap : stat.name;
+	return `<span class="green">${name} is now ${either("high", "rising")}</span>
+		<br>${output.join(", ")}`;
+}
+window.statDisplay = statDisplay;
+"""
+
+
+PREGNANCY_TYPES = """function pregnancySize(week) {
+	if (week < 4) {
+		return "tiny";
+	} else if (week < 12) return "small";
+	const sizes = ["big", "huge"];
+	return ["tiny", "small", "normal"][week % 3];
+}
+"""
+
+
+def test_rules_reach_past_the_literal():
+    parser = JSParser(PREGNANCY_TYPES, Path("pregnancy-types.js"))
+    kept = [lit.value for lit in parser.parse()]
+
+    # 'return "tiny";' ends after the literal, 'return ["tiny",' after the first one
+    assert kept == ["tiny", "small", "tiny", "small", "normal"]
+    assert "big" not in kept
+
+
+def _line_scan(lines, patterns):
+    """the per-line scan of ParseJS.parse_type_only, the extraction before the lexer"""
+    return [
+        bool(line.strip() and any(p in line.strip() for p in patterns))
+        for line in lines
+    ]
+
+
+def _assert_same_as_line_scan(content, filename):
+    parser = JSParser(content, Path(filename))
+    patterns = SPECIAL_FILES[filename]
+    flags = parser.to_line_flags(parser.filter_literals(patterns))
+    expected = _line_scan(content.split("\n"), patterns)
+    # every line where a literal with letters starts is flagged like the line scan did,
+    # apart from the inner lines of multi-line templates, kept whole now
+    literals = list(parser.literals())
+    inner = {line for lit in literals for line in range(lit.line + 1, lit.end_line + 1)}
+    text_lines = {
+        lit.line
+        for lit in literals
+        if re.search("[A-Za-z]", lit.value) and lit.line not in inner
+    }
+    for line in text_lines:
+        assert flags[line] == expected[line], content.split("\n")[line]
+    return flags, expected
+
+
+def test_same_lines_as_line_scan():
+    _assert_same_as_line_scan(PREGNANCY_TYPES, "pregnancy-types.js")
+    _assert_same_as_line_scan(SAMPLE, "macros.js")
+    _assert_same_as_line_scan(
+        """setup.feats = {
+	"Tidy": {
+		title: "Tidy",
+		desc: "Kept the orphanage clean.",
+		hint: `Clean ${"often"}.`,
+		series: "none",
+	},
+};
+el.html = "<span class='red'>Lost</span>";
+""",
+        "feats.js",
+    )
+    _assert_same_as_line_scan(
+        """function lose(targetName) {
+	return "You lose " + targetName + ".";
+}
+const label = "Stat";
+""",
+        "text.js",
+    )
+
+
+def test_benchmark_lexer_vs_line_scan():
+    block = BENCH_SAMPLE * 2000
+    lines = block.split("\n")
+    patterns = SPECIAL_FILES["macros.js"]
+
+    start = time.perf_counter()
+    for _ in range(5):
+        expected = _line_scan(lines, patterns)
+    line_scan = (time.perf_counter() - start) / 5
+
+    start = time.perf_counter()
+    for _ in range(5):
+        parser = JSParser(block, Path("macros.js"))
+        list(parser.literals())
+    tokenise = (time.perf_counter() - start) / 5
+
+    # rules run on the cached tokens, the file is not scanned again
+    start = time.perf_counter()
+    for _ in range(5):
+        flags = parser.to_line_flags(parser.filter_literals(patterns))
+    rules = (time.perf_counter() - start) / 5
+
+    logger.info(
+        f"{len(lines)} lines: line scan {line_scan * 1000:.2f}ms, "
+        f"lexer tokenise {tokenise * 1000:.2f}ms, rules {rules * 1000:.2f}ms"
+    )
+    # the same lines, plus the second line of each multi-line template
+    extra = [i for i, (new, old) in enumerate(zip(flags, expected)) if new != old]
+    assert all(not expected[i] and lines[i].lstrip().startswith("<br>") for i in extra)
+    assert len(extra) == 2000
@@ -0,0 +1,123 @@
+import asyncio
+
+from loguru import logger
+
+from src.markup_masker import MarkupMasker
+from src.token_counter import estimate_tokens
+from src.translation_engine import TranslationEngine
+from tests.test_translation_engine import FakeClient
+
+ROWS = [
+    "<<link [[Next|Bath Ending]]>><<endevent>><<set $phase to 1>><</link>>",
+    'You see <span class="red">$NPCList[0].fullDescription</span> smile at you.',
+    '<<if $player.gender is "m">>He<<else>>She<</if>> waves. [[Wave back|Street Wave]]',
+    '<<button "Buy it">><<set _cost to 50>><</button>> | [[Leave]]',
+    "It costs $5, which is _not_ much.",
+    "<<set $x to 1>><<run delete $y>>",
+]
+
+
+def test_mask_restore_roundtrip():
+    masker = MarkupMasker()
+    for row in ROWS:
+        masked = masker.mask(row)
+        assert masker.restore(masked, masked.text) == row
+
+    masked = masker.mask(ROWS[0])
+    assert masked.text == "{0}Next{1}"
+    assert masked.spans == (
+        "<<link [[",
+        "|Bath Ending]]>><<endevent>><<set $phase to 1>><</link>>",
+    )
+    masked = masker.mask(ROWS[3])
+    assert masked.text == "{0}Buy it{1} | {2}"
+    # prices and plain words are not variables
+    assert masker.mask(ROWS[4]).spans == ()
+
+    # comparisons in prose are not tags
+    for row in ("If a < b and c > d, run.", "Love <3 and >_< faces", "x<y, y>z"):
+        assert masker.mask(row).spans == ()
+    assert masker.mask("a <br/> b <i >c</i>").spans == ("<br/>", "<i >", "</i>")
+
+    # markup only, no request needed
+    assert not masker.mask(ROWS[5]).has_text
+    assert masker.mask(ROWS[4]).has_text
+
+
+def test_restore_validation():
+    masker = MarkupMasker()
+    masked = masker.mask("<<if $a>>Hello<<else>>Bye<</if>>")
+    assert masked.text == "{0}Hello{1}Bye{2}"
+
+    # reordered, spaced and full-width placeholders are fine
+    assert (
+        masker.restore(masked, "{1}再见{ 0 }你好｛2｝")
+        == "<<else>>再见<<if $a>>你好<</if>>"
+    )
+    # missing, repeated and unknown placeholders are not
+    assert masker.restore(masked, "{0}你好{1}再见") is None
+    assert masker.restore(masked, "{0}你好{1}再见{2}{2}") is None
+    assert masker.restore(masked, "{0}你好{1}再见{2}{3}") is None
+    assert masker.failures == 3
+
+    # rows with placeholder-like text are sent as they are
+    masked = masker.mask("Press {0} to <b>jump</b>")
+    assert masked.spans == ()
+    assert masked.text == "Press {0} to <b>jump</b>"
+
+
+class LossyClient(FakeClient):
+    """Drops the placeholders of masked rows"""
+
+    async def chat(self, model, messages):
+        response = await super().chat(model, messages)
+        content = response["message"]["content"]
+        return {"message": {"content": content.replace("{1}", "")}}
+
+
+def test_engine_masking():
+    masker = MarkupMasker()
+    client = FakeClient(latency=0.001)
+    engine = TranslationEngine(prompt="P:", client=client, masker=masker)
+
+    translated = asyncio.run(engine.translate(ROWS[0]))
+    assert translated == (
+        "<<link [[NEXT|Bath Ending]]>><<endevent>><<set $phase to 1>><</link>>"
+    )
+    assert asyncio.run(engine.translate(ROWS[5])) == ROWS[5]
+    assert client.calls == 1
+
+    # lost placeholders, the row is sent again unmasked
+    client = LossyClient(latency=0.001)
+    engine = TranslationEngine(prompt="P:", client=client, masker=masker)
+    assert asyncio.run(engine.translate(ROWS[0])) == ROWS[0].upper()
+    assert client.calls == 2
+
+
+def test_engine_batch_masking():
+    masker = MarkupMasker()
+    client = FakeClient(latency=0.001)
+    engine = TranslationEngine(prompt="P:", client=client, masker=masker, batch_rows=8)
+
+    results = asyncio.run(engine.translate_batch(ROWS))
+
+    assert results[1] == (
+        'YOU SEE <span class="red">$NPCList[0].fullDescription</span> SMILE AT YOU.'
+    )
+    assert results[3] == '<<button "BUY IT">><<set _cost to 50>><</button>> | [[Leave]]'
+    assert results[5] == ROWS[5]
+    assert client.calls == 1
+
+
+def test_benchmark_masking_tokens():
+    masker = MarkupMasker()
+    rows = ROWS * 100
+    before = sum(estimate_tokens(row) for row in rows)
+    for row in rows:
+        masker.mask(row)
+
+    logger.info(
+        f"Masking {len(rows)} rows: {masker.tokens_saved} of ~{before} estimated tokens saved "
+        f"({masker.tokens_saved / before:.1%})"
+    )
+    assert masker.tokens_saved > before / 3
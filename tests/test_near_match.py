@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.near_match import NearMatchIndex
+
+
+def test_query():
+    index = NearMatchIndex().build(
+        pd.Series(
+            [
+                "You walk home through the quiet park.",
+                "The shop is closed.",
+                None,
+                "Hi",
+            ]
+        )
+    )
+    matches = index.query(
+        pd.Series(
+            [
+                "You walk home through the quiet old park.",
+                "Something else entirely.",
+                "the shop is CLOSED.",
+                None,
+                "Hi",
+            ]
+        )
+    )
+
+    assert [match.index for match in matches] == [0, -1, 1, -1, 3]
+    assert 0.7 <= matches[0].similarity < 1.0
+    assert matches[2].similarity == 1.0
+
+
+def test_benchmark_query():
+    rng = np.random.default_rng(0)
+    words = "you walk the street slowly and look at sky dark warm cold she smile laugh run home".split()
+    texts = [" ".join(rng.choice(words, 14)) + f" {i}." for i in range(100000)]
+    edited = [texts[i].replace(" ", "  and ", 1) for i in range(0, 100000, 20)]
+    new = [f"A brand new line number {i} appears." for i in range(2000)]
+
+    start = time.perf_counter()
+    index = NearMatchIndex().build(pd.Series(texts))
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matches = index.query(pd.Series(edited + new))
+    query = time.perf_counter() - start
+
+    found = sum(match.index == i * 20 for i, match in enumerate(matches[:5000]))
+    assert all(match.index == -1 for match in matches[5000:])
+    assert found > 4500
+    logger.info(
+        f"100000 rows: build {build * 1000:.2f}ms, query of 7000 rows {query * 1000:.2f}ms, "
+        f"{found}/5000 edits found"
+    )
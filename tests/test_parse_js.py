@@ -3,48 +3,8 @@ from pathlib import Path
 from typing import List, Dict, Set, Optional, Any, Callable, Tuple, Union
 from .consts import *
 from .parse_twee import ParseTwee
+from src.js_parser import JSParser, SPECIAL_FILES
 
-# File name patterns for special handling
-SPECIAL_FILES = {
-    # 01-setup
-    "weather-descriptions.js": {"'", '"', "`"},
-
-    # 02-Helpers
-    "macros.js": {"return `", "either(", "return '", 'return "'},
-
-    # 04-Variables
-    "feats.js": {"title: ", "desc: ", "hint: ", ".html"},
-    "colours.js": {'name_cap: "', 'name: "'},
-    "shop.js": {'"'},
-    "plant-setup.js": {"plural:", "singular:", "seed_name:"},
-
-    # special-masturbation
-    "macros-masturbation.js": {"namecap", "name : name"},
-
-    # 04-Pregnancy
-    "children-story-functions.js": {"const wordList", "wordList.push"},
-    "pregnancy.js": {"names = ['", "names.pushUnique", "spermOwner.name +", "spermOwner.fullDescription +", ".replace(/[^a-zA-Z"},
-    "story-functions.js": {"name = (caps ?", "name = caps ?", "name = name[0]"},
-    "pregnancy-types.js": {'return "tiny";', 'return "small";', 'return "normal";', 'return "large";', 'return ["tiny",'},
-
-    # 03-Templates
-    "t-actions.js": {"either("},
-    "t-bodyparts.js": {"either("},
-
-    # external
-    "color-namer.js": None,  # Special handling
-
-    # base-system
-    "widgets.js": {".name_cap,", "addfemininityfromfactor(", "playerAwareTheyArePregnant()", "function formatList("},
-    "text.js": {".statChange", 'return "', "targetName"},
-    "stat-changes.js": {"return '", 'return "', ".statChange"},
-
-    # 01-main
-    "02-tooltips.js": {'"', '`', "Description", "Output", "<span", "<br>"},
-
-    # 05-renderer
-    "30-canvasmodel-editor.js": {'CombatEditor.create', 'CombatEditor.Create', 'textContent'},
-}
 
 class ParseJS:
     """Parser for JavaScript files in Degrees of Lewdity codebase"""
@@ -79,7 +39,7 @@ class ParseJS:
                 if self._filename == "color-namer.js":
                     return self.parse_type_between(starts=["var colors = {"], ends=["}"])
             else:
-                return self.parse_type_only(patterns)
+                return self.parse_type_literals(patterns)
 
         # Specific file parsers for complex files
         match self._filename:
@@ -141,7 +101,7 @@ class ParseJS:
         match self._filename:
             case "widgets.js" | "text.js" | "stat-changes.js":
                 if self._filename in SPECIAL_FILES:
-                    return self.parse_type_only(SPECIAL_FILES[self._filename])
+                    return self.parse_type_literals(SPECIAL_FILES[self._filename])
                 return self._parse_normal()
             case "effect.js":
                 return self._parse_effect()
@@ -710,6 +670,12 @@ class ParseJS:
 
         return [bool(line.strip() and any(p in line.strip() for p in pattern)) for line in self._lines]
 
+    def parse_type_literals(self, patterns: Set[str]) -> List[bool]:
+        """Parse file with the JS lexer, keeping lines of literals whose context matches patterns"""
+        content = "\n".join(line.rstrip("\r\n") for line in self._lines)
+        parser = JSParser(content, self._filepath)
+        return parser.to_line_flags(parser.filter_literals(patterns))[:len(self._lines)]
+
     def parse_type_between(self, starts: List[str], ends: List[str], contain: bool = False) -> List[bool]:
         """Parse extracting only content between start and end markers"""
         results = []
@@ -4,6 +4,7 @@ from pathlib import Path
 
 from .consts import *
 from .tools.process_variables import VariablesProcess
+from src.twee_parser import TweeParser
 
 
 class ParseTwee:
@@ -350,16 +351,19 @@ class ParseTwee:
             if self.is_comment(line) or self.is_event(line) or self.is_only_marks(line):
                 results.append(False)
             elif (
-                self.is_tag_span(line)
-                or self.is_tag_label(line)
-                or self.is_widget_option(line)
-                or self.is_widget_link(line)
+                self.is_any(
+                    line,
+                    "tag_span",
+                    "tag_label",
+                    "widget_option",
+                    "widget_link",
+                    "widget_print",
+                )
                 or "$_value2.name" in line
                 or "<<print $_label" in line
                 or "<<= $_label" in line
                 or "<<- $_label" in line
                 or "(No access)" in line
-                or self.is_widget_print(line)
                 or "replace(/[^a-zA-Z" in line
                 or "notEquippedItem.name" in line
             ):
@@ -427,13 +431,16 @@ class ParseTwee:
             if self.is_comment(line) or self.is_event(line) or self.is_only_marks(line):
                 results.append(False)
             elif (
-                self.is_tag_span(line)
+                self.is_any(
+                    line,
+                    "tag_span",
+                    "tag_label",
+                    "widget_print",
+                    "widget_option",
+                    "widget_link",
+                )
                 or "<<wearlink_norefresh" in line
                 or ">>." in line
-                or self.is_tag_label(line)
-                or self.is_widget_print(line)
-                or self.is_widget_option(line)
-                or self.is_widget_link(line)
                 or "__" in line
                 or '? "' in line
                 or ".replace(/[^a-zA-Z" in line
@@ -522,10 +529,9 @@ class ParseTwee:
             ):
                 results.append(False)
             elif (
-                self.is_tag_span(line)
-                or self.is_widget_print(line)
-                or self.is_tag_label(line)
-                or self.is_widget_option(line)
+                self.is_any(
+                    line, "tag_span", "widget_print", "tag_label", "widget_option"
+                )
                 or "<<run delete " in line
                 or "<<if $NPCList" in line
                 or "<<if ($NPCList" in line
@@ -2087,134 +2093,18 @@ class ParseTwee:
 
     """ 判断 """
 
-    @staticmethod
-    def is_comment(line: str) -> bool:
-        """Check if line is a comment"""
-        if line.startswith("*") or line.startswith("*/") or line.startswith("-->"):
-            return True
-        return (line.startswith("/*") or line.startswith("<!--")) and (
-            line.endswith("*/") or line.endswith("-->")
-        )
-
-    @staticmethod
-    def is_json_line(line: str) -> bool:
-        """Check if line follows JSON property format"""
-        pattern = r"^[\w\"]*\s*:\s*[ `\'/\$\.\w\":,\|\(\)\{\}\[\]]+,*$"
-        return bool(re.search(pattern, line))
-
-    @staticmethod
-    def is_only_marks(line: str) -> bool:
-        """Check if line contains only symbols (no alphanumeric chars)"""
-        return not re.search(r"[A-Za-z\d]", line)
-
-    @staticmethod
-    def is_event(line: str) -> bool:
-        """Check if line contains an event marker"""
-        return "::" in line
-
-    @staticmethod
-    def is_tag_span(line: str) -> bool:
-        """Check if line contains a span tag with content"""
-        return bool(re.search(r"<span.*?>[\"\w\.\-+\$]", line))
-
-    @staticmethod
-    def is_tag_label(line: str) -> bool:
-        """Check if line contains a label tag with content"""
-        return bool(
-            re.search(r"<label>[\w\-+]", line) or re.search(r"\w</label>", line)
-        )
-
-    @staticmethod
-    def is_tag_input(line: str) -> bool:
-        """Check if line contains an input tag with value"""
-        return bool(re.search(r"<input.*?value=\"", line))
-
-    @staticmethod
-    def is_widget_print(line: str) -> bool:
-        """Check if line contains print widget"""
-        pattern = r"<<(?:print|=|-)\s[^<]*[\"\'`\w]+[\-\?\s\w\.\$,\'\"<>\[\]\(\)/]+(?:\)>>|\">>|\'>>|`>>|\]>>|>>)"
-        return bool(re.search(pattern, line))
-
-    @staticmethod
-    def is_widget_option(line: str) -> bool:
-        """Check if line contains option widget"""
-        return bool(re.search(r"<<option\s\"", line))
-
-    @staticmethod
-    def is_widget_button(line: str) -> bool:
-        """Check if line contains button widget"""
-        return bool(re.search(r"<<button ", line))
-
-    @staticmethod
-    def is_widget_link(line: str) -> bool:
-        """Check if line contains link widget"""
-        pattern = r"<<link\s*(\[\[|\"\w|`\w|\'\w|\"\(|`\(|\'\(|_\w|`)"
-        return bool(re.search(pattern, line))
-
-    @staticmethod
-    def is_widget_high_rate_link(line: str) -> bool:
-        """Check if line contains a high-frequency link widget"""
-        pattern = r"<<link \[\[(Next\||Next\s\||Leave\||Refuse\||Return\||Resume\||Confirm\||Continue\||Stop\||Phase\|)"
-        return bool(re.search(pattern, line))
-
-    @staticmethod
-    def is_only_widgets(line: str) -> bool:
-        """Check if line contains only widgets, tags or variables (no text content)"""
-        # Quick check for lines that definitely aren't just widgets
-        if "<" not in line and "$" not in line and not line.startswith("_"):
-            return False
-
-        # Special cases that are known to be widgets-only
-        special_widget_patterns = {
-            "<<print either(",
-            "<<= either(",
-            "<<- either(",
-            "<<print [",
-            "<<= [",
-            "<<- [",
-        }
-        if line in special_widget_patterns:
-            return True
-
-        # Remove all widget patterns
-        cleaned_line = line
-        for widget in re.findall(r"(<<(?:[^<>]*?|run.*?|for.*?)>>)", line):
-            if widget:
-                cleaned_line = cleaned_line.replace(widget, "", 1)
-
-        # If all widgets removed and no other content remains
-        if (
-            "<" not in cleaned_line
-            and "$" not in cleaned_line
-            and not cleaned_line.startswith("_")
-        ):
-            return (
-                not cleaned_line.strip()
-                or ParseTwee.is_comment(cleaned_line.strip())
-                or ParseTwee.is_only_marks(cleaned_line.strip())
-            )
-
-        # Remove all HTML tags
-        for tag in re.findall(r"(<[/\s\w\"=\-@\$\+\'\.]*>)", cleaned_line):
-            if tag:
-                cleaned_line = cleaned_line.replace(tag, "", 1)
-
-        # If all tags removed and no variables remain
-        if "$" not in cleaned_line and not cleaned_line.startswith("_"):
-            return (
-                not cleaned_line.strip()
-                or ParseTwee.is_comment(cleaned_line.strip())
-                or ParseTwee.is_only_marks(cleaned_line.strip())
-            )
-
-        # Remove all variable references
-        for var in re.findall(r"((?:\$|_)[^_][#;\w\.\(\)\[\]\"\'`]*)", cleaned_line):
-            if var:
-                cleaned_line = cleaned_line.replace(var, "", 1)
-
-        # If what remains is empty or just marks, it's only widgets/vars
-        return (
-            not cleaned_line.strip()
-            or ParseTwee.is_comment(cleaned_line.strip())
-            or ParseTwee.is_only_marks(cleaned_line.strip())
-        )
+    # predicates and their compiled patterns live in src.twee_parser
+    is_comment = staticmethod(TweeParser.is_comment)
+    is_json_line = staticmethod(TweeParser.is_json_line)
+    is_only_marks = staticmethod(TweeParser.is_only_marks)
+    is_event = staticmethod(TweeParser.is_event)
+    is_tag_span = staticmethod(TweeParser.is_tag_span)
+    is_tag_label = staticmethod(TweeParser.is_tag_label)
+    is_tag_input = staticmethod(TweeParser.is_tag_input)
+    is_widget_print = staticmethod(TweeParser.is_widget_print)
+    is_widget_option = staticmethod(TweeParser.is_widget_option)
+    is_widget_button = staticmethod(TweeParser.is_widget_button)
+    is_widget_link = staticmethod(TweeParser.is_widget_link)
+    is_widget_high_rate_link = staticmethod(TweeParser.is_widget_high_rate_link)
+    is_any = staticmethod(TweeParser.is_any)
+    is_only_widgets = staticmethod(TweeParser.is_only_widgets)
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from contextlib import aclosing
+
+import httpx
+import pytest
+from loguru import logger
+
+from src.providers import (
+    ChatProvider,
+    OllamaProvider,
+    OpenAIProvider,
+    create_http_client,
+    create_provider,
+)
+from src.stand_in_server import StandInServer, stand_in_reply
+from src.translation_engine import TranslationEngine, format_batch
+
+MESSAGES = [{"role": "user", "content": "Translate:\nNext"}]
+
+
+def test_stand_in_reply():
+    assert stand_in_reply("Translate:\nNext") == "NEXT"
+    batch = "Translate:\n" + format_batch(["Next", "Leave"])
+    assert stand_in_reply(batch) == "@@1@@\nNEXT\n@@2@@\nLEAVE"
+
+
+def test_providers_against_stand_in_server():
+    async def run():
+        async with StandInServer() as server, create_http_client() as http:
+            openai = OpenAIProvider(f"{server.url}/v1", api_key="sk-test", http=http)
+            ollama = OllamaProvider(server.url, http=http)
+            answers = [
+                await openai.chat(model="m", messages=MESSAGES),
+                await ollama.chat(model="m", messages=MESSAGES),
+            ]
+            with pytest.raises(httpx.HTTPStatusError):
+                await OpenAIProvider(server.url, http=http).chat("m", MESSAGES)
+            return answers, server.requests
+
+    answers, requests = asyncio.run(run())
+    assert [a["message"]["content"] for a in answers] == ["NEXT", "NEXT"]
+    assert requests == 2
+
+
+def test_create_provider():
+    provider = create_provider("deepseek", env={"DEEPSEEK_API_KEY": "sk-test"})
+    assert isinstance(provider, OpenAIProvider)
+    asyncio.run(provider.aclose())
+    with pytest.raises(ValueError):
+        create_provider("gpt", env={})
+    with pytest.raises(ValueError, match="OpenAI-compatible"):
+        create_provider("cursor")
+    with pytest.raises(ValueError, match="--provider openai"):
+        create_provider("X-ALMA")
+
+
+def test_connections_are_pooled():
+    async def run():
+        async with StandInServer(latency=0.01) as server, create_http_client() as http:
+            provider = OpenAIProvider(f"{server.url}/v1", http=http)
+            for _ in range(3):
+                await asyncio.gather(
+                    *(provider.chat(model="m", messages=MESSAGES) for _ in range(4))
+                )
+            return server
+
+    server = asyncio.run(run())
+    assert server.requests == 12
+    # keep-alive connections are reused across rounds
+    assert server.connections <= 4
+    assert server.max_in_flight == 4
+
+
+def test_engine_over_provider():
+    texts = ["Next", "Leave", "Next", "Stay"]
+
+    async def run():
+        async with StandInServer() as server, create_http_client() as http:
+            engine = TranslationEngine(
+                prompt="Translate:\n",
+                concurrency=2,
+                client=OpenAIProvider(f"{server.url}/v1", http=http),
+                batch_rows=2,
+            )
+            async with aclosing(engine.translate_ordered(texts)) as results:
+                return [item async for item in results]
+
+    assert asyncio.run(run()) == [(i, t.upper()) for i, t in enumerate(texts)]
+
+
+def test_benchmark_provider_throughput():
+    rows = 64
+    latency = 0.02
+    timings = {}
+
+    async def run(concurrency):
+        async with (
+            StandInServer(latency=latency) as server,
+            create_http_client() as http,
+        ):
+            engine = TranslationEngine(
+                prompt="Translate:\n",
+                concurrency=concurrency,
+                client=OpenAIProvider(f"{server.url}/v1", http=http),
+            )
+            start = time.perf_counter()
+            async with aclosing(
+                engine.translate_ordered(f"row {i}" for i in range(rows))
+            ) as results:
+                assert len([item async for item in results]) == rows
+            return time.perf_counter() - start, server.connections
+
+    for concurrency in (1, 8):
+        timings[concurrency], connections = asyncio.run(run(concurrency))
+        assert connections <= concurrency
+
+    logger.info(
+        f"{rows} rows at {latency * 1000:.0f}ms per request over HTTP: "
+        + ", ".join(
+            f"concurrency {k} {rows / v:.0f} rows/s" for k, v in timings.items()
+        )
+    )
+    assert timings[8] < timings[1] / 2
+
+
+def test_incomplete_provider_fails_on_creation():
+    class NoStreamProvider(ChatProvider):
+        def _path(self) -> str:
+            return "/chat"
+
+        def _payload(self, model, messages, stream):
+            return {"model": model, "messages": messages}
+
+        def _content(self, body):
+            return body["content"]
+
+    with pytest.raises(TypeError):
+        NoStreamProvider("http://127.0.0.1:9")
@@ -0,0 +1,209 @@
+import asyncio
+import csv
+import time
+
+import httpx
+import pytest
+from loguru import logger
+
+from src.providers import OpenAIProvider, create_http_client, create_provider
+from src.rate_limiter import RateLimiter, RateLimits, TokenBucket, parse_retry_after
+from src.stand_in_server import StandInServer
+
+MESSAGES = [{"role": "user", "content": "Translate:\nNext"}]
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("0.25") == 0.25
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.wait_time(2) == 0
+    bucket.consume(3)
+    # one token of debt, two to refill
+    assert bucket.wait_time(1) == pytest.approx(0.2, abs=0.02)
+    # larger than the bucket, waits for a full one
+    assert bucket.wait_time(5) == pytest.approx(0.3, abs=0.02)
+    bucket.refund(10)
+    assert bucket.level == 2
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, capacity=1)
+
+
+def test_limiter_paces_requests():
+    limiter = RateLimiter(RateLimits(rpm=1200), burst=1 / 1200)
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(limiter.acquire(0) for _ in range(6)))
+        return time.perf_counter() - start
+
+    # 20 requests per second, one at a time
+    assert asyncio.run(run()) >= 0.24
+    assert limiter.waited > 0
+
+
+def test_limiter_settles_reported_usage():
+    limiter = RateLimiter(RateLimits(tpm=600), burst=1 / 6)  # 100 tokens, 10 per second
+
+    async def run():
+        await limiter.acquire(100)
+        # the request used far less than reserved, the next one goes out at once
+        limiter.settle(100, 20)
+        start = time.perf_counter()
+        await limiter.acquire(60)
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) < 0.05
+
+
+def test_backoff():
+    limiter = RateLimiter(max_retries=2, base_delay=0.01)
+    assert limiter.backoff(0, 0.05) == 0.05
+    assert 0.01 <= limiter.backoff(1, None) <= 0.02
+    assert limiter.backoff(2, None) is None
+    assert limiter.throttled == 2
+
+
+def test_provider_honours_retry_after():
+    async def run():
+        async with StandInServer(rpm=600) as server, create_http_client() as http:
+            provider = OpenAIProvider(f"{server.url}/v1", http=http)
+            answers = await asyncio.gather(
+                *(provider.chat(model="m", messages=MESSAGES) for _ in range(8))
+            )
+            return answers, server, provider
+
+    answers, server, provider = asyncio.run(run())
+    assert [a["message"]["content"] for a in answers] == ["NEXT"] * 8
+    assert server.requests == 8
+    assert server.throttled > 0
+    assert provider.limiter.throttled == server.throttled
+
+
+def test_create_provider_limits():
+    provider = create_provider("gpt", env={"OPENAI_API_KEY": "sk-test"}, rpm=60)
+    assert provider.limiter.limits == RateLimits(rpm=60, tpm=200000)
+    asyncio.run(provider.aclose())
+
+
+def test_translator_keeps_running_with_provider(tmp_path):
+    from src.translator import Translator
+
+    rows = [[str(i), f"row {i} " + "x" * 4000] for i in range(25)]
+    (tmp_path / "in").mkdir()
+    with open(tmp_path / "in" / "a.csv", "w", encoding="utf-8", newline="") as fp:
+        csv.writer(fp).writerows(rows)
+
+    async def run():
+        async with StandInServer(rpm=6000) as server, create_http_client() as http:
+            translator = Translator(
+                model="m",
+                input_path=tmp_path / "in",
+                output_path=tmp_path / "out",
+                save=True,
+                concurrency=4,
+                token_estimate=True,
+                client=OpenAIProvider(
+                    f"{server.url}/v1",
+                    http=http,
+                    limiter=RateLimiter(RateLimits(rpm=6000), burst=1 / 3000),
+                ),
+            )
+            await translator.resume_translate_async()
+            translator.close()
+            return translator
+
+    # well past the 40000 token stop of the local model, the limiter paces instead
+    translator = asyncio.run(run())
+    assert not translator._token_limit_hit
+    with open(tmp_path / "out" / "a.csv", encoding="utf-8") as fp:
+        assert [row[2] for row in csv.reader(fp)] == [row[1].upper() for row in rows]
+
+
+def test_benchmark_paced_vs_unpaced():
+    requests = 30
+    results = {}
+
+    async def run(limiter):
+        async with StandInServer(rpm=1200) as server, create_http_client() as http:
+            provider = OpenAIProvider(f"{server.url}/v1", http=http, limiter=limiter)
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(provider.chat(model="m", messages=MESSAGES) for _ in range(requests))
+            )
+            return time.perf_counter() - start, server.throttled
+
+    results["unpaced"] = asyncio.run(run(RateLimiter(max_retries=50)))
+    results["paced"] = asyncio.run(
+        run(RateLimiter(RateLimits(rpm=1200), burst=1 / 1200))
+    )
+
+    logger.info(
+        f"{requests} requests against a 20 rps server: "
+        + ", ".join(
+            f"{name} {elapsed:.2f}s with {throttled} throttled"
+            for name, (elapsed, throttled) in results.items()
+        )
+    )
+    assert results["paced"][1] < results["unpaced"][1]
+
+
+def test_provider_out_of_retries():
+    async def run():
+        async with StandInServer(rpm=1) as server, create_http_client() as http:
+            provider = OpenAIProvider(
+                f"{server.url}/v1",
+                http=http,
+                limiter=RateLimiter(RateLimits(tpm=600), max_retries=0),
+            )
+            # the stand-in allows a burst of two
+            for _ in range(2):
+                await provider.chat(model="m", messages=MESSAGES)
+            with pytest.raises(httpx.HTTPStatusError) as error:
+                await provider.chat(model="m", messages=MESSAGES)
+            return error.value.response
+
+    response = asyncio.run(run())
+    assert response.status_code == 429
+    assert "Rate limit" in response.json()["error"]["message"]
+
+
+def test_failed_connection_returns_reserved_tokens():
+    async def run():
+        async with create_http_client() as http:
+            # nothing listens on the discard port
+            provider = OpenAIProvider(
+                "http://127.0.0.1:9/v1",
+                http=http,
+                limiter=RateLimiter(RateLimits(tpm=600), max_retries=0),
+            )
+            with pytest.raises(httpx.TransportError):
+                await provider.chat(model="m", messages=MESSAGES)
+            return provider.limiter
+
+    limiter = asyncio.run(run())
+    assert limiter._tokens.level == pytest.approx(60, abs=1)
+
+
+def test_rejected_request_returns_reserved_tokens():
+    async def run():
+        async with StandInServer() as server, create_http_client() as http:
+            # no route, the stand-in answers 404 which is not retried
+            provider = OpenAIProvider(
+                f"{server.url}/v2",
+                http=http,
+                limiter=RateLimiter(RateLimits(tpm=600)),
+            )
+            with pytest.raises(httpx.HTTPStatusError) as error:
+                await provider.chat(model="m", messages=MESSAGES)
+            return provider.limiter, error.value.response
+
+    limiter, response = asyncio.run(run())
+    assert response.status_code == 404
+    assert limiter._tokens.level == pytest.approx(60, abs=1)
@@ -0,0 +1,230 @@
+import asyncio
+import csv
+import time
+from contextlib import aclosing
+
+from loguru import logger
+
+from src.providers import OllamaProvider, OpenAIProvider, create_http_client
+from src.response_stream import ResponseStream
+from src.stand_in_server import StandInServer, stand_in_reply
+from src.translation_engine import TranslationEngine, extract_translation, parse_batch
+
+THOUGHT = "<think>\nNext is a button, 继续.\n</think>\n\n继续"
+
+
+def _feed(reader: ResponseStream, response: str, size: int) -> int:
+    """Feed response in pieces of size chars, returns the pieces read"""
+    for read, start in enumerate(range(0, len(response), size), start=1):
+        if not reader.feed(response[start : start + size]):
+            return read
+    return read
+
+
+def test_thinking_dropped_across_chunks():
+    for size in range(1, 12):
+        reader = ResponseStream("Next")
+        _feed(reader, THOUGHT, size)
+        assert extract_translation(reader.response) == "继续"
+        assert reader.think_chars == len("\nNext is a button, 继续.\n")
+        assert "button" not in reader.response
+
+    reader = ResponseStream("Next")
+    _feed(reader, "继续 <thin", 3)
+    # an unfinished tag at the end of the stream stays in the answer
+    assert reader.response == "继续 "
+    assert not reader.complete
+
+
+def test_batch_stops_when_complete():
+    response = "<think>hm</think>@@1@@\n继续\n@@2@@\n离开\n@@1@@\n继续继续\n@@2@@\n"
+    reader = ResponseStream("Next\nLeave", rows=2)
+    read = _feed(reader, response, 2)
+
+    assert reader.complete
+    assert read < len(response) // 2
+    assert parse_batch(reader.response, 2) == {1: "继续", 2: "离开"}
+
+    # a marker past the batch before every row is in does not end it
+    reader = ResponseStream("Next\nLeave", rows=2)
+    _feed(reader, "@@1@@\n继续\n@@3@@\n?\n@@2@@\n离开\n", 4)
+    assert not reader.complete
+
+
+def test_runaway_is_cut_off():
+    reader = ResponseStream("Next", max_ratio=4, slack=100)
+    read = _feed(reader, "<think>hm</think>" + "继续 " * 1000, 10)
+
+    assert reader.runaway
+    # 116 answer chars allowed, of 3000
+    assert read == 14
+
+    reader = ResponseStream("Next", max_think_chars=1000)
+    read = _feed(reader, "<think>" + "hmm " * 1000, 10)
+
+    assert reader.runaway
+    assert read == 101
+
+
+def test_long_thinking_is_not_a_runaway():
+    # thinking does not scale with the row, it has a budget of its own
+    reader = ResponseStream("Next", max_ratio=4, slack=100)
+    _feed(reader, "<think>" + "hmm " * 4000 + "</think>继续", 10)
+
+    assert not reader.runaway
+    assert extract_translation(reader.response) == "继续"
+
+
+def _loop_reply(content: str) -> str:
+    if content.endswith("Loop"):
+        return "<think>" + "wait, " * 6000 + "</think>循环"
+    return "<think>ok</think>" + stand_in_reply(content)
+
+
+def test_providers_stream():
+    async def read(provider):
+        chunks = await provider.chat(
+            model="m",
+            messages=[{"role": "user", "content": "Translate:\nNext"}],
+            stream=True,
+        )
+        async with aclosing(chunks):
+            return [chunk["message"]["content"] async for chunk in chunks]
+
+    async def run():
+        async with (
+            StandInServer(reply=_loop_reply, piece_chars=4) as server,
+            create_http_client() as http,
+        ):
+            pieces = [
+                await read(OpenAIProvider(f"{server.url}/v1", http=http)),
+                await read(OllamaProvider(server.url, http=http)),
+            ]
+            return pieces
+
+    for pieces in asyncio.run(run()):
+        assert len(pieces) > 1
+        assert "".join(pieces) == "<think>ok</think>NEXT"
+
+
+def test_engine_stream_cuts_runaway():
+    texts = ["Next", "Loop", "Leave"]
+
+    async def run():
+        async with (
+            StandInServer(reply=_loop_reply, piece_latency=0.001) as server,
+            create_http_client() as http,
+        ):
+            engine = TranslationEngine(
+                prompt="Translate:\n",
+                concurrency=3,
+                client=OpenAIProvider(f"{server.url}/v1", http=http),
+                stream=True,
+            )
+            async with aclosing(engine.translate_ordered(texts)) as results:
+                translations = [item async for item in results]
+            # the server notices the closed stream at its next piece
+            await asyncio.sleep(0.05)
+            return translations, engine, server
+
+    translations, engine, server = asyncio.run(run())
+    # the runaway row is not translated
+    assert translations == [(0, "NEXT"), (1, None), (2, "LEAVE")]
+    assert engine.runaways == 1
+    assert engine.think_chars > 0
+    assert server.streams_cut == 1
+
+
+def test_translator_stream(tmp_path, monkeypatch):
+    import src.translator as translator_module
+    from src.translator import Translator
+
+    closed = []
+
+    def chat(model, messages, stream=False):
+        def pieces():
+            try:
+                text = messages[-1]["content"].rsplit("\n", 1)[-1]
+                response = _loop_reply(text)
+                for start in range(0, len(response), 5):
+                    yield {"message": {"content": response[start : start + 5]}}
+            finally:
+                closed.append(text)
+
+        return pieces()
+
+    monkeypatch.setattr(translator_module, "chat", chat)
+    translator = Translator(input_path=tmp_path, token_estimate=True, stream=True)
+
+    assert translator.use_qwen("Next") == "NEXT"
+    assert translator.use_qwen("Loop") is None
+    assert closed == ["Next", "Loop"]
+    translator.close()
+
+
+def test_benchmark_stream_runaway_latency():
+    texts = ["Next", "Loop", "Leave", "Stay"]
+    timings = {}
+
+    async def run(stream):
+        async with (
+            StandInServer(
+                reply=_loop_reply, piece_chars=32, piece_latency=0.001
+            ) as server,
+            create_http_client() as http,
+        ):
+            engine = TranslationEngine(
+                prompt="Translate:\n",
+                concurrency=4,
+                client=OpenAIProvider(f"{server.url}/v1", http=http),
+                stream=stream,
+                max_think_chars=4096,
+            )
+            start = time.perf_counter()
+            async with aclosing(engine.translate_ordered(texts)) as results:
+                assert len([item async for item in results]) == len(texts)
+            return time.perf_counter() - start
+
+    for stream in (False, True):
+        timings["streamed" if stream else "whole"] = asyncio.run(run(stream))
+
+    logger.info(
+        "4 rows, one of them thinking in a loop for 36000 chars, 4096 allowed: "
+        + ", ".join(f"{k} {v * 1000:.0f}ms" for k, v in timings.items())
+    )
+    assert timings["streamed"] < timings["whole"] / 2
+
+
+def test_translator_does_not_write_runaway(tmp_path):
+    from src.translator import Translator
+
+    (tmp_path / "in").mkdir()
+    with open(tmp_path / "in" / "a.csv", "w", encoding="utf-8", newline="") as fp:
+        csv.writer(fp).writerows([["0", "Next"], ["1", "Loop"], ["2", "Leave"]])
+    with open(tmp_path / "in" / "b.csv", "w", encoding="utf-8", newline="") as fp:
+        csv.writer(fp).writerows([["0", "Stay"], ["1", "Leave"]])
+
+    async def run():
+        async with (
+            StandInServer(reply=_loop_reply) as server,
+            create_http_client() as http,
+        ):
+            translator = Translator(
+                model="m",
+                input_path=tmp_path / "in",
+                output_path=tmp_path / "out",
+                save=True,
+                token_estimate=True,
+                client=OpenAIProvider(f"{server.url}/v1", http=http),
+                stream=True,
+            )
+            await translator.resume_translate_async()
+            translator.close()
+
+    asyncio.run(run())
+    # the output stays a prefix of the input, resume sends the runaway row again
+    with open(tmp_path / "out" / "a.csv", encoding="utf-8") as fp:
+        assert list(csv.reader(fp)) == [["0", "Next", "NEXT"]]
+    # the runaway row of a.csv does not hold back b.csv
+    with open(tmp_path / "out" / "b.csv", encoding="utf-8") as fp:
+        assert list(csv.reader(fp)) == [["0", "Stay", "STAY"], ["1", "Leave", "LEAVE"]]
@@ -0,0 +1,139 @@
+import asyncio
+import csv
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from src.revision_diff import (
+    RevisionDelta,
+    RevisionDiff,
+    default_line_flags,
+    load_line_flags,
+)
+
+
+def _git(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@t", *args],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def _commit(repo: Path, files: dict, message: str) -> str:
+    for name, content in files.items():
+        file_path = repo / name
+        if content is None:
+            file_path.unlink()
+            continue
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(content, encoding="utf-8")
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", message)
+    return _git(repo, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def game_repo(tmp_path):
+    repo = tmp_path / "game-repo"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    old = _commit(
+        repo,
+        {
+            "game/loc-home/home.twee": ":: Home\nYou are at home.\n<<set $x to 1>>\nThe bed is soft.\n",
+            "game/loc-home/gone.twee": ":: Gone\nThis passage goes away.\n",
+            "game/loc-street/street.twee": ":: Street\nCars pass by.\n",
+            "game/04-Variables/shop.js": 'const a = "Buy it";\n',
+            "readme.md": "readme\n",
+        },
+        "old",
+    )
+    new = _commit(
+        repo,
+        {
+            "game/loc-home/home.twee": ":: Home\nYou are at home.\n<<set $x to 2>>\nThe bed is very soft.\nA cat sleeps.\n",
+            "game/loc-home/gone.twee": None,
+            "game/04-Variables/shop.js": 'const a = "Buy it";\nconst b = "Sell it";\n',
+            "readme.md": "readme changed\n",
+        },
+        "new",
+    )
+    return repo, old, new
+
+
+def test_revision_diff(tmp_path, game_repo):
+    repo, old, new = game_repo
+    raw = tmp_path / "raw"
+    (raw / "loc-home").mkdir(parents=True)
+    (raw / "04-Variables").mkdir(parents=True)
+    (raw / "loc-home" / "home.csv").write_text(
+        "2,You are at home.\n4,The bed is soft.\n", encoding="utf-8"
+    )
+    (raw / "04-Variables" / "shop.csv").write_text('1,"const a = ""Buy it"";"\n')
+
+    differ = RevisionDiff(
+        repo, old, new, raw, tmp_path / "delta", updated_raw_path=tmp_path / "updated"
+    )
+    assert asyncio.run(differ.changed_files()) == [
+        Path("04-Variables/shop.js"),
+        Path("loc-home/gone.twee"),
+        Path("loc-home/home.twee"),
+    ]
+    deltas = asyncio.run(differ.create_delta())
+
+    assert deltas == [
+        RevisionDelta(Path("04-Variables/shop.js"), 2, 1, False),
+        RevisionDelta(Path("loc-home/gone.twee"), 0, 0, True),
+        RevisionDelta(Path("loc-home/home.twee"), 3, 2, False),
+    ]
+    home = list(csv.reader(open(tmp_path / "delta" / "loc-home" / "home.csv")))
+    assert home == [["4", "The bed is very soft."], ["5", "A cat sleeps."]]
+    shop = list(csv.reader(open(tmp_path / "delta" / "04-Variables" / "shop.csv")))
+    assert shop == [["2", 'const b = "Sell it";']]
+    # unchanged files are not extracted at all
+    assert not (tmp_path / "delta" / "loc-street").exists()
+    assert (tmp_path / "updated" / "loc-home" / "home.csv").is_file()
+
+
+def test_revision_diff_lists(tmp_path, game_repo):
+    repo, old, new = game_repo
+    differ = RevisionDiff(
+        repo,
+        old,
+        new,
+        tmp_path / "raw",
+        tmp_path / "delta",
+        blacklist=["loc-home\\gone.twee"],
+        whitelist=[],
+    )
+    assert asyncio.run(differ.changed_files()) == [Path("loc-home/home.twee")]
+
+
+def test_revision_diff_unknown_revision(tmp_path, game_repo):
+    repo, old, _ = game_repo
+    differ = RevisionDiff(repo, old, "no-such-tag", tmp_path / "raw", tmp_path / "d")
+    with pytest.raises(RuntimeError):
+        asyncio.run(differ.changed_files())
+
+
+def test_default_line_flags():
+    lines = [":: Passage", "", "/* note */", "<<set $a to 1>>", "Hello there.", "..."]
+    assert default_line_flags(Path("a.twee"), lines) == [
+        False,
+        False,
+        False,
+        False,
+        True,
+        False,
+    ]
+
+
+def test_load_line_flags():
+    assert load_line_flags("src.revision_diff:default_line_flags") is default_line_flags
+    with pytest.raises(ValueError):
+        load_line_flags("src.revision_diff")
+    with pytest.raises(TypeError):
+        load_line_flags("src.revision_diff:GAME_SUFFIXES")
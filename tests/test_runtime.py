@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from src.differentiator import Differentiator
+from src.merger import Merger
+from src.runtime import Runtime
+from tests.test_diff import _tree_outputs, _write_tree
+
+
+def test_runtime_lifecycle():
+    runtime = Runtime(max_workers=2)
+    with pytest.raises(RuntimeError):
+        runtime.executor
+
+    async def main(runtime: Runtime):
+        async with runtime.stage("Square"):
+            # the shared pool is the default executor of the loop too
+            loop = asyncio.get_running_loop()
+            squared = await loop.run_in_executor(None, pow, 3, 2)
+        return squared + await runtime.run_in_thread(pow, 2, 3)
+
+    assert runtime.run(main) == 17
+    # pools are closed after the run
+    with pytest.raises(RuntimeError):
+        runtime.executor
+
+
+def test_runtime_shared_by_stages(tmp_path):
+    _write_tree(tmp_path / "translated", 4, 100, translated=True)
+    _write_tree(tmp_path / "raw", 4, 100, translated=False)
+
+    expected = Differentiator(
+        tmp_path / "translated", tmp_path / "raw", tmp_path / "expected"
+    )
+    asyncio.run(expected.create_diff())
+    expected.close()
+
+    async def main(runtime: Runtime):
+        # two process backed runs in one pool, each with its own translation memory
+        for name, memory in (("first", False), ("second", True)):
+            differ = Differentiator(
+                tmp_path / "translated",
+                tmp_path / "raw",
+                tmp_path / name,
+                backend="process",
+                translation_memory=memory,
+                autofill_path=tmp_path / f"{name}-autofill" if memory else None,
+                runtime=runtime,
+            )
+            assert await differ.create_diff() == 4
+            assert await differ.count_diff_rows() > 0
+        merger = Merger(tmp_path / "translated", tmp_path / "raw", runtime)
+        assert await merger.merge_translates() == 4
+        return runtime.process_pool
+
+    pool = Runtime(max_workers=2, max_processes=2).run(main)
+    assert _tree_outputs(tmp_path / "first") == _tree_outputs(tmp_path / "expected")
+    assert _tree_outputs(tmp_path / "second") != _tree_outputs(tmp_path / "first")
+    with pytest.raises(RuntimeError):
+        # shut down with the runtime
+        pool.submit(pow, 2, 2)
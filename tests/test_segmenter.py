@@ -0,0 +1,27 @@
+from src.segmenter import SegmentChange, diff_segments, split_segments
+
+
+def test_split_segments():
+    text = (
+        'You smile. <<if $x.y is 1>>He nods.<</if>> She says "Go!" and leaves.<br>'
+        '[[Next.|Room]] <span class="red">Done.</span>'
+    )
+    segments = [text[start:end] for start, end in split_segments(text)]
+
+    assert "".join(segments) == text
+    assert segments[0] == "You smile. "
+    # punctuation inside macros, links and tags never splits them
+    assert any("<<if $x.y is 1>>" in segment for segment in segments)
+    assert any("[[Next.|Room]]" in segment for segment in segments)
+    assert segments[-2].endswith("<br>")
+
+
+def test_diff_segments():
+    old_spans, new_spans, changes = diff_segments(
+        "A one. B two. C three.", "A one.  B two changed. C three. D four."
+    )
+    assert len(old_spans) == 3 and len(new_spans) == 4
+    assert changes == [
+        SegmentChange("replace", (1, 2), (1, 2)),
+        SegmentChange("insert", (3, 3), (3, 4)),
+    ]
@@ -0,0 +1,58 @@
+import time
+
+from loguru import logger
+
+from src.token_counter import TokenCounter, estimate_tokens
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("Next") == 1
+    assert estimate_tokens("Hello there, how are you?") == 7
+    # one token per CJK char
+    assert estimate_tokens("你好，世界") == 5
+    assert estimate_tokens("继续 Next") == 4
+
+
+def test_estimate_mode_never_loads_tokenizer():
+    counter = TokenCounter("no/such-tokenizer", estimate=True)
+
+    assert counter.count("Hello there, how are you?") == 7
+    assert counter.count("Hello there, how are you?") == 7
+    assert counter._tokenizer is None
+    assert counter.cache_info().hits == 1
+
+
+class FakeTokenizer:
+    def __init__(self):
+        self.calls = 0
+
+    def tokenize(self, text):
+        self.calls += 1
+        return text.split()
+
+
+def test_count_is_memoised():
+    counter = TokenCounter(cache_size=2)
+    counter._tokenizer = FakeTokenizer()
+
+    assert [counter.count(t) for t in ["a b", "a b", "c", "a b", "d e f"]] == [
+        2,
+        2,
+        1,
+        2,
+        3,
+    ]
+    assert counter._tokenizer.calls == 3
+
+
+def test_benchmark_translator_startup(tmp_path):
+    start = time.perf_counter()
+    from src.translator import Translator
+
+    translator = Translator(input_path=tmp_path, output_path=tmp_path / "out")
+    elapsed = time.perf_counter() - start
+    translator.close()
+
+    logger.info(f"Translator import and start in {elapsed * 1000:.1f}ms")
+    assert elapsed < 1
@@ -0,0 +1,121 @@
+import asyncio
+
+from src.translation_cache import TranslationCache, normalize_source
+from src.translation_engine import TranslationEngine
+from tests.test_translation_engine import FakeClient
+
+
+def test_normalize_source():
+    assert normalize_source('\ufeff  Say ""hi"",\n  then  leave. ') == (
+        'Say "hi", then leave.'
+    )
+
+
+def test_cache_roundtrip(tmp_path):
+    db_file = tmp_path / "cache" / "mt.sqlite3"
+    with TranslationCache(db_file, "qwen3:8b", "P:") as cache:
+        assert cache.get("Next") is None
+        cache.put("Next", "继续")
+        cache.put_many([("Leave", "离开"), ("Leave", "走开")])
+
+        assert cache.get(" Next ") == "继续"
+        # a newer translation replaces the old one
+        assert cache.get("Leave") == "走开"
+        assert len(cache) == 2
+        assert tuple(cache.stats) == (2, 1, 2)
+        assert cache.stats.hit_rate == 2 / 3
+
+    # persisted, scoped to model and prompt
+    with TranslationCache(db_file, "qwen3:8b", "P:") as cache:
+        assert cache.get("Next") == "继续"
+    with TranslationCache(db_file, "qwen3:14b", "P:") as cache:
+        assert cache.get("Next") is None
+    with TranslationCache(db_file, "qwen3:8b", "Q:") as cache:
+        assert cache.get("Next") is None
+
+
+def test_engine_uses_cache(tmp_path):
+    texts = ["Next", "Leave", "Next", "Stay", "Leave", "Next"]
+    with TranslationCache(tmp_path / "mt.sqlite3", "m", "P:") as cache:
+        client = FakeClient(latency=0.001)
+        engine = TranslationEngine(model="m", prompt="P:", client=client, cache=cache)
+
+        async def run():
+            return [item async for item in engine.translate_ordered(texts)]
+
+        assert asyncio.run(run()) == [(i, text.upper()) for i, text in enumerate(texts)]
+        # translate_ordered runs ahead, repeats still in flight are sent again
+        first_run = client.calls
+        assert first_run <= len(texts)
+
+        # a second run is answered from the cache only
+        client = FakeClient(latency=0.001)
+        engine = TranslationEngine(
+            model="m", prompt="P:", client=client, cache=cache, batch_rows=4
+        )
+        assert asyncio.run(run()) == [(i, text.upper()) for i, text in enumerate(texts)]
+        assert client.calls == 0
+        assert cache.stats.writes == first_run
+
+
+def test_engine_batch_cache(tmp_path):
+    with TranslationCache(tmp_path / "mt.sqlite3", "m", "P:") as cache:
+        cache.put("row 1", "cached 1")
+        cache.put("row 2", "cached 2")
+        client = FakeClient(latency=0.001, drop={"row 3"})
+        engine = TranslationEngine(
+            model="m", prompt="P:", client=client, cache=cache, batch_rows=8
+        )
+
+        results = asyncio.run(engine.translate_batch([f"row {i}" for i in range(5)]))
+
+        assert results == ["ROW 0", "cached 1", "cached 2", "ROW 3", "ROW 4"]
+        # one batch of the 3 uncached rows, the dropped row alone
+        assert client.calls == 2
+        # failed rows are not cached, answered rows are
+        assert cache.get("row 4") == "ROW 4"
+        assert cache.get("row 3") == "ROW 3"
+
+
+def test_translator_looks_rows_up_once(tmp_path, monkeypatch):
+    import csv
+
+    from src.translator import Translator
+
+    texts = ["Next", "Leave", "Stay"]
+    (tmp_path / "in").mkdir()
+    with open(tmp_path / "in" / "a.csv", "w", encoding="utf-8", newline="") as fp:
+        csv.writer(fp).writerows([[str(i), text] for i, text in enumerate(texts)])
+
+    client = FakeClient(latency=0.001)
+    translator = Translator(
+        model="m",
+        input_path=tmp_path / "in",
+        output_path=tmp_path / "out",
+        save=True,
+        cache_path=tmp_path / "mt.sqlite3",
+        token_estimate=True,
+        client=client,
+    )
+    cache = translator._cache
+    cache.put("Leave", "离开")
+    lookups = []
+    select = cache._select
+    monkeypatch.setattr(
+        cache, "_select", lambda key: lookups.append(key) or select(key)
+    )
+    asyncio.run(translator.resume_translate_async())
+    stats = cache.stats
+    translator.close()
+
+    # one get per row, the hit is not sent, the misses are not looked up again
+    assert len(lookups) == 3
+    assert (stats.hits, stats.misses) == (1, 2)
+    assert client.calls == 2
+    with open(tmp_path / "out" / "a.csv", encoding="utf-8") as fp:
+        # the fake client upper-cases the whole prompt, its last line is the row
+        assert [row[2].rsplit("\n", 1)[-1] for row in csv.reader(fp)] == [
+            "NEXT",
+            "离开",
+            "STAY",
+        ]
@@ -0,0 +1,197 @@
+import asyncio
+import random
+import time
+from contextlib import aclosing
+
+from loguru import logger
+
+from src.translation_engine import (
+    TranslationEngine,
+    extract_translation,
+    format_batch,
+    parse_batch,
+)
+
+
+class FakeClient:
+    """
+    Answers like an Ollama server with parallel slots, the translation is the upper-cased row.
+    Batch requests are answered row by row, rows in drop are left out of batch answers
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.01,
+        jitter: float = 0.0,
+        fail: str = None,
+        drop: set = (),
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail = fail
+        self.drop = set(drop)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+
+    async def chat(self, model, messages):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+            content = messages[-1]["content"]
+            if "@@1@@" in content:
+                rows = parse_batch(content, len(content))
+                kept = [
+                    f"@@{n}@@\n{text.upper()}"
+                    for n, text in rows.items()
+                    if text not in self.drop
+                ]
+                return {"message": {"content": "<think>hm</think>" + "\n".join(kept)}}
+            text = content.removeprefix("P:")
+            if text == self.fail:
+                raise ConnectionError("server gone")
+            return {"message": {"content": f"<think>hm</think>{text.upper()}"}}
+        finally:
+            self.in_flight -= 1
+
+
+def _translate_all(engine: TranslationEngine, texts):
+    async def run():
+        return [item async for item in engine.translate_ordered(texts)]
+
+    return asyncio.run(run())
+
+
+def test_translate_ordered():
+    client = FakeClient(latency=0.001, jitter=0.01)
+    engine = TranslationEngine(prompt="P:", concurrency=4, client=client)
+    texts = [f"row {i}" for i in range(50)]
+
+    results = _translate_all(engine, texts)
+
+    # finished out of order, yielded in order
+    assert results == [(i, f"ROW {i}") for i in range(50)]
+    assert client.max_in_flight == 4
+
+
+def test_translate_failure_keeps_input():
+    engine = TranslationEngine(
+        prompt="P:", concurrency=2, client=FakeClient(fail="bad")
+    )
+    assert _translate_all(engine, ["ok", "bad", "fine"]) == [
+        (0, "OK"),
+        (1, "bad"),
+        (2, "FINE"),
+    ]
+
+
+def test_translate_ordered_stops_early():
+    client = FakeClient(latency=0.01)
+    engine = TranslationEngine(prompt="P:", concurrency=2, window=4, client=client)
+
+    async def run():
+        async with aclosing(engine.translate_ordered(f"{i}" for i in range(100))) as it:
+            async for index, _ in it:
+                if index == 3:
+                    break
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    # only the window was sent, nothing is left running
+    assert client.calls <= 8
+    assert client.in_flight == 0
+
+
+def test_parse_batch():
+    texts = ["Hello.", "Two\nlines", "<<link [[Next|Home]]>>"]
+    request = format_batch(texts)
+    assert parse_batch(request, 3) == {1: "Hello.", 2: "Two\nlines", 3: texts[2]}
+
+    # out of range, repeated and empty rows are left out
+    response = (
+        "<think>@@1@@</think>\n@@1@@\n一\n@@2@@\n\n@@3@@\n三\n@@3@@\n三\n@@9@@\n九"
+    )
+    assert parse_batch(response, 3) == {1: "一"}
+
+
+def test_translate_batches():
+    client = FakeClient(latency=0.001, jitter=0.005)
+    engine = TranslationEngine(
+        prompt="P:", concurrency=2, client=client, batch_rows=8, batch_tokens=1000
+    )
+    texts = [f"row {i}" for i in range(50)]
+
+    assert _translate_all(engine, texts) == [(i, f"ROW {i}") for i in range(50)]
+    # 7 batches instead of 50 requests
+    assert engine.requests == client.calls == 7
+    assert engine.retried_rows == 0
+
+
+def test_translate_batch_retries_missing_rows():
+    client = FakeClient(latency=0.001, drop={"row 3", "row 5"})
+    engine = TranslationEngine(prompt="P:", client=client, batch_rows=10)
+
+    assert _translate_all(engine, [f"row {i}" for i in range(10)]) == [
+        (i, f"ROW {i}") for i in range(10)
+    ]
+    # one batch, one retry batch of the 2 missing rows, then one request per row
+    assert client.calls == 4
+    assert engine.retried_rows == 4
+
+
+def test_batch_token_budget():
+    engine = TranslationEngine(
+        prompt="P:", batch_rows=10, batch_tokens=10, count_tokens=len
+    )
+    batches = list(engine._batches(["aaaa", "bbbb", "cc", "a much longer row", "d"]))
+    assert [[index for index, _ in batch] for batch in batches] == [
+        [0, 1, 2],
+        [3],
+        [4],
+    ]
+
+
+def test_extract_translation():
+    assert extract_translation("<think>\nplan\n</think>\n\n你好") == "你好"
+    assert extract_translation("Sure!\n\n你好\n\n") == "你好"
+
+
+def test_benchmark_translation_concurrency():
+    texts = [f"row {i}" for i in range(40)]
+    timings = {}
+    for concurrency in (1, 4, 8):
+        engine = TranslationEngine(
+            prompt="P:", concurrency=concurrency, client=FakeClient(latency=0.01)
+        )
+        start = time.perf_counter()
+        _translate_all(engine, texts)
+        timings[concurrency] = time.perf_counter() - start
+
+    logger.info(
+        "40 rows at 10ms per request: "
+        + ", ".join(
+            f"concurrency {k} {len(texts) / v:.0f} rows/s" for k, v in timings.items()
+        )
+    )
+    assert timings[4] < timings[1] / 2
+
+
+def test_benchmark_batch_prompt_overhead():
+    prompt = "P:" * 500
+    texts = [f"row {i}" for i in range(200)]
+    sent = {}
+    for batch_rows in (1, 10, 25):
+        client = FakeClient(latency=0.001)
+        engine = TranslationEngine(
+            prompt=prompt, concurrency=4, client=client, batch_rows=batch_rows
+        )
+        _translate_all(engine, texts)
+        sent[batch_rows] = engine.requests * len(prompt)
+
+    logger.info(
+        f"{len(texts)} rows, {len(prompt)} char prompt: "
+        + ", ".join(f"batch {k} sends {v} prompt chars" for k, v in sent.items())
+    )
+    assert sent[10] * 10 == sent[1]
@@ -0,0 +1,145 @@
+import csv
+import time
+
+from loguru import logger
+
+from src.translation_journal import CHECKPOINT_SUFFIX, TranslationJournal
+
+
+def _write_padding(path, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as fp:
+        csv.writer(fp).writerows(rows)
+
+
+def test_journal_resume(tmp_path):
+    journal_file = tmp_path / "mt.jsonl"
+    with TranslationJournal(journal_file) as journal:
+        journal.append("a.csv", "1", "Next", "继续")
+        journal.append("a.csv", "2", "Leave", "离开")
+        journal.append("b/c.csv", "7", "Hi.", "嗨。")
+
+    # closed cleanly, nothing after the checkpoint
+    journal = TranslationJournal(journal_file)
+    assert journal.progress("a.csv").rows == 2
+    assert journal.verify("a.csv", ["Next", "Leave", "Stay"]) == 2
+    assert journal.verify("b/c.csv", ["Hi."]) == 1
+    assert journal.verify("d.csv", ["Hi."]) == 0
+
+    # crash: synced but no checkpoint, and a torn last line
+    journal.append("a.csv", "3", "Stay", "留下")
+    journal.sync()
+    with open(journal_file, "ab") as fp:
+        fp.write(b'{"file": "a.csv", "row_id": "4", "sou')
+
+    journal = TranslationJournal(journal_file)
+    assert journal.progress("a.csv").rows == 3
+    assert journal_file.read_bytes().endswith(b"\n")
+    journal.close()
+
+
+def test_journal_verify_changed_file(tmp_path):
+    with TranslationJournal(tmp_path / "mt.jsonl") as journal:
+        journal.append("a.csv", "1", "Next", "继续")
+        journal.append("a.csv", "2", "Leave", "离开")
+
+        # the diff was recreated, the journaled rows are not its leading rows any more
+        assert journal.verify("a.csv", ["Next", "Go away"]) == 0
+        assert journal.progress("a.csv").rows == 0
+
+    with TranslationJournal(tmp_path / "mt.jsonl") as journal:
+        assert journal.progress("a.csv").rows == 0
+
+
+def test_journal_materialize(tmp_path):
+    _write_padding(
+        tmp_path / "in" / "a.csv", [["1", "Next"], ["2", "Leave"], ["3", "Stay"]]
+    )
+    _write_padding(tmp_path / "in" / "b" / "c.csv", [["7", 'Say "hi"']])
+
+    with TranslationJournal(tmp_path / "mt.jsonl") as journal:
+        journal.append("a.csv", "1", "Next", "继续")
+        journal.append("a.csv", "2", "Leave", "离开, 走")
+        journal.append("b/c.csv", "7", 'Say "hi"', "说“嗨”")
+
+        assert journal.materialize(tmp_path / "in", tmp_path / "out") == 3
+
+    assert (tmp_path / "out" / "a.csv").read_bytes().decode("utf-8") == (
+        '1,Next,继续\r\n2,Leave,"离开, 走"\r\n'
+    )
+    with open(tmp_path / "out" / "b" / "c.csv", encoding="utf-8") as fp:
+        assert list(csv.reader(fp)) == [["7", 'Say "hi"', "说“嗨”"]]
+
+    # a later session only rewrites the files it journaled
+    (tmp_path / "out" / "b" / "c.csv").write_text("kept", encoding="utf-8")
+    with TranslationJournal(tmp_path / "mt.jsonl") as journal:
+        journal.append("a.csv", "3", "Stay", "留下")
+        assert journal.materialize(tmp_path / "in", tmp_path / "out") == 3
+    assert (tmp_path / "out" / "b" / "c.csv").read_text(encoding="utf-8") == "kept"
+
+
+def test_translator_journal(tmp_path, monkeypatch):
+    import src.translator as translator_module
+    from src.translator import Translator
+
+    sent = []
+
+    def chat(model, messages):
+        text = messages[-1]["content"].rsplit("\n", 1)[-1]
+        sent.append(text)
+        return {"message": {"content": text.upper()}}
+
+    monkeypatch.setattr(translator_module, "chat", chat)
+    rows = [["1", "Next"], ["2", "Leave"], ["3", "Stay"]]
+    _write_padding(tmp_path / "in" / "a.csv", rows)
+    journal_file = tmp_path / "mt.jsonl"
+
+    def run():
+        translator = Translator(
+            input_path=tmp_path / "in",
+            output_path=tmp_path / "out",
+            save=True,
+            token_estimate=True,
+            journal_path=journal_file,
+        )
+        translator.resume_translate()
+        translator.materialize()
+        translator.close()
+
+    # stop after the first row, like a crashed run
+    with TranslationJournal(journal_file) as journal:
+        journal.append("a.csv", "1", "Next", "NEXT")
+    run()
+
+    assert sent == ["Leave", "Stay"]
+    with open(tmp_path / "out" / "a.csv", encoding="utf-8") as fp:
+        assert list(csv.reader(fp)) == [row + [row[1].upper()] for row in rows]
+
+    # everything journaled, nothing is sent
+    run()
+    assert sent == ["Leave", "Stay"]
+
+
+def test_benchmark_journal_resume(tmp_path):
+    journal_file = tmp_path / "mt.jsonl"
+    rows = 50000
+    with TranslationJournal(journal_file) as journal:
+        for i in range(rows):
+            journal.append(f"file{i % 100}.csv", str(i), f"row {i}", f"译文 {i}")
+
+    start = time.perf_counter()
+    TranslationJournal(journal_file).close()
+    checkpointed = time.perf_counter() - start
+
+    (tmp_path / ("mt.jsonl" + CHECKPOINT_SUFFIX)).unlink()
+    start = time.perf_counter()
+    journal = TranslationJournal(journal_file)
+    full = time.perf_counter() - start
+    assert sum(journal.progress(f"file{i}.csv").rows for i in range(100)) == rows
+    journal.close()
+
+    logger.info(
+        f"Resume of a {rows} row journal: {checkpointed * 1000:.1f}ms from the checkpoint, "
+        f"{full * 1000:.1f}ms reading the whole journal"
+    )
+    assert checkpointed < full
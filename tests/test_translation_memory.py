@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.translation_memory import TextNormalizer, TranslationMemory
+
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=[0, 1, 2])
+
+
+def test_lookup():
+    memory = TranslationMemory().build(
+        [
+            _frame([[1, "Next", "下一步"], [2, "Leave", "离开"], [3, "Stay", None]]),
+            None,
+            _frame([[1, "Leave", "走开"], [2, "You walk home.", "你走回家。"]]),
+        ]
+    )
+
+    # untranslated rows are not indexed, the first translation wins
+    assert len(memory) == 3
+    assert memory.file_count == 3
+    result = memory.lookup(pd.Series(["Leave", "Stay", None, "You walk home.", "Run"]))
+    assert result.tolist() == ["离开", None, None, "你走回家。", None]
+
+
+def test_text_normalizer():
+    normalize = TextNormalizer()
+    texts = pd.Series(['\ufeffSay  ""hi""\tnow ', 'Say "hi" now', None])
+    keys = normalize(texts)
+    assert keys[0] == keys[1] == 'Say "hi" now'
+    assert pd.isna(keys[2])
+    assert TextNormalizer(collapse_whitespace=False)(texts)[0] == 'Say  "hi"\tnow'
+
+
+def test_normalized_lookup():
+    memory = TranslationMemory(TextNormalizer()).build(
+        [_frame([[1, "You  walk home. ", "你走回家。"]])]
+    )
+    assert memory.lookup(pd.Series(["You walk home.", "You walk"])).tolist() == [
+        "你走回家。",
+        None,
+    ]
+
+
+def test_lookup_collision(monkeypatch):
+    import src.translation_memory as translation_memory
+
+    # every text gets the same hash, only the collision check can tell them apart
+    monkeypatch.setattr(
+        translation_memory,
+        "hash_array",
+        lambda values, **kwargs: np.zeros(len(values), "uint64"),
+    )
+    memory = TranslationMemory().build([_frame([[1, "a", "A"], [2, "b", "B"]])])
+    assert memory.lookup(pd.Series(["b", "c", "a"])).tolist() == ["B", None, "A"]
+
+
+def test_benchmark_lookup():
+    texts = [f"You say line {i} to the crowd." for i in range(300000)]
+    frames = [
+        _frame([[i, text, f"译文 {i}"] for i, text in enumerate(texts[k::10])])
+        for k in range(10)
+    ]
+
+    start = time.perf_counter()
+    memory = TranslationMemory().build(frames)
+    build = time.perf_counter() - start
+
+    queries = pd.Series(texts[::3] + [f"New line {i}" for i in range(5000)])
+    start = time.perf_counter()
+    result = memory.lookup(queries)
+    lookup = time.perf_counter() - start
+
+    assert pd.notna(result).sum() == 100000
+    logger.info(
+        f"{len(memory)} strings: build {build * 1000:.2f}ms, "
+        f"lookup of {len(queries)} rows {lookup * 1000:.2f}ms"
+    )
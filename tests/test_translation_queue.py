@@ -0,0 +1,94 @@
+import csv
+
+from src.io_helper import IOHelper
+from src.translation_queue import Occurrence, PendingFile, TranslationQueue
+from src.translator import _QueueWriter
+
+
+def _queue():
+    queue = TranslationQueue()
+    queue.add_file(
+        PendingFile(
+            "a.csv", "out/a.csv", "w", [["1", "Next"], ["2", "Hi."], ["3", "Next"]]
+        )
+    )
+    queue.add_file(
+        PendingFile("b.csv", "out/b.csv", "a", [["7", " Next "], ["8", "Bye."]])
+    )
+    return queue
+
+
+def test_plan():
+    queue = _queue()
+
+    assert len(queue) == 3
+    assert queue.row_count == 5
+    assert queue.sources == ["Next", "Hi.", "Bye."]
+    assert queue.references[0] == [
+        Occurrence(0, 0),
+        Occurrence(0, 2),
+        Occurrence(1, 0),
+    ]
+
+
+def test_fan_out_in_order():
+    queue = _queue()
+
+    # rows wait for every row before them
+    assert queue.complete(2, "再见") == []
+    assert queue.complete(1, "嗨") == []
+    released = queue.complete(0, "继续")
+
+    assert [(file, row[0], text) for file, row, text in released] == [
+        (0, "1", "继续"),
+        (0, "2", "嗨"),
+        (0, "3", "继续"),
+        (1, "7", "继续"),
+        (1, "8", "再见"),
+    ]
+    # every occurrence is written, nothing is kept
+    assert queue._translations == {}
+
+
+def test_fan_out_partial():
+    queue = _queue()
+
+    released = queue.complete(0, "继续")
+
+    # the rest of a.csv waits for "Hi.", b.csv does not wait for a.csv
+    assert [(file, row[0]) for file, row, _ in released] == [(0, "1"), (1, "7")]
+    assert [(file, row[0]) for file, row, _ in queue.complete(1, "嗨")] == [
+        (0, "2"),
+        (0, "3"),
+    ]
+
+
+def test_untranslated_row_holds_back_its_file_only():
+    queue = TranslationQueue()
+    queue.add_file(
+        PendingFile("a.csv", "out/a.csv", "w", [["1", "Loop"], ["2", "Hi."]])
+    )
+    queue.add_file(
+        PendingFile("b.csv", "out/b.csv", "w", [["7", "Hi."], ["8", "Bye."]])
+    )
+
+    # "Loop" is never completed
+    assert [(file, row[0]) for file, row, _ in queue.complete(1, "嗨")] == [(1, "7")]
+    assert [(file, row[0]) for file, row, _ in queue.complete(2, "再见")] == [(1, "8")]
+
+
+def test_writer_appends_to_a_file_released_again(tmp_path):
+    queue = TranslationQueue()
+    a, b = str(tmp_path / "a.csv"), str(tmp_path / "b.csv")
+    queue.add_file(PendingFile("a.csv", a, "w", [["1", "Next"], ["2", "Hi."]]))
+    queue.add_file(PendingFile("b.csv", b, "w", [["7", "Next"]]))
+
+    with _QueueWriter(IOHelper(), queue, True) as writer:
+        writer.write(queue.complete(0, "继续"))
+        # a.csv again after b.csv, its first row is kept
+        writer.write(queue.complete(1, "嗨"))
+
+    with open(a, encoding="utf-8") as fp:
+        assert list(csv.reader(fp)) == [["1", "Next", "继续"], ["2", "Hi.", "嗨"]]
+    with open(b, encoding="utf-8") as fp:
+        assert list(csv.reader(fp)) == [["7", "Next", "继续"]]
@@ -0,0 +1,117 @@
+import re
+import time
+
+from loguru import logger
+
+from src.twee_parser import PREDICATES, TweeParser, predicate_set
+
+LINES = [
+    "",
+    "::Widgets waiting-room [widget]",
+    "/* comment */",
+    "--- ... ---",
+    'name_cap: "Red",',
+    '<span class="gold">Gold</span> coins',
+    "<label>Strength</label>",
+    'Your <input type="checkbox" value="yes"> choice',
+    '<<print either("You run", "You hide")>>',
+    '<<option "English" "en">>',
+    '<<button "Confirm">><</button>>',
+    "<<link [[Next|Street]]>><</link>>",
+    '<<link "Go home">><<set $home to 1>><</link>>',
+    "<<set $phase to 1>><<if $phase is 1>>",
+    "You walk along the street. The wind is cold.",
+]
+
+# patterns as they were written inline before the registry
+LEGACY = {
+    "json_line": r"^[\w\"]*\s*:\s*[ `\'/\$\.\w\":,\|\(\)\{\}\[\]]+,*$",
+    "tag_span": r"<span.*?>[\"\w\.\-+\$]",
+    "tag_input": r"<input.*?value=\"",
+    "widget_print": r"<<(?:print|=|-)\s[^<]*[\"\'`\w]+[\-\?\s\w\.\$,\'\"<>\[\]\(\)/]+(?:\)>>|\">>|\'>>|`>>|\]>>|>>)",
+    "widget_option": r"<<option\s\"",
+    "widget_button": r"<<button ",
+    "widget_link": r"<<link\s*(\[\[|\"\w|`\w|\'\w|\"\(|`\(|\'\(|_\w|`)",
+    "widget_high_rate_link": r"<<link \[\[(Next\||Next\s\||Leave\||Refuse\||Return\||Resume\||Confirm\||Continue\||Stop\||Phase\|)",
+}
+
+
+def test_predicates_match_legacy():
+    for line in LINES:
+        for name, pattern in LEGACY.items():
+            predicate = getattr(TweeParser, f"is_{name}")
+            assert predicate(line) == bool(re.search(pattern, line)), (name, line)
+
+        assert TweeParser.is_tag_label(line) == bool(
+            re.search(r"<label>[\w\-+]", line) or re.search(r"\w</label>", line)
+        )
+        assert TweeParser.is_only_marks(line) == (not re.search(r"[A-Za-z\d]", line))
+
+
+def test_predicate_set():
+    names = tuple(PREDICATES)
+    combined = predicate_set(*names)
+    assert predicate_set(*names) is combined
+
+    for line in LINES:
+        answers = combined.evaluate(line)
+        for name in names:
+            assert answers[name] == getattr(TweeParser, f"is_{name}")(line)
+        assert combined.any(line) == any(answers.values())
+
+
+def test_benchmark_predicates():
+    lines = LINES * 1000
+
+    for name in PREDICATES:
+        pattern = LEGACY.get(name)
+        predicate = getattr(TweeParser, f"is_{name}")
+
+        start = time.perf_counter()
+        for line in lines:
+            predicate(line)
+        compiled = time.perf_counter() - start
+
+        if pattern is None:
+            logger.info(f"is_{name}: compiled {compiled * 1000:.2f}ms")
+            continue
+
+        start = time.perf_counter()
+        for line in lines:
+            re.search(pattern, line)
+        inline = time.perf_counter() - start
+        logger.info(
+            f"is_{name}: inline re.search {inline * 1000:.2f}ms, compiled {compiled * 1000:.2f}ms"
+        )
+
+
+def test_benchmark_predicate_set():
+    lines = LINES * 1000
+    names = ("tag_span", "tag_label", "widget_option", "widget_link", "widget_print")
+    combined = predicate_set(*names)
+
+    start = time.perf_counter()
+    for line in lines:
+        (
+            TweeParser.is_tag_span(line)
+            or TweeParser.is_tag_label(line)
+            or TweeParser.is_widget_option(line)
+            or TweeParser.is_widget_link(line)
+            or TweeParser.is_widget_print(line)
+        )
+    separate = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for line in lines:
+        combined.any(line)
+    any_pass = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for line in lines:
+        combined.evaluate(line)
+    evaluate_pass = time.perf_counter() - start
+
+    logger.info(
+        f"{len(names)} predicates: separate {separate * 1000:.2f}ms, "
+        f"any {any_pass * 1000:.2f}ms, evaluate {evaluate_pass * 1000:.2f}ms"
+    )